@@ -9,6 +9,25 @@ Get a list of countries with: nordvpn countries
 
 APPINDICATOR_ID = 'nordvpn-indicator'
 INTERVAL = 10
+# Status check interval (seconds) per connection state
+STATUS_INTERVALS = {'connecting': 1,
+                    'disconnecting': 1,
+                    'measuring': None,
+                    'connected': 30,
+                    'disconnected': 30,
+                    'default': INTERVAL}
+# Refresh the country catalogue once a day
+CATALOGUE_INTERVAL = 86400
+# Check the account expiry once a day...
+ACCOUNT_INTERVAL = 86400
+# ...and warn this number of days before it expires
+EXPIRY_WARN_DAYS = 7
+# Pause polling on battery below this percentage
+LOW_BATTERY = 20
+# Resolve the servers of the connection profiles every 10 minutes
+PROFILE_INTERVAL = 600
+# Read the NordVPN settings again every minute (changed outside the indicator)
+SETTINGS_INTERVAL = 60
 
 import gi
 gi.require_version('Gtk', '3.0')
@@ -19,74 +38,172 @@ try:
 except:
     gi.require_version('AyatanaAppIndicator3', '0.1')
     from gi.repository import AyatanaAppIndicator3 as AppIndicator3
-gi.require_version('Notify', '0.7')
 
-import subprocess
 import signal
-from threading import Event, Thread
-from gi.repository import Notify
-from os.path import abspath, dirname, join, exists
-from pathlib import Path
+from threading import Thread, Lock
+from gi.repository import GLib
+from os.path import abspath, dirname, join
 import re
-from os import makedirs
+import logging
 
 # Local modules
 from .login import NordVPNLogin
 from .connect import NordVPNConnect
 from .settings import NordVPNSettings
+from .meshnet import NordVPNMeshnet
+from .network import NetworkMonitor
+from .power import PowerMonitor
+from .scheduler import Scheduler
+from .icons import IconSet
+from .profiles import ProfileTargets, get_profiles, apply_profile
+from .verify import verify_connection, get_verification, clear_verification
+from .speedtest import run_speedtest
+from .geo import get_geo_index, get_nearest, update_location
+from .log import setup_logging, stop_logging
+from .notify import NotificationManager
+from .metrics import MetricsExporter, write_textfile, TEXTFILE_INTERVAL
+from .recorder import start_recording, stop_recording
+from .watchdog import get_watchdog
+from .singleflight import get_single_flight, get_api_bucket
+from .usage import UsageAccounting, USAGE_INTERVAL, format_bytes
+from .technology import CANDIDATES, get_network_identity, get_choice, apply_choice, \
+                        mark_degraded, check_speed, select_technology, cancel_measurement, \
+                        is_cancelled
+from .recent import get_ranked, get_favourites, get_last_server, add_connection, \
+                    rate_session, toggle_favourite
 from .nordvpn import is_loggedin, is_connected, get_fastest_server, \
                     has_account, load_order_page, get_account_info, \
                     get_status_info, get_connection_status, \
-                    nordvpn_connect, nordvpn_disconnect, rate_connection
+                    nordvpn_connect, nordvpn_disconnect, rate_connection, \
+                    set_online, get_countries, get_account_expiry_days, \
+                    get_status_dict, get_cities, set_killswitch, api_reachable, \
+                    get_settings_text, \
+                    cache_path
+from .config import get_config, conf_path
 
-# i18n: http://docs.python.org/3/library/gettext.html
-import gettext
-_ = gettext.translation(APPINDICATOR_ID, fallback=True).gettext
+# i18n: shared catalogue
+from .i18n import _, N_
+
+logger = logging.getLogger(__name__)
 
 
 class NordVPNIndicator():
-    def __init__(self):
+    def __init__(self, system_bus_address=None):
         """
         Provides tray icon with menu and checks
-        every INTERVAL for changes in the connection.
+        periodically (STATUS_INTERVALS) for changes in the connection.
+        system_bus_address: private bus instead of the system bus (soak test)
         """
         # Save current directory
         self.script_dir = abspath(dirname(__file__))
         # Translations (used in multiple functions)
-        self.order_text = _('Get a NordVPN account')
+        # Marked with N_ and translated with _ when shown
+        self.order_text = N_('Get a NordVPN account')
         self.connections = {
-            'connecting': {'label': _('Quick connect'), 'icon': join(self.script_dir, 'connecting.svg')},
-            'disconnecting': {'label': _('Quick connect'), 'icon': join(self.script_dir, 'connecting.svg')},
-            'connected': {'label': _('Disconnect'), 'icon': join(self.script_dir, 'connected.svg')},
-            'disconnected': {'label': _('Quick connect'), 'icon': join(self.script_dir, 'disconnected.svg')},
-            'no_internet': {'label': _('Quick connect'), 'icon': join(self.script_dir, 'connecting.svg')}
+            'connecting': {'label': N_('Quick connect'), 'icon': join(self.script_dir, 'connecting.svg')},
+            'disconnecting': {'label': N_('Quick connect'), 'icon': join(self.script_dir, 'connecting.svg')},
+            'measuring': {'label': N_('Stop measuring'), 'icon': join(self.script_dir, 'connecting.svg')},
+            'connected': {'label': N_('Disconnect'), 'icon': join(self.script_dir, 'connected.svg')},
+            'disconnected': {'label': N_('Quick connect'), 'icon': join(self.script_dir, 'disconnected.svg')},
+            'no_internet': {'label': N_('Quick connect'), 'icon': join(self.script_dir, 'connecting.svg')},
+            'unresponsive': {'label': N_('NordVPN daemon is not responding'), 'icon': join(self.script_dir, 'unresponsive.svg')}
         }
-        self.manual_connect_text = _('Manual connect')
-        self.status_text = _('Status Information')
-        self.rate_text = _('Rate last connection')
-        self.poor_text = _('poor')
-        self.excellent_text = _('excellent')
-        self.loggedin_text = _('You are not logged into NordVPN.\n'
-                               'Please, login with: nordvpn login')
+        self.manual_connect_text = N_('Manual connect')
+        self.status_text = N_('Status Information')
+        self.meshnet_text = N_('Meshnet')
+        self.speedtest_text = N_('Speed test')
+        self.rate_text = N_('Rate last connection')
+        self.profiles_text = N_('Profiles')
+        self.recent_text = N_('Recent servers')
+        self.favourite_text = N_('Favourite: {0}')
+        self.poor_text = N_('poor')
+        self.excellent_text = N_('excellent')
+        self.verify_text = N_('Verification')
+        self.verify_failed_text = N_('The VPN connection could not be verified')
+        self.verify_results_text = {True: N_('passed'), False: N_('failed'), None: N_('timeout')}
+        self.verify_names_text = {'interface': N_('Tunnel interface'),
+                                  'routing': N_('Routing'),
+                                  'dns': N_('DNS'),
+                                  'exit_ip': N_('Exit IP')}
+        self.usage_text = N_('Data usage')
+        self.usage_periods_text = {'session': N_('Session'), 'day': N_('Today'), 'month': N_('This month')}
+        self.usage_budget_text = N_('{0}: {1} of the {2} budget used')
+        self.technology_text = N_('Technology')
+        self.technology_selected_text = N_('{0} is the best technology on this network.')
+        self.loggedin_text = N_('You are not logged into NordVPN.\n'
+                                'Please, login with: nordvpn login')
         
         self.current_connection = 'connecting'
+        # Server the tunnel is connected to and the last connected server
+        self.current_server = ''
+        self.last_server = ''
+        self.server_lock = Lock()
+        self.usage = None
         # Current NordVPN settings
         self.current_settings = {}
         self.fill_settings(True)
         self.settings_changed = False
-        # Create event to use when thread is done
-        self.check_done_event = Event()
+        # Servers of the connection profiles
+        self.profile_targets = ProfileTargets()
+        # Reload the configuration when it is edited
+        get_config().watch()
+        # All periodic work is done by the scheduler
+        self.scheduler = Scheduler()
+        # Pause polling while suspended or offline
+        self.network_monitor = NetworkMonitor(self.on_network_changed, bus_address=system_bus_address)
+        self.network_monitor.start()
+        if not self.network_monitor.active:
+            self.on_network_changed(False, False)
+        # Pause polling on low battery
+        self.power_monitor = PowerMonitor(self.on_power_changed, LOW_BATTERY, bus_address=system_bus_address)
+        self.power_monitor.start()
+        if self.power_monitor.low_power:
+            self.on_power_changed(True)
         # Create indicator object
         self.indicator = AppIndicator3.Indicator.new(APPINDICATOR_ID, self.connections[self.current_connection]['icon'], AppIndicator3.IndicatorCategory.SYSTEM_SERVICES)
         self.indicator.set_title('NordVPN Indicator')
         self.indicator.set_status(AppIndicator3.IndicatorStatus.ACTIVE)
+        # Pre-rendered icons
+        self.icons = IconSet(self.indicator,
+                             {state: connection['icon'] for state, connection in self.connections.items()},
+                             cache_path)
+        self.icons.set_state(self.current_connection)
         self.indicator.set_menu(self.build_menu())
         # Init notifier
-        Notify.init(APPINDICATOR_ID)
-        # Start thread to check for connection changes
-        Thread(target=self.run_check).start()
-        # Some debugging
-        print(('--------- NordVPNIndicator Init ---------'))
+        self.notifier = NotificationManager(APPINDICATOR_ID)
+        self.notifier.start()
+        # Check for connection changes and refresh the catalogue
+        self.scheduler.register('status', self.run_check, STATUS_INTERVALS)
+        self.scheduler.register('catalogue', self.run_refresh_catalogue, {'default': CATALOGUE_INTERVAL})
+        self.scheduler.register('account', self.run_check_expiry, {'default': ACCOUNT_INTERVAL})
+        speedtest_interval = get_config().get('speedtest_interval')
+        if speedtest_interval > 0:
+            # Only while connected
+            self.scheduler.register('speedtest', self.run_speed_test, {'connected': speedtest_interval,
+                                                                       'default': None})
+        self.scheduler.register('settings', self.run_refresh_settings, {'default': SETTINGS_INTERVAL,
+                                                                        'connecting': None,
+                                                                        'disconnecting': None,
+                                                                        'measuring': None})
+        self.scheduler.register('profiles', self.profile_targets.refresh, {'default': PROFILE_INTERVAL,
+                                                                           'connecting': None,
+                                                                           'disconnecting': None,
+                                                                           'measuring': None})
+        # Opt-in metrics endpoint and/or textfile
+        self.metrics_exporter = None
+        if get_config().get('metrics_port'):
+            self.metrics_exporter = MetricsExporter(get_config().get('metrics_port'))
+            self.metrics_exporter.start()
+        if get_config().get('metrics_textfile'):
+            self.scheduler.register('metrics', self.run_write_metrics, {'default': TEXTFILE_INTERVAL})
+        # Data usage of the tunnel
+        try:
+            self.usage = UsageAccounting()
+        except OSError as e:
+            logger.warning('Cannot account the data usage: %s', e)
+        else:
+            self.scheduler.register('usage', self.run_usage, {'default': USAGE_INTERVAL})
+        logger.info('NordVPNIndicator started')
 
     def fill_settings(self, force=False):
         """
@@ -95,10 +212,7 @@ class NordVPNIndicator():
         """
         if force or self.settings_changed:
             settings = {'protocol': '', 'country': '', 'server': ''}
-            try:
-                output = subprocess.check_output(['nordvpn', 'settings']).decode('utf-8').lower().strip()
-            except:
-                output = ''
+            output = get_settings_text().lower().strip()
             if 'dns' in output:
                 output = output.replace(' ', '').replace('-', '').replace('_', '')
                 output_list = output.split('\n')
@@ -112,24 +226,28 @@ class NordVPNIndicator():
                         elif 'disabled' in value: value = False
                         settings[match.group(1)] = value
                 # Add country details (because 'nordvpn settings' doesn't show it)
-                nordvpn_save = '{}/.config/nordvpn'.format(str(Path.home()))
-                if not exists(nordvpn_save): makedirs(nordvpn_save)
-                settings['nordvpnsave'] = nordvpn_save
                 if settings['autoconnect']:
-                    server_save = join(nordvpn_save, 'server')
-                    country_save = join(nordvpn_save, 'country')
-                    if exists(server_save):
-                        with open(server_save, 'r') as f:
-                            settings['server'] = f.read().replace('\n', '').replace('\r', '')
-                    elif exists(country_save):
-                        with open(country_save, 'r') as f:
-                            settings['country'] = f.read().replace('\n', '').replace('\r', '')
+                    config = get_config()
+                    settings['server'] = config.get('server')
+                    if not settings['server']:
+                        settings['country'] = config.get('country')
 
             # Save in the current_settings dictionary
             self.current_settings = settings
+            # API calls are skipped while the killswitch blocks them
+            set_killswitch(settings.get('killswitch', False))
         # Show current settings
-        print(('---------------- Settings ---------------'))
-        print(("{}".format(', '.join("{!s}={!r}".format(key,val) for (key,val) in self.current_settings.items()))))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Settings: %s', ', '.join('{!s}={!r}'.format(key, val) for (key, val) in self.current_settings.items()))
+
+    def run_refresh_settings(self):
+        """
+        Called by the scheduler: follow the settings changed with the
+        command line (e.g. the killswitch that blocks the API calls).
+        """
+        # Keep the last settings while the daemon does not answer
+        if 'dns' in get_settings_text().lower():
+            self.fill_settings(True)
 
     def build_menu(self):
         """
@@ -137,21 +255,56 @@ class NordVPNIndicator():
         """
         menu = Gtk.Menu()
         if not has_account():
-            self.item_order = Gtk.MenuItem.new_with_label(self.order_text)
+            self.item_order = Gtk.MenuItem.new_with_label(_(self.order_text))
             self.item_order.connect('activate', self.show_order_page)
             menu.append(self.item_order)
             menu.append(Gtk.SeparatorMenuItem())
-        item_quick_connect = Gtk.MenuItem.new_with_label(self.connections[self.current_connection]['label'])
+        item_quick_connect = Gtk.MenuItem.new_with_label(_(self.connections[self.current_connection]['label']))
         item_quick_connect.connect('activate', self.quick_connect)
         menu.append(item_quick_connect)
-        item_manual_connect = Gtk.MenuItem.new_with_label(self.manual_connect_text)
+        item_manual_connect = Gtk.MenuItem.new_with_label(_(self.manual_connect_text))
         item_manual_connect.connect('activate', self.manual_connect)
         menu.append(item_manual_connect)
+
+        # Connection profiles
+        profiles = get_profiles()
+        item_profiles = Gtk.MenuItem.new_with_label(_(self.profiles_text))
+        if profiles:
+            sub_menu = Gtk.Menu()
+            for name in sorted(profiles):
+                sub_item_profile = Gtk.MenuItem.new_with_label(name)
+                sub_item_profile.connect('activate', self.switch_profile, name)
+                sub_menu.append(sub_item_profile)
+            item_profiles.set_submenu(sub_menu)
+            menu.append(item_profiles)
+
+        # Recent and favourite servers: connect without API requests
+        ranked = get_ranked()
+        current_server = self.current_server if self.current_connection == 'connected' else ''
+        item_recent = Gtk.MenuItem.new_with_label(_(self.recent_text))
+        if ranked or current_server:
+            sub_menu = Gtk.Menu()
+            for server, country, favourite in ranked:
+                label = '{0} ({1})'.format(server, country) if country else server
+                if favourite:
+                    label = '{0} {1}'.format(chr(9733), label)
+                sub_item_server = Gtk.MenuItem.new_with_label(label)
+                sub_item_server.connect('activate', self.connect_recent, server)
+                sub_menu.append(sub_item_server)
+            if current_server:
+                if ranked:
+                    sub_menu.append(Gtk.SeparatorMenuItem())
+                sub_item_favourite = Gtk.CheckMenuItem.new_with_label(_(self.favourite_text).format(current_server))
+                sub_item_favourite.set_active(current_server in get_favourites())
+                sub_item_favourite.connect('toggled', self.toggle_favourite, current_server)
+                sub_menu.append(sub_item_favourite)
+            item_recent.set_submenu(sub_menu)
+            menu.append(item_recent)
         
         # Rating
-        item_rate = Gtk.MenuItem.new_with_label(self.rate_text)
+        item_rate = Gtk.MenuItem.new_with_label(_(self.rate_text))
         sub_menu = Gtk.Menu()
-        sub_item_rate_1 = Gtk.MenuItem.new_with_label('1 ({})'.format(self.poor_text))
+        sub_item_rate_1 = Gtk.MenuItem.new_with_label('1 ({})'.format(_(self.poor_text)))
         sub_item_rate_1.connect('activate', self.rate_prev_connection, 1)
         sub_menu.append(sub_item_rate_1)
         sub_item_rate_2 = Gtk.MenuItem.new_with_label('2')
@@ -163,15 +316,21 @@ class NordVPNIndicator():
         sub_item_rate_4 = Gtk.MenuItem.new_with_label('4')
         sub_item_rate_4.connect('activate', self.rate_prev_connection, 4)
         sub_menu.append(sub_item_rate_4)
-        sub_item_rate_5 = Gtk.MenuItem.new_with_label('5 ({})'.format(self.excellent_text))
+        sub_item_rate_5 = Gtk.MenuItem.new_with_label('5 ({})'.format(_(self.excellent_text)))
         sub_item_rate_5.connect('activate', self.rate_prev_connection, 5)
         sub_menu.append(sub_item_rate_5)
         item_rate.set_submenu(sub_menu)
         menu.append(item_rate)
         
-        item_status = Gtk.MenuItem.new_with_label(self.status_text)
+        item_status = Gtk.MenuItem.new_with_label(_(self.status_text))
         item_status.connect('activate', self.show_status)
         menu.append(item_status)
+        item_speedtest = Gtk.MenuItem.new_with_label(_(self.speedtest_text))
+        item_speedtest.connect('activate', self.speed_test)
+        menu.append(item_speedtest)
+        item_meshnet = Gtk.MenuItem.new_with_label(_(self.meshnet_text))
+        item_meshnet.connect('activate', self.show_meshnet)
+        menu.append(item_meshnet)
         item_settings = Gtk.MenuItem.new_with_label(_('Settings'))
         item_settings.connect('activate', self.show_settings)
         menu.append(item_settings)
@@ -183,10 +342,26 @@ class NordVPNIndicator():
         
         if self.current_connection == 'connecting' or \
            self.current_connection == 'disconnecting' or \
-           self.current_connection == 'no_internet':
-            # Connecting/disconnecting/no internet
+           self.current_connection == 'no_internet' or \
+           self.current_connection == 'unresponsive':
+            # Connecting/disconnecting/no internet/daemon not responding
             item_quick_connect.set_sensitive(False)
             item_manual_connect.set_sensitive(False)
+            item_profiles.set_sensitive(False)
+            item_recent.set_sensitive(False)
+            item_speedtest.set_sensitive(False)
+            item_meshnet.set_sensitive(False)
+            item_settings.set_sensitive(False)
+            item_status.set_sensitive(False)
+            item_rate.set_sensitive(False)
+        elif self.current_connection == 'measuring':
+            # Measuring the technologies: only stop it
+            item_quick_connect.set_sensitive(True)
+            item_manual_connect.set_sensitive(False)
+            item_profiles.set_sensitive(False)
+            item_recent.set_sensitive(False)
+            item_speedtest.set_sensitive(False)
+            item_meshnet.set_sensitive(False)
             item_settings.set_sensitive(False)
             item_status.set_sensitive(False)
             item_rate.set_sensitive(False)
@@ -201,6 +376,7 @@ class NordVPNIndicator():
             # Disconnected
             item_quick_connect.set_sensitive(True)
             item_manual_connect.set_sensitive(True)
+            item_speedtest.set_sensitive(False)
             item_settings.set_sensitive(False)
             item_status.set_sensitive(True)
             item_rate.set_sensitive(True)
@@ -209,29 +385,151 @@ class NordVPNIndicator():
 
     def run_check(self):
         """
-        Checks every INTERVAL for changes in the connection.
+        Called by the scheduler to check for changes in the connection.
+        """
+        connection = get_connection_status()
+        if connection in ('connected', 'disconnected'):
+            # The status text is kept for a moment: no extra nordvpn command
+            server_changed = self.update_server(get_status_dict() if connection == 'connected' else {})
+            if server_changed and connection == self.current_connection:
+                GLib.idle_add(self.refresh_menu)
+        if self.network_monitor.active:
+            GLib.idle_add(self.set_connection, connection)
+
+    def update_server(self, status):
+        """
+        Keep the server the tunnel is connected to (from the status dictionary).
+        A new server is added to the recent servers, also when it was
+        connected outside the indicator.
+        Returns True when the server changed
         """
-        while not self.check_done_event.is_set():
-            connection = get_connection_status()
-            if connection != self.current_connection:
-                self.current_connection = connection
-                print(('Connection status: {}'.format(self.current_connection)))
-                # Change icon
-                self.indicator.set_icon_full(self.connections[self.current_connection]['icon'], '')
-                # Build menu
-                self.indicator.set_menu(self.build_menu())
-            self.check_done_event.wait(INTERVAL)
+        server = status.get('hostname', '').split('.')[0]
+        with self.server_lock:
+            if server == self.current_server:
+                return False
+            self.current_server = server
+            if server:
+                self.last_server = server
+        if server:
+            add_connection(server, status.get('country', ''))
+        if self.usage is not None:
+            self.usage.set_server(server)
+        return True
+
+    def run_refresh_catalogue(self):
+        """
+        Called by the scheduler to refresh the country catalogue
+        when the cached catalogue is outdated.
+        """
+        get_countries()
+        get_cities()
+        if self.current_connection == 'disconnected':
+            update_location()
+        # Build the geo index now, not at the first quick connect
+        get_geo_index()
+
+    def run_write_metrics(self):
+        """
+        Called by the scheduler to write the metrics textfile.
+        """
+        write_textfile(get_config().get('metrics_textfile'))
+
+    def run_usage(self):
+        """
+        Called by the scheduler to account the data usage and alert on budgets.
+        """
+        for period, used, budget in self.usage.sample():
+            text = _(self.usage_budget_text).format(_(self.usage_periods_text[period]),
+                                                    format_bytes(used * 1000000), format_bytes(budget * 1000000))
+            self.notifier.notify('usage', _(self.usage_text), text, 'dialog-warning')
+
+    def get_usage_text(self):
+        """
+        Data usage of the session, today and this month, one per line.
+        """
+        lines = ['{0}:'.format(_(self.usage_text))]
+        session = self.usage.get_session()
+        usage = [('session', session[1:] if session else None),
+                 ('day', self.usage.get_today()),
+                 ('month', self.usage.get_month())]
+        for period, counts in usage:
+            if counts is not None:
+                lines.append('{0}: {1} {2} / {3} {4}'.format(_(self.usage_periods_text[period]),
+                                                             chr(8595), format_bytes(counts[0]),
+                                                             chr(8593), format_bytes(counts[1])))
+        return '\n'.join(lines)
+
+    def run_check_expiry(self):
+        """
+        Called by the scheduler to warn when the account is about to expire.
+        """
+        days = get_account_expiry_days()
+        if days is not None and days <= EXPIRY_WARN_DAYS:
+            email, expires = get_account_info()
+            title = _('Your NordVPN account expires soon')
+            self.notifier.notify('account', title, expires, 'dialog-warning')
+
+    def set_connection(self, connection):
+        """
+        Change icon and menu when the connection changed.
+        """
+        if connection != self.current_connection:
+            self.current_connection = connection
+            logger.info('Connection status: %s', self.current_connection)
+            # Change icon
+            self.icons.set_state(self.current_connection)
+            # Build menu
+            self.indicator.set_menu(self.build_menu())
+            # Poll faster while connecting/disconnecting
+            self.scheduler.set_state(connection)
+            if connection == 'disconnected':
+                clear_verification()
+            elif connection == 'unresponsive':
+                self.notifier.notify('daemon', _(self.connections['unresponsive']['label']),
+                                     _('The status is checked again when it answers.'), 'dialog-warning')
+                logger.warning('NordVPN daemon: %s', get_watchdog().get_summary())
+        return False
+
+    def on_network_changed(self, active, resumed):
+        """
+        Called by the NetworkMonitor.
+        Pause polling while suspended or offline, check immediately on resume.
+        """
+        set_online(active)
+        if active:
+            self.scheduler.resume('offline')
+            if resumed:
+                self.scheduler.run_now('status')
+        else:
+            self.scheduler.pause('offline')
+            if hasattr(self, 'indicator'):
+                self.set_connection('no_internet')
+            else:
+                self.current_connection = 'no_internet'
+
+    def on_power_changed(self, low_power):
+        """
+        Called by the PowerMonitor.
+        Pause polling on battery below LOW_BATTERY.
+        """
+        if low_power:
+            self.scheduler.pause('low_power')
+        else:
+            self.scheduler.resume('low_power')
+            self.scheduler.run_now('status')
 
     def rate_prev_connection(self, widget, rate):
         """
         Rate the last connection
         """
         return_code, rate_result = rate_connection(rate)
+        if return_code == 0:
+            rate_session(self.last_server or get_last_server(), (rate - 1) / 4)
         icon = 'dialog-ok'
         if return_code > 0:
             icon = 'dialog-error'
         # Show rate info in notification window
-        Notify.Notification.new(self.rate_text, rate_result, icon).show()
+        self.notifier.notify('rate', _(self.rate_text), rate_result, icon, force=True)
     
     def show_status(self, widget=None):
         """
@@ -242,14 +540,45 @@ class NordVPNIndicator():
             email, expires = get_account_info()
             # Use box horizontal character (dec 9472)
             text = '{0}\n{1}\n{2}'.format(expires, chr(9472) * 25, get_status_info())
-            print(('-------------- show_status --------------'))
-            print(text)
+            server, results = get_verification()
+            if results:
+                text = '{0}\n{1}\n{2}'.format(text, chr(9472) * 25, self.get_verification_text(results))
+            if self.usage is not None:
+                text = '{0}\n{1}\n{2}'.format(text, chr(9472) * 25, self.get_usage_text())
+            logger.debug('Status: %s', text)
             icon = 'dialog-warning' if 'Disconnected' in text else 'dialog-information'
         else:
-            text = self.loggedin_text
+            text = _(self.loggedin_text)
             icon = 'dialog-error'
         # Show status info in notification window
-        Notify.Notification.new(self.status_text, text, icon).show()
+        self.notifier.notify('status', _(self.status_text), text, icon, force=True)
+
+    def get_verification_text(self, results):
+        """
+        Verification results, one check per line.
+        """
+        lines = ['{0}:'.format(_(self.verify_text))]
+        for name, (passed, detail, seconds) in results.items():
+            lines.append('{0}: {1} ({2})'.format(_(self.verify_names_text[name]),
+                                                 _(self.verify_results_text[passed]), detail))
+        return '\n'.join(lines)
+
+    def run_verify(self):
+        """
+        Verify the new connection and notify when a check failed.
+        """
+        status = get_status_dict()
+        self.update_server(status)
+        server = status.get('hostname', '').split('.')[0]
+        results = verify_connection(server, status.get('currenttechnology', ''))
+        if any(passed is False for passed, detail, seconds in results.values()):
+            self.notifier.notify('verify', _(self.verify_failed_text),
+                                 self.get_verification_text(results), 'dialog-warning')
+        # The quality of the connection ranks the server
+        scores = [{True: 1, False: 0, None: 0.5}[passed] for passed, detail, seconds in results.values()]
+        if server and scores:
+            rate_session(server, sum(scores) / len(scores))
+        GLib.idle_add(self.refresh_menu)
 
     def show_settings(self, widget):
         """
@@ -258,6 +587,41 @@ class NordVPNIndicator():
         self.settings_changed = NordVPNSettings(self.current_settings).show_settings()
         self.fill_settings()
     
+    def speed_test(self, widget):
+        """
+        Test the throughput of the current connection.
+        """
+        Thread(target=self.run_speed_test, kwargs={'notify': True}, daemon=True).start()
+
+    def run_speed_test(self, notify=False):
+        """
+        Speed test thread (also called by the scheduler).
+        """
+        status = get_status_dict()
+        server = status.get('hostname', '').split('.')[0]
+        if not server:
+            return
+        result = run_speedtest(server, status.get('currenttechnology', ''))
+        if result is not None and get_config().get('auto_technology'):
+            check_speed(get_network_identity(), status.get('currenttechnology', ''), result['download_mbps'])
+        if not notify:
+            return
+        if result is None:
+            text = _('The speed test failed.')
+            icon = 'dialog-error'
+        else:
+            text = _('Download: {0:g} Mbit/s\nUpload: {1:g} Mbit/s\n'
+                     'Latency: {2:g} ms (jitter {3:g} ms)').format(result['download_mbps'], result['upload_mbps'],
+                                                                   result['ttfb_ms'], result['jitter_ms'])
+            icon = 'dialog-information'
+        self.notifier.notify('speedtest', '{0}: {1}'.format(_(self.speedtest_text), server), text, icon, force=True)
+
+    def show_meshnet(self, widget):
+        """
+        Show the meshnet window.
+        """
+        NordVPNMeshnet().show_meshnet()
+
     def quick_connect(self, widget):
         """
         Quick connect.
@@ -272,13 +636,39 @@ class NordVPNIndicator():
         if country or server:
             self.change_connection(country=country, server=server)
         
+    def connect_recent(self, widget, server):
+        """
+        Connect to a recent or favourite server.
+        """
+        self.change_connection(connect=True, server=server)
+
+    def toggle_favourite(self, widget, server):
+        """
+        Add the current server to or remove it from the favourites.
+        """
+        toggle_favourite(server)
+        GLib.idle_add(self.refresh_menu)
+
+    def refresh_menu(self):
+        """
+        Build the menu again (in the main loop).
+        """
+        self.indicator.set_menu(self.build_menu())
+        return False
+
+    def switch_profile(self, widget, name):
+        """
+        Switch to a connection profile.
+        """
+        self.change_connection(connect=True, profile=name)
+
     def show_order_page(self, widget=None):
         """
         Load the order page
         """
         load_order_page()
 
-    def change_connection(self, country=None, server=None, connect=None, quick=False):
+    def change_connection(self, country=None, server=None, connect=None, quick=False, profile=None):
         """
         Start connection change in a thread
         Login when needed
@@ -290,21 +680,37 @@ class NordVPNIndicator():
 
         if return_code == 0:
             # Start this threaded or else the system tray icon does not change
-            Thread(target=self.run_change_connection, kwargs={'country': country,'server': server, 'connect': connect, 'quick': quick}).start()
+            Thread(target=self.run_change_connection, kwargs={'country': country,'server': server, 'connect': connect, 'quick': quick, 'profile': profile}).start()
         else:
             # Failed to login
             title = _('Not logged into NordVPN.')
-            Notify.Notification.new(title, last_line, 'dialog-error').show()
-            print(('----------- change_connection -----------'))
-            print(last_line)
+            self.notifier.notify('login', title, last_line, 'dialog-error', force=True)
+            logger.warning('Login failed: %s', last_line)
             
-    def run_change_connection(self, country=None, server=None, connect=None, quick=False):
+    def run_change_connection(self, country=None, server=None, connect=None, quick=False, profile=None):
         """
         Switches connection:
         Disconnect when connected and vise versa.
+        Connect with the settings and server of a profile.
+        The first connect on a network measures the technologies (auto_technology).
         """
+        # A change of the user stops measuring: the toggle disconnects
+        measuring = cancel_measurement()
+        if profile:
+            # Only the settings that differ are changed
+            apply_profile(get_profiles().get(profile, {}), self.current_settings)
+            server = self.profile_targets.get_target(profile)
         # Save current connection status
-        if connect is None: connect = not is_connected()
+        if connect is None: connect = not measuring and not is_connected()
+        # Measured technology of this network (unless the profile sets one)
+        network = ''
+        choice = None
+        if connect and get_config().get('auto_technology') and \
+           'technology' not in get_profiles().get(profile, {}):
+            network = get_network_identity()
+            choice = get_choice(network)
+            if choice is not None:
+                apply_choice(choice, self.current_settings)
 
         # Connect to country/server or disconnect
         connect_obj = ''
@@ -314,33 +720,98 @@ class NordVPNIndicator():
             if not server:
                 server = self.current_settings['server']
             connect_obj = server if server else country
-            if not connect_obj:
+            if not connect_obj and self.current_settings.get('killswitch') and not api_reachable():
+                # The killswitch blocks the API: do not wait for it, the daemon selects the server
+                logger.info('API blocked by the killswitch: the daemon selects the server')
+            elif not connect_obj:
                 # Get fastest server to connect to
                 connect_obj = get_fastest_server()
+                if not connect_obj:
+                    # API is unreachable: nearest city of the catalogue
+                    nearest = get_nearest(1, 'city')
+                    if nearest:
+                        distance, city = nearest[0]
+                        connect_obj = city['name']
+                        logger.info('Connect to the nearest city: %s (%.0f km)', connect_obj, distance)
 
+        # Not measured on this network: measure while connecting (not after a cancelled measurement)
+        winner = None
+        if network and choice is None and not measuring:
+            GLib.idle_add(self.set_connection, 'measuring')
+            logger.info('Measure the technologies with %s', connect_obj or 'the server of the daemon')
+            winner = select_technology(network, connect_obj, self.current_settings)
+            self.settings_changed = True
+            if is_cancelled():
+                # The change of the user that cancelled it shows the state
+                return
+            if winner is not None:
+                self.notifier.notify('technology', _(self.technology_text),
+                                     _(self.technology_selected_text).format(' '.join(CANDIDATES[winner].values())),
+                                     'dialog-information')
+
+        # Show the change and poll fast until it is done
+        GLib.idle_add(self.set_connection, 'connecting' if connect else 'disconnecting')
         if connect:
-            return_code, output = nordvpn_connect(connect_obj)
+            if winner is not None and is_connected():
+                # Measured last: already connected with the winner
+                return_code, output = (0, '')
+            else:
+                return_code, output = nordvpn_connect(connect_obj)
+            if return_code == 0:
+                self.run_verify()
+            elif choice is not None:
+                mark_degraded(network, 'cannot connect')
         else:
             return_code, output = nordvpn_disconnect()
+        GLib.idle_add(self.scheduler.run_now, 'status')
         # Show notification of error
         if return_code != 0:
             if not output:
                 output = _('If the problem persists, contact NordVPN customer support.')
             error_title = _('Failed to connect to "{0}"'.format(connect_obj)) if connect else _('Failed to disconnect from "{0}"'.format(connect_obj))
-            Notify.Notification.new(error_title, output, 'dialog-error').show()
+            # The answer to the user's click: also when it failed just before
+            self.notifier.notify('connection', error_title, output, 'dialog-error', force=True)
+
+    def shutdown(self):
+        """
+        Stop the timers, threads and exporters without leaving the main loop.
+        """
+        self.scheduler.stop()
+        self.icons.stop_animation()
+        self.network_monitor.stop()
+        self.power_monitor.stop()
+        self.notifier.stop()
+        logger.info('NordVPN daemon: %s', get_watchdog().get_summary())
+        logger.info('Requests: %s, rate limited API requests: %d',
+                    get_single_flight().counters, get_api_bucket().limited)
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.stop()
+        if self.usage is not None:
+            self.usage.close()
 
     def quit(self, widget=None):
         """
         Quit the application.
         """
-        self.check_done_event.set()
-        Notify.uninit()
+        self.shutdown()
         Gtk.main_quit()
 
-def main():
+def main(debug=False):
+    """
+    Start the indicator.
+    Argument: debug: log everything, also to stderr
+    """
+    config = get_config()
+    setup_logging(conf_path, debug, config.get('log_level'), config.get('log_levels'))
+    if config.get('record_file'):
+        start_recording(config.get('record_file'))
     NordVPNIndicator()
     signal.signal(signal.SIGINT, signal.SIG_DFL)
-    Gtk.main()
+    try:
+        Gtk.main()
+    finally:
+        stop_recording()
+        stop_logging()
     
 if __name__ == '__main__':
     main()
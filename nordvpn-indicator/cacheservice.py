@@ -0,0 +1,274 @@
+#! /usr/bin/env python3
+
+"""
+Shared cache service for multi-user machines
+One poller for "nordvpn status" and one cache for the NordVPN API,
+served read-only to every user's indicator over a local socket.
+Started by the nordvpn-indicator-cache systemd unit.
+Request (one line): "status" or "api <path>" (only API_PATHS with
+the API_QUERY parameters)
+Answer (JSON): {"age": seconds, "data": text} or {"error": message}
+Only uses the standard library: it does not load the indicator (GTK).
+"""
+
+import socketserver
+import subprocess
+import threading
+import hashlib
+import json
+import os
+import sys
+import re
+import signal
+import logging
+from time import time, monotonic
+from urllib.parse import parse_qsl, urlencode
+from os.path import join, exists
+
+SOCKET_PATH = '/run/nordvpn-indicator/cache.sock'
+CACHE_DIR = '/var/cache/nordvpn-indicator'
+API_URL = os.environ.get('NORDVPN_API_URL', 'https://api.nordvpn.com/v1')
+# Paths that may be requested and the maximum age (seconds) of their data
+API_PATHS = {'/servers/countries': 86400,
+             '/servers/recommendations': 300}
+# Query parameters that may be used and their values
+API_QUERY = {'filters[country_id]': re.compile(r'^\d{1,5}$')}
+# API fetches per path (without the query) per minute, with bursts of
+FETCHES_PER_MINUTE = 30
+FETCH_BURST = 10
+# Poll nordvpn status every number of seconds
+STATUS_INTERVAL = 5
+# Maximum number of different API requests to keep
+MAX_ENTRIES = 500
+MAX_REQUEST = 1024
+
+logger = logging.getLogger('nordvpn-indicator.cacheservice')
+
+
+class Cache():
+    def __init__(self, cache_dir=CACHE_DIR, api_url=API_URL):
+        """
+        API responses in memory and on disk, the last status in memory.
+        """
+        self.cache_dir = cache_dir
+        self.api_url = api_url
+        self.lock = threading.Lock()
+        # path: {'time': ..., 'data': ...}
+        self.entries = {}
+        # One fetch per path at a time
+        self.fetching = {}
+        # path without the query: (tokens, time)
+        self.fetch_tokens = {}
+        self.status = {'time': None, 'data': ''}
+        self.stop_event = threading.Event()
+
+    def normalize(self, path):
+        """
+        Check a requested path and return it in one canonical form.
+        The indicator escapes the brackets for curl ("filters\\[country_id\\]").
+        Returns (canonical path, path without the query)
+        Raises ValueError for a path or query parameter that is not allowed
+        """
+        base, query = (path.replace('\\', '') + '?').split('?')[:2]
+        if base not in API_PATHS:
+            raise ValueError('path not allowed: {0}'.format(base))
+        parameters = parse_qsl(query, keep_blank_values=True, strict_parsing=bool(query))
+        for name, value in parameters:
+            if name not in API_QUERY or not API_QUERY[name].match(value):
+                raise ValueError('query not allowed: {0}'.format(name))
+        if len(dict(parameters)) != len(parameters):
+            raise ValueError('repeated query parameter')
+        if not parameters:
+            return (base, base)
+        return ('{0}?{1}'.format(base, urlencode(sorted(parameters), safe='[]')), base)
+
+    def allow_fetch(self, base):
+        """
+        Take a fetch token of a path (FETCHES_PER_MINUTE, FETCH_BURST).
+        """
+        with self.lock:
+            now = monotonic()
+            tokens, last = self.fetch_tokens.get(base, (FETCH_BURST, now))
+            tokens = min(FETCH_BURST, tokens + (now - last) * FETCHES_PER_MINUTE / 60)
+            allowed = tokens >= 1
+            self.fetch_tokens[base] = (tokens - 1 if allowed else tokens, now)
+            return allowed
+
+    def prune(self):
+        """
+        Remove the files of requests that are not allowed (any more).
+        """
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return
+        for name in names:
+            file_name = join(self.cache_dir, name)
+            try:
+                with open(file_name) as f:
+                    path = json.load(f).get('path', '')
+                keep = self.normalize(path)[0] == path and self.file_name(path) == file_name
+            except (OSError, ValueError, AttributeError):
+                keep = False
+            if not keep:
+                self.remove(file_name)
+
+    def remove(self, file_name):
+        try:
+            os.remove(file_name)
+        except OSError as e:
+            logger.warning('Cannot remove %s: %s', file_name, e)
+
+    def file_name(self, path):
+        return join(self.cache_dir, hashlib.sha1(path.encode('utf-8')).hexdigest()[:16] + '.json')
+
+    def load(self, path):
+        """
+        API response from disk (kept over restarts).
+        """
+        try:
+            with open(self.file_name(path)) as f:
+                entry = json.load(f)
+            return entry if entry.get('path') == path else None
+        except (OSError, ValueError):
+            return None
+
+    def save(self, path, entry):
+        """
+        Write an API response atomically.
+        """
+        file_name = self.file_name(path)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(file_name + '.tmp', 'w') as f:
+                json.dump(dict(entry, path=path), f)
+            os.replace(file_name + '.tmp', file_name)
+        except OSError as e:
+            logger.warning('Cannot save %s: %s', file_name, e)
+
+    def get_api(self, path):
+        """
+        Get an API response: cached or fetched (once for all clients).
+        """
+        path, base = self.normalize(path)
+        max_age = API_PATHS[base]
+        with self.lock:
+            entry = self.entries.get(path) or self.load(path)
+            if entry is not None and time() - entry['time'] < max_age:
+                self.entries[path] = entry
+                return entry
+            fetch_lock = self.fetching.setdefault(path, threading.Lock())
+        with fetch_lock:
+            try:
+                return self.fetch(path, base, max_age, entry)
+            finally:
+                with self.lock:
+                    self.fetching.pop(path, None)
+
+    def fetch(self, path, base, max_age, entry=None):
+        """
+        Fetch an API response (entry: outdated response or None).
+        """
+        with self.lock:
+            latest = self.entries.get(path)
+            if latest is not None and time() - latest['time'] < max_age:
+                # Fetched for another client meanwhile
+                return latest
+        if not self.allow_fetch(base):
+            logger.warning('Too many requests for %s', base)
+            if entry is not None:
+                return entry
+            raise ValueError('too many requests: {0}'.format(base))
+        try:
+            # No URL globbing ([1-100], {a,b}): one request per request
+            data = subprocess.check_output(['curl', '--silent', '--fail', '--globoff', self.api_url + path],
+                                           timeout=10).decode('utf-8')
+            json.loads(data)
+        except (subprocess.SubprocessError, OSError, ValueError) as e:
+            logger.warning('Cannot fetch %s: %s', path, e)
+            if entry is not None:
+                # Better outdated than nothing
+                return entry
+            raise ValueError('cannot fetch {0}'.format(path))
+        entry = {'time': time(), 'data': data}
+        self.save(path, entry)
+        with self.lock:
+            self.entries[path] = entry
+            if len(self.entries) > MAX_ENTRIES:
+                oldest = min(self.entries, key=lambda key: self.entries[key]['time'])
+                del self.entries[oldest]
+                self.remove(self.file_name(oldest))
+        return entry
+
+    def poll_status(self, interval=STATUS_INTERVAL):
+        """
+        Status poller thread.
+        """
+        while not self.stop_event.is_set():
+            try:
+                data = subprocess.check_output(['nordvpn', 'status'], stderr=subprocess.STDOUT,
+                                               env=dict(os.environ, LANG='C'), timeout=5).decode('utf-8')
+                with self.lock:
+                    self.status = {'time': time(), 'data': data}
+            except (subprocess.SubprocessError, OSError) as e:
+                logger.warning('Cannot get the status: %s', e)
+            self.stop_event.wait(interval)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        """
+        Answer one request.
+        """
+        cache = self.server.cache
+        request = self.rfile.readline(MAX_REQUEST).decode('utf-8', 'replace').strip()
+        try:
+            if request == 'status':
+                with cache.lock:
+                    entry = dict(cache.status)
+                if entry['time'] is None:
+                    raise ValueError('no status yet')
+            elif request.startswith('api '):
+                entry = cache.get_api(request[4:].strip())
+            else:
+                raise ValueError('unknown request')
+            answer = {'age': time() - entry['time'], 'data': entry['data']}
+        except ValueError as e:
+            answer = {'error': str(e)}
+        self.wfile.write(json.dumps(answer).encode('utf-8'))
+
+
+class CacheServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def main(socket_path=SOCKET_PATH, cache_dir=CACHE_DIR):
+    """
+    Start the status poller and serve the socket.
+    """
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+    cache = Cache(cache_dir)
+    cache.prune()
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    if exists(socket_path):
+        os.remove(socket_path)
+    server = CacheServer(socket_path, RequestHandler)
+    server.cache = cache
+    # Every user may read
+    os.chmod(socket_path, 0o666)
+    threading.Thread(target=cache.poll_status, name='status', daemon=True).start()
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    logger.info('Serving %s', socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cache.stop_event.set()
+        server.server_close()
+        os.remove(socket_path)
+
+
+if __name__ == '__main__':
+    # Arguments: optional socket path, cache directory
+    main(*sys.argv[1:3])
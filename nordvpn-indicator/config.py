@@ -0,0 +1,219 @@
+#! /usr/bin/env python3
+
+"""
+Indicator configuration store
+All indicator settings and state are kept in one JSON file:
+~/.config/nordvpn/indicator.json
+The file is loaded once, kept in memory, reloaded when it is edited
+and written atomically (temporary file + rename).
+The old loose files (has_account, server, country, indicator.conf)
+are migrated on first use.
+"""
+
+from gi.repository import Gio
+from os.path import join, exists, getmtime, dirname
+from os import makedirs, replace, remove, fsync
+from pathlib import Path
+from threading import RLock
+import tempfile
+import json
+import re
+import logging
+
+conf_path = '{0}/.config/nordvpn'.format(Path.home())
+
+# Known settings with their default value (and type)
+DEFAULTS = {'has_account': False,
+            'server': '',
+            'country': '',
+            'order_link': 'https://join.nordvpn.com/order/',
+            'log_level': 'INFO',
+            'log_levels': '',
+            'api_url': 'https://api.nordvpn.com/v1',
+            'profiles': {},
+            'speedtest_download_url': 'https://speed.cloudflare.com/__down?bytes={bytes}',
+            'speedtest_upload_url': 'https://speed.cloudflare.com/__up',
+            'speedtest_interval': 0,
+            'location': '',
+            'last_location': '',
+            'metrics_port': 0,
+            'metrics_textfile': '',
+            'record_file': '',
+            'favourites': [],
+            'usage_daily_budget': 0,
+            'usage_monthly_budget': 0,
+            'auto_technology': False}
+
+logger = logging.getLogger(__name__)
+
+_config = None
+
+
+def get_config():
+    """
+    The shared configuration store.
+    """
+    global _config
+    if _config is None:
+        _config = IndicatorConfig(join(conf_path, 'indicator.json'))
+    return _config
+
+
+class IndicatorConfig():
+    def __init__(self, path):
+        """
+        Load the configuration (or migrate the old files).
+        """
+        self.path = path
+        self.lock = RLock()
+        self.values = dict(DEFAULTS)
+        self.saved_mtime = None
+        self.monitor = None
+        if exists(self.path):
+            self.load()
+        else:
+            self.migrate()
+
+    def load(self):
+        """
+        (Re)load the configuration file.
+        """
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning('Cannot load %s: %s', self.path, e)
+            return
+        with self.lock:
+            self.values = self.typed(data)
+
+    def typed(self, data):
+        """
+        Convert known settings to the type of their default.
+        Unknown settings are kept as they are.
+        """
+        values = dict(DEFAULTS)
+        for key, value in data.items():
+            default = DEFAULTS.get(key)
+            try:
+                if isinstance(default, bool):
+                    value = value if isinstance(value, bool) else str(value).lower() in ('1', 'true', 'yes')
+                elif default is not None:
+                    value = type(default)(value)
+            except (TypeError, ValueError):
+                logger.warning('Invalid value for %s: %r', key, value)
+                value = default
+            values[key] = value
+        return values
+
+    def get(self, key, default=None):
+        """
+        Get a setting.
+        """
+        with self.lock:
+            return self.values.get(key, DEFAULTS.get(key, default))
+
+    def set(self, **values):
+        """
+        Change one or more settings and save when something changed.
+        """
+        with self.lock:
+            new_values = dict(self.values)
+            new_values.update(values)
+            new_values = self.typed(new_values)
+            if new_values == self.values:
+                return
+            self.values = new_values
+            self.save()
+
+    def save(self):
+        """
+        Write the configuration atomically.
+        """
+        with self.lock:
+            try:
+                makedirs(dirname(self.path), exist_ok=True)
+                fd, tmp = tempfile.mkstemp(dir=dirname(self.path), prefix='.indicator.')
+                with open(fd, 'w') as f:
+                    json.dump(self.values, f, indent=4, sort_keys=True)
+                    f.flush()
+                    fsync(f.fileno())
+                replace(tmp, self.path)
+                self.saved_mtime = getmtime(self.path)
+            except OSError as e:
+                logger.warning('Cannot save %s: %s', self.path, e)
+
+    def watch(self):
+        """
+        Reload the configuration when it is edited outside the indicator.
+        Needs a running GLib main loop.
+        """
+        self.monitor = Gio.File.new_for_path(self.path).monitor_file(Gio.FileMonitorFlags.NONE, None)
+        self.monitor.connect('changed', self.on_file_changed)
+
+    def on_file_changed(self, monitor, file, other_file, event_type):
+        """
+        Configuration file was changed.
+        """
+        if event_type not in (Gio.FileMonitorEvent.CHANGES_DONE_HINT, Gio.FileMonitorEvent.CREATED):
+            return
+        try:
+            if getmtime(self.path) == self.saved_mtime:
+                # Our own change
+                return
+        except OSError:
+            return
+        logger.info('%s was changed: reload', self.path)
+        self.load()
+
+    def migrate(self):
+        """
+        Move the old loose files into the store.
+        """
+        values = {}
+        has_account = join(conf_path, 'has_account')
+        if exists(has_account):
+            values['has_account'] = True
+        for key in ('server', 'country'):
+            file = join(conf_path, key)
+            if exists(file):
+                with open(file, 'r') as f:
+                    values[key] = f.read().replace('\n', '').replace('\r', '')
+        indicator_conf = join(conf_path, 'indicator.conf')
+        if exists(indicator_conf):
+            conf = get_config_dict(indicator_conf)
+            for old_key, key in (('ORDER_LINK', 'order_link'),
+                                 ('LOG_LEVEL', 'log_level'),
+                                 ('LOG_LEVELS', 'log_levels')):
+                if conf.get(old_key):
+                    values[key] = conf[old_key]
+        self.values = self.typed(values)
+        self.save()
+        if not exists(self.path):
+            # Keep the old files when we cannot save
+            return
+        for key in ('has_account', 'server', 'country'):
+            file = join(conf_path, key)
+            if exists(file):
+                remove(file)
+        if exists(indicator_conf):
+            replace(indicator_conf, indicator_conf + '.old')
+        if values:
+            logger.info('Migrated %s to %s', ', '.join(values), self.path)
+
+
+# Read keys from file
+def get_config_dict(file, key_value=re.compile(r'^\s*(\w+)\s*=\s*["\']?(.*?)["\']?\s*(#.*)?$')):
+    """
+    Returns POSIX config file (key=value, no sections) as dict.
+    Assumptions: no multiline values, no value contains '#'.
+    """
+    d = {}
+    with open(file) as f:
+        for line in f:
+            try:
+                key, value, _ = key_value.match(line).groups()
+            except AttributeError:
+                continue
+            d[key] = value
+    return d
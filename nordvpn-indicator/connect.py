@@ -1,7 +1,5 @@
 #! /usr/bin/env python3
 
-APPINDICATOR_ID = 'nordvpn-indicator'
-
 import gi
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk
@@ -10,10 +8,10 @@ from os.path import abspath, dirname, join
 # Local modules
 from .nordvpn import get_countries, get_recommended_servers, \
                     get_recommended_country
+from .speedtest import get_results, get_server_summary
 
-# i18n: http://docs.python.org/3/library/gettext.html
-import gettext
-_ = gettext.translation(APPINDICATOR_ID, fallback=True).gettext
+# i18n: shared catalogue
+from .i18n import _
 
 
 class NordVPNConnect(Gtk.Dialog):
@@ -87,26 +85,33 @@ class NordVPNConnect(Gtk.Dialog):
                 return country_list[0]
         return 0
 
-    def fill_combobox(self, combobox, data_list, selected_index=None):
+    def fill_combobox(self, combobox, data_list, selected_index=None, details=None):
         """
         Returns a Gtk.ComboBox object from a data list.
         
-        Arguments: Gtk.ComboBox object, a data list, optional selected index (0+).
+        Arguments: Gtk.ComboBox object, a data list, optional selected index (0+),
+                   optional dictionary with details to show next to the data.
         """
         if combobox is None:
             return
+        if details is None:
+            details = {}
 
         try:
             liststore = combobox.get_model()
             liststore.clear()
         except:
-            liststore = Gtk.ListStore(str)
+            liststore = Gtk.ListStore(str, str)
             cell = Gtk.CellRendererText()
             combobox.pack_start(cell, True)
             combobox.add_attribute(cell, "text", 0)
+            cell = Gtk.CellRendererText()
+            cell.set_property('foreground', 'gray')
+            combobox.pack_start(cell, False)
+            combobox.add_attribute(cell, "text", 1)
 
         for data in data_list:
-            liststore.append([str(data)])
+            liststore.append([str(data), details.get(data, '')])
         combobox.set_model(liststore)
         
         if selected_index:
@@ -147,8 +152,10 @@ class NordVPNConnect(Gtk.Dialog):
             servers = get_recommended_servers(self.get_country_id(country))
             # Add an empty string at the beginning of the list
             servers.insert(0, '')
-            # Fill combobox
-            self.fill_combobox(self.cmb_servers, servers, 1)
+            # Fill combobox with the stored speed test results
+            results = get_results()
+            details = {server: get_server_summary(server, results) for server in servers}
+            self.fill_combobox(self.cmb_servers, servers, 1, details)
         else:
             # Clear server comobox
             self.fill_combobox(self.cmb_servers, [])
@@ -0,0 +1,163 @@
+#! /usr/bin/env python3
+
+"""
+Geo index of the NordVPN cities and servers
+Locations are stored as 3D unit vectors in a k-d tree so nearest
+queries do not suffer from the date line or the poles.
+The index is built once per catalogue refresh.
+"""
+
+from math import radians, cos, sin, asin
+from heapq import heappush, heappushpop
+from threading import Lock
+import logging
+
+# Local modules
+from .nordvpn import get_cities, get_server_locations, cache_mtime, get_insights
+from .config import get_config
+
+EARTH_RADIUS = 6371.0
+
+logger = logging.getLogger(__name__)
+_index = {'index': None, 'key': None}
+_index_lock = Lock()
+
+
+def to_vector(latitude, longitude):
+    """
+    Unit vector of a location.
+    """
+    latitude, longitude = radians(latitude), radians(longitude)
+    return (cos(latitude) * cos(longitude), cos(latitude) * sin(longitude), sin(latitude))
+
+
+def chord_to_km(chord_squared):
+    """
+    Great circle distance of a squared chord length between unit vectors.
+    """
+    return 2 * EARTH_RADIUS * asin(min(1.0, chord_squared ** 0.5 / 2))
+
+
+class GeoIndex():
+    def __init__(self, items):
+        """
+        Build a k-d tree.
+        Argument: list of (latitude, longitude, item) tuples
+        """
+        self.items = [item for latitude, longitude, item in items]
+        self.vectors = [to_vector(latitude, longitude) for latitude, longitude, item in items]
+        # Nodes: index of the item, axis, left node, right node
+        self.root = self.build(list(range(len(self.items))), 0)
+
+    def __len__(self):
+        return len(self.items)
+
+    def build(self, indexes, depth):
+        """
+        Build a (sub)tree of the given item indexes.
+        """
+        if not indexes:
+            return None
+        axis = depth % 3
+        indexes.sort(key=lambda i: self.vectors[i][axis])
+        middle = len(indexes) // 2
+        return (indexes[middle], axis,
+                self.build(indexes[:middle], depth + 1),
+                self.build(indexes[middle + 1:], depth + 1))
+
+    def nearest(self, latitude, longitude, count=1, accept=None):
+        """
+        Get the nearest items.
+        Arguments: location, number of items, optional accept(item) filter
+        Returns a list of (distance in km, item), nearest first
+        """
+        target = to_vector(latitude, longitude)
+        # Max heap of the best items: (-squared distance, index)
+        best = []
+
+        def search(node):
+            if node is None:
+                return
+            index, axis, left, right = node
+            vector = self.vectors[index]
+            distance = sum((a - b) ** 2 for a, b in zip(vector, target))
+            if accept is None or accept(self.items[index]):
+                if len(best) < count:
+                    heappush(best, (-distance, index))
+                elif distance < -best[0][0]:
+                    heappushpop(best, (-distance, index))
+            difference = target[axis] - vector[axis]
+            near, far = (left, right) if difference < 0 else (right, left)
+            search(near)
+            # The other side can only be closer than the worst best item
+            if len(best) < count or difference ** 2 < -best[0][0]:
+                search(far)
+
+        search(self.root)
+        return [(chord_to_km(-distance), self.items[index]) for distance, index in sorted(best, reverse=True)]
+
+
+def get_geo_index():
+    """
+    The index of the cached cities and servers.
+    It is built again when the catalogue was refreshed.
+    Items are dictionaries with type (city or server), name, country, country_code
+    """
+    key = (cache_mtime('cities'), cache_mtime('server_locations'))
+    with _index_lock:
+        if _index['index'] is None or _index['key'] != key:
+            items = []
+            for country_id, country, country_code, city, latitude, longitude in get_cities(cache_only=True):
+                items.append((latitude, longitude, {'type': 'city', 'name': city,
+                                                    'country': country, 'country_code': country_code}))
+            for server, (latitude, longitude, country_code) in get_server_locations().items():
+                items.append((latitude, longitude, {'type': 'server', 'name': server,
+                                                    'country': '', 'country_code': country_code}))
+            _index['index'] = GeoIndex(items)
+            _index['key'] = key
+            logger.debug('Geo index with %d locations', len(items))
+        return _index['index']
+
+
+def get_location():
+    """
+    Location (latitude, longitude) of the user or None.
+    Setting "location": "50.85,4.35" in indicator.json overrules the
+    location that was last reported by the NordVPN API while disconnected.
+    """
+    location = get_config().get('location') or get_config().get('last_location')
+    try:
+        latitude, longitude = (float(value) for value in str(location).split(','))
+    except ValueError:
+        return None
+    return (latitude, longitude)
+
+
+def update_location(timeout=5):
+    """
+    Remember the location reported by the NordVPN API
+    when it is not the location of a VPN server.
+    """
+    insights = get_insights(timeout)
+    if not insights.get('protected') and 'latitude' in insights and 'longitude' in insights:
+        try:
+            get_config().set(last_location='{0:.2f},{1:.2f}'.format(float(insights['latitude']),
+                                                                    float(insights['longitude'])))
+        except (TypeError, ValueError) as e:
+            logger.debug('Cannot get the location: %s', e)
+
+
+def get_nearest(count=1, item_type=None, location=None):
+    """
+    Get the nearest cities and/or servers.
+    Arguments: number of items, optional type (city or server),
+               location (default: get_location())
+    Returns a list of (distance in km, item)
+    """
+    location = location or get_location()
+    if location is None:
+        return []
+    accept = None
+    if item_type:
+        accept = lambda item: item['type'] == item_type
+    return get_geo_index().nearest(location[0], location[1], count, accept)
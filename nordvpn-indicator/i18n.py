@@ -0,0 +1,45 @@
+#! /usr/bin/env python3
+
+"""
+Shared translation service
+The catalogue is loaded once, on the first translated string.
+Mark strings that are translated later with N_ and translate them
+with _ when they are shown:
+    self.quit_text = N_('Quit')
+    Gtk.MenuItem.new_with_label(_(self.quit_text))
+"""
+
+APPINDICATOR_ID = 'nordvpn-indicator'
+
+# i18n: http://docs.python.org/3/library/gettext.html
+import gettext
+from threading import Lock
+
+_translation = None
+_lock = Lock()
+
+
+def get_translation(localedir=None):
+    """
+    Load the catalogue once.
+    """
+    global _translation
+    if _translation is None:
+        with _lock:
+            if _translation is None:
+                _translation = gettext.translation(APPINDICATOR_ID, localedir, fallback=True)
+    return _translation
+
+
+def _(message):
+    """
+    Translate a message.
+    """
+    return get_translation().gettext(message)
+
+
+def N_(message):
+    """
+    Mark a message for translation without translating it.
+    """
+    return message
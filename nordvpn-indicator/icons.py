@@ -0,0 +1,188 @@
+#! /usr/bin/env python3
+
+"""
+Tray icon set
+The SVG icons are rendered once to PNG files in the cache directory,
+keyed by a hash of their content, variant and size. Both variants
+(light and dark panel) are rendered and the icon follows theme changes.
+The connecting icon is animated by cycling pre-rendered frames.
+"""
+
+import gi
+gi.require_version('Gtk', '3.0')
+gi.require_version('GdkPixbuf', '2.0')
+from gi.repository import Gtk, Gdk, GdkPixbuf, GLib
+from os.path import join, exists, basename, splitext
+from os import makedirs, listdir, remove, replace
+from math import cos, pi
+import hashlib
+import logging
+import re
+
+# Icon size in the panel (multiplied with the HiDPI scale factor)
+PANEL_SIZE = 22
+# Connecting animation
+FRAMES = 8
+FRAME_INTERVAL = 150
+ANIMATED_STATES = ('connecting', 'disconnecting', 'measuring')
+# Colors to replace per panel variant
+VARIANT_COLORS = {'light': {'#8c8c8c': '#6e6e6e'},
+                  'dark': {'#8c8c8c': '#b4b4b4', '#4687ff': '#6fa0ff'}}
+
+logger = logging.getLogger(__name__)
+
+
+class IconSet():
+    def __init__(self, indicator, icons, cache_dir):
+        """
+        Arguments: AppIndicator3.Indicator, dictionary with SVG path per state,
+                   cache directory
+        """
+        self.indicator = indicator
+        self.icons = icons
+        self.cache_dir = join(cache_dir, 'icons')
+        self.state = None
+        self.frame = 0
+        self.animation_id = None
+        # Icon names (frames) per variant and SVG
+        self.names = {}
+        self.variant = self.get_variant()
+        self.prepared = self.prepare()
+        settings = Gtk.Settings.get_default()
+        if settings is not None:
+            for setting in ('gtk-theme-name', 'gtk-application-prefer-dark-theme'):
+                settings.connect('notify::' + setting, self.on_theme_changed)
+
+    def get_variant(self):
+        """
+        Use the dark variant with a dark theme.
+        """
+        settings = Gtk.Settings.get_default()
+        if settings is not None:
+            if settings.get_property('gtk-application-prefer-dark-theme'):
+                return 'dark'
+            theme = settings.get_property('gtk-theme-name') or ''
+            if 'dark' in theme.lower():
+                return 'dark'
+        return 'light'
+
+    def get_scale(self):
+        """
+        Highest scale factor of all monitors (HiDPI).
+        """
+        try:
+            display = Gdk.Display.get_default()
+            return max(display.get_monitor(i).get_scale_factor() for i in range(display.get_n_monitors()))
+        except:
+            return 1
+
+    def prepare(self):
+        """
+        Render the icons of both variants that are not in the cache yet.
+        Returns False when rendering is not possible.
+        """
+        size = PANEL_SIZE * self.get_scale()
+        animated = set(self.icons[state] for state in ANIMATED_STATES if state in self.icons)
+        try:
+            makedirs(self.cache_dir, exist_ok=True)
+            for variant, colors in VARIANT_COLORS.items():
+                names = self.names.setdefault(variant, {})
+                for svg in set(self.icons.values()):
+                    with open(svg, 'rb') as f:
+                        data = f.read()
+                    for color, variant_color in colors.items():
+                        data = data.replace(color.encode(), variant_color.encode())
+                    key = hashlib.sha1(data + str(size).encode()).hexdigest()[:16]
+                    name = '{0}-{1}'.format(splitext(basename(svg))[0], key)
+                    frames = [name]
+                    if svg in animated:
+                        frames += ['{0}-{1}'.format(name, i) for i in range(1, FRAMES)]
+                    for i, frame in enumerate(frames):
+                        png = join(self.cache_dir, frame + '.png')
+                        if not exists(png):
+                            self.render(self.fade(data, i), size, png)
+                    names[svg] = frames
+            self.cleanup()
+        except Exception as e:
+            logger.warning('Cannot render icons, using SVG files: %s', e)
+            return False
+        self.indicator.set_icon_theme_path(self.cache_dir)
+        return True
+
+    def fade(self, data, frame):
+        """
+        Change the opacity of the icon for an animation frame.
+        Frame 0 is fully opaque.
+        """
+        if frame == 0:
+            return data
+        opacity = 0.4 + 0.3 * (1 + cos(2 * pi * frame / FRAMES))
+        # On the root element: the styles of the shapes keep their own opacity
+        return re.sub(rb'<svg(\s)', '<svg opacity="{0:.2f}"\\1'.format(opacity).encode(), data, count=1)
+
+    def render(self, data, size, png):
+        """
+        Render SVG data to a PNG file.
+        """
+        loader = GdkPixbuf.PixbufLoader.new_with_type('svg')
+        loader.set_size(size, size)
+        loader.write(data)
+        loader.close()
+        loader.get_pixbuf().savev(png + '.tmp', 'png', [], [])
+        replace(png + '.tmp', png)
+
+    def cleanup(self):
+        """
+        Remove rendered icons of previous versions or sizes.
+        """
+        names = set(name for variant in self.names.values() for frames in variant.values() for name in frames)
+        for png in listdir(self.cache_dir):
+            if splitext(png)[0] not in names:
+                remove(join(self.cache_dir, png))
+
+    def on_theme_changed(self, settings, spec):
+        """
+        Show the icon of the other variant when the theme changed.
+        """
+        variant = self.get_variant()
+        if variant == self.variant:
+            return
+        logger.debug('Icon variant: %s', variant)
+        self.variant = variant
+        if self.prepared and self.state is not None:
+            frames = self.names[variant][self.icons[self.state]]
+            self.indicator.set_icon_full(frames[self.frame % len(frames)], '')
+
+    def set_state(self, state):
+        """
+        Change the icon, only when the state changed.
+        """
+        if state == self.state:
+            return
+        self.state = state
+        self.stop_animation()
+        svg = self.icons[state]
+        if not self.prepared:
+            self.indicator.set_icon_full(svg, '')
+            return
+        self.frame = 0
+        self.indicator.set_icon_full(self.names[self.variant][svg][0], '')
+        if state in ANIMATED_STATES:
+            self.animation_id = GLib.timeout_add(FRAME_INTERVAL, self.next_frame)
+
+    def next_frame(self):
+        """
+        Show the next animation frame.
+        """
+        frames = self.names[self.variant][self.icons[self.state]]
+        self.frame = (self.frame + 1) % len(frames)
+        self.indicator.set_icon_full(frames[self.frame], '')
+        return True
+
+    def stop_animation(self):
+        """
+        Stop the animation.
+        """
+        if self.animation_id is not None:
+            GLib.source_remove(self.animation_id)
+            self.animation_id = None
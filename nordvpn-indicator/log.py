@@ -0,0 +1,124 @@
+#! /usr/bin/env python3
+
+"""
+Logging
+Records are put on a queue and written by a listener thread
+so the GTK and worker threads never wait for the disk.
+The log file is written as JSON lines, rotated by size and compressed.
+Levels can be set in ~/.config/nordvpn/indicator.json:
+    "log_level": "INFO",
+    "log_levels": "nordvpn=DEBUG,scheduler=WARNING"
+"""
+
+APPINDICATOR_ID = 'nordvpn-indicator'
+
+import logging
+import logging.handlers
+from queue import Queue
+from datetime import datetime
+from os.path import join
+from os import makedirs, remove
+import threading
+import json
+import gzip
+import shutil
+import sys
+
+# Rotate at this size and keep this number of compressed files
+MAX_BYTES = 1024 * 1024
+BACKUP_COUNT = 3
+
+_listener = None
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        """
+        One JSON object per line.
+        """
+        data = {'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+                'level': record.levelname,
+                'module': record.name.replace(APPINDICATOR_ID + '.', ''),
+                'thread': record.threadName,
+                'msg': record.getMessage()}
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        """
+        Do not format in the calling thread: the listener does that.
+        """
+        return record
+
+
+def rotator(source, dest):
+    """
+    Compress the rotated log file.
+    """
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    remove(source)
+
+
+def get_level(name, default='INFO'):
+    """
+    Validated level name (default for an unknown level).
+    """
+    level = str(name).strip().upper()
+    if isinstance(logging.getLevelName(level), int):
+        return level
+    logging.getLogger(APPINDICATOR_ID).warning('Unknown log level %r: using %s', name, default)
+    return default
+
+
+def setup_logging(log_dir, debug=False, level='INFO', module_levels=''):
+    """
+    Start logging to log_dir/indicator.log.
+    Arguments: log directory, debug: log everything, also to stderr,
+               level, comma separated module=level list
+    """
+    global _listener
+    makedirs(log_dir, exist_ok=True)
+    file_handler = logging.handlers.RotatingFileHandler(join(log_dir, 'indicator.log'),
+                                                        maxBytes=MAX_BYTES,
+                                                        backupCount=BACKUP_COUNT,
+                                                        encoding='utf-8')
+    file_handler.namer = lambda name: name + '.gz'
+    file_handler.rotator = rotator
+    file_handler.setFormatter(JSONFormatter())
+    handlers = [file_handler]
+    if debug:
+        stream_handler = logging.StreamHandler(sys.stderr)
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        handlers.append(stream_handler)
+    _listener = logging.handlers.QueueListener(Queue(), *handlers)
+    _listener.start()
+
+    logger = logging.getLogger(APPINDICATOR_ID)
+    logger.handlers = [QueueHandler(_listener.queue)]
+    logger.propagate = False
+    logger.setLevel('DEBUG' if debug else get_level(level))
+    # Per module levels
+    for module_level in module_levels.split(','):
+        if '=' in module_level:
+            module, level = module_level.split('=', 1)
+            logging.getLogger('{0}.{1}'.format(APPINDICATOR_ID, module.strip())).setLevel(get_level(level))
+
+    # Log uncaught exceptions
+    def excepthook(exc_type, exc_value, exc_traceback):
+        logger.critical('Uncaught exception', exc_info=(exc_type, exc_value, exc_traceback))
+    sys.excepthook = excepthook
+    threading.excepthook = lambda args: excepthook(args.exc_type, args.exc_value, args.exc_traceback)
+
+
+def stop_logging():
+    """
+    Write the queued records and stop the listener.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
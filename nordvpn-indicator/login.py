@@ -1,25 +1,140 @@
 #! /usr/bin/env python3
 
-APPINDICATOR_ID = 'nordvpn-indicator'
-
 import gi
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk
-from os.path import abspath, dirname, join, exists
+from gi.repository import Gtk, GLib
+from os.path import abspath, dirname, join
+from threading import Thread, Event
+from time import monotonic
 import subprocess
+import os
+import pty
+import re
+import select
+import signal
+import logging
+
+# Local modules
+from .nordvpn import set_has_account, invalidate_account_info
+
+# i18n: shared catalogue
+from .i18n import _
+
+# Seconds to wait for each step of the login
+LOGIN_TIMEOUT = 30
+# Custom dialog response when the login thread is done
+RESPONSE_DONE = 1
+ANSI_ESCAPE = re.compile(r'\x1B\[[0-?]*[ -/]*[@-~]')
+LOGIN_PROMPT = re.compile(r'sername|mail')
+PASSWORD_PROMPT = re.compile(r'assword')
+SUCCESS = re.compile(r'elcome|already logged in')
+FAILURE = re.compile(r'not correct|incorrect|invalid|wrong|failed|denied|not found|too many')
+
+logger = logging.getLogger(__name__)
+
+
+def pty_login(login, password, on_output=None, cancel_event=None, timeout=LOGIN_TIMEOUT):
+    """
+    Run "nordvpn login" on a pseudo terminal and answer its prompts.
+    The credentials are only written to its input, never on a command line.
+    Arguments: login, password, optional on_output(text) callback,
+               optional threading.Event to cancel, timeout per step
+    Returns (return code, message):
+        0: logged in, 1: timeout, 2: unexpected end, 3: no login/password,
+        4: login refused, 5: cannot start nordvpn, 6: cancelled
+    """
+    if not login or not password:
+        return (3, _('Login/password was not given.'))
+    master, slave = pty.openpty()
+    try:
+        process = subprocess.Popen(['nordvpn', 'login'], stdin=slave, stdout=slave, stderr=slave,
+                                   start_new_session=True, env=dict(os.environ, LANG='C'))
+    except OSError as e:
+        os.close(master)
+        os.close(slave)
+        return (5, _('Cannot start nordvpn: {0}').format(e.strerror))
+    os.close(slave)
+
+    step = 'login'
+    output = ''
+    result = None
+    deadline = monotonic() + timeout
+    try:
+        while result is None:
+            if cancel_event is not None and cancel_event.is_set():
+                result = (6, _('Login was cancelled.'))
+                break
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                result = (1, _('Timeout while waiting for the {0} prompt.').format(step))
+                break
+            ready = select.select([master], [], [], min(remaining, 0.2))[0]
+            if not ready:
+                continue
+            try:
+                data = os.read(master, 1024)
+            except OSError:
+                # EIO: nordvpn closed the terminal
+                data = b''
+            if not data:
+                last_line = output.strip().split('\n')[-1] if output.strip() else ''
+                if SUCCESS.search(output.lower()):
+                    result = (0, last_line)
+                elif step == 'result' and FAILURE.search(output.lower()):
+                    result = (4, last_line)
+                else:
+                    result = (2, _('nordvpn login stopped unexpectedly: {0}').format(last_line))
+                break
+            text = ANSI_ESCAPE.sub('', data.decode('utf-8', 'replace')).replace('\r', '')
+            # Never show the password, even if it is echoed
+            if len(password) > 3:
+                text = text.replace(password, '*' * 8)
+            output += text
+            if on_output is not None and text.strip():
+                on_output(text.strip())
+            lower = output.lower()
+            if SUCCESS.search(lower):
+                result = (0, output.strip().split('\n')[-1])
+            elif FAILURE.search(lower) and step == 'result':
+                result = (4, output.strip().split('\n')[-1])
+            elif step == 'login' and 'http' in lower:
+                # Newer versions only support browser login
+                result = (4, _('Please, login in your browser: {0}').format(output.strip()))
+            elif step == 'login' and LOGIN_PROMPT.search(lower):
+                os.write(master, '{0}\n'.format(login).encode('utf-8'))
+                step = 'password'
+                output = ''
+                deadline = monotonic() + timeout
+            elif step == 'password' and PASSWORD_PROMPT.search(lower):
+                os.write(master, '{0}\n'.format(password).encode('utf-8'))
+                step = 'result'
+                output = ''
+                deadline = monotonic() + timeout
+    finally:
+        os.close(master)
+        if process.poll() is None:
+            os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
 
-# i18n: http://docs.python.org/3/library/gettext.html
-import gettext
-_ = gettext.translation(APPINDICATOR_ID, fallback=True).gettext
+    if result[0] == 0:
+        # Update the cached login state
+        set_has_account()
+        invalidate_account_info()
+    logger.info('Login result: %d %s', result[0], result[1])
+    return result
 
 
 class NordVPNLogin(Gtk.Dialog):
     def __init__(self):
         # Paths
         self.script_dir = abspath(dirname(__file__))
-        self.expect_template = join(self.script_dir, 'nordvpn-login.exp')
         # Return value
         self.value = (-1, '')
+        self.cancel_event = Event()
 
     def show(self):
         """
@@ -59,26 +174,60 @@ class NordVPNLogin(Gtk.Dialog):
         self.txt_pwd.set_activates_default(True)
         self.txt_pwd.set_hexpand(True)
         grid.attach(self.txt_pwd, 1, 1, 1, 1)
-        
+        # Progress
+        self.spinner = Gtk.Spinner()
+        grid.attach(self.spinner, 0, 2, 1, 1)
+        self.lbl_progress = Gtk.Label()
+        self.lbl_progress.set_halign(Gtk.Align.START)
+        self.lbl_progress.set_line_wrap(True)
+        grid.attach(self.lbl_progress, 1, 2, 1, 1)
+
         # Show the window
         self.show_all()
-        response = self.run()
-        if response == Gtk.ResponseType.OK:
-            login = self.txt_uname.get_text().strip()
-            password = self.txt_pwd.get_text().strip()
-            if login and password:
-                if exists(self.expect_template):
-                    return_msg = ''
-                    command = 'expect "{0}" "{1}" "{2}"'.format(self.expect_template, login, password)
-                    return_code = subprocess.call(['bash', '-c', command], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                    if return_code == 1: return_msg = 'ERROR: timeout'
-                    elif return_code == 2: return_msg = 'ERROR: unexpected EOF'
-                    elif return_code == 3: return_msg = 'ERROR: no login/password was given'
-                    elif return_code > 3: return_msg = 'ERROR: unexpected error'
-                    self.value = (return_code, return_msg)
-                else:
-                    self.value = (-1, _('Cannot find {}.'.format(self.expect_template)))
+        while True:
+            response = self.run()
+            if response == Gtk.ResponseType.OK:
+                login = self.txt_uname.get_text().strip()
+                password = self.txt_pwd.get_text().strip()
+                if not login or not password:
+                    self.lbl_progress.set_text(_('Login/password was not given.'))
+                    continue
+                # Login off the GTK thread
+                self.set_busy(True)
+                Thread(target=self.run_login, args=(login, password), daemon=True).start()
+            elif response == RESPONSE_DONE:
+                self.set_busy(False)
+                if self.value[0] == 0:
+                    break
+                self.lbl_progress.set_text(self.value[1])
             else:
-                self.value = (-1, _('Login/password was not given.'))
+                # Cancel (also stops a running login)
+                self.cancel_event.set()
+                if self.value[0] != 0:
+                    self.value = (-1, _('Login was cancelled.'))
+                break
         self.destroy()
         return self.value
+
+    def set_busy(self, busy):
+        """
+        Disable the input while logging in.
+        """
+        self.txt_uname.set_sensitive(not busy)
+        self.txt_pwd.set_sensitive(not busy)
+        self.set_response_sensitive(Gtk.ResponseType.OK, not busy)
+        if busy:
+            self.spinner.start()
+        else:
+            self.spinner.stop()
+
+    def run_login(self, login, password):
+        """
+        Login thread: stream the prompts to the dialog.
+        """
+        def on_output(text):
+            if not self.cancel_event.is_set():
+                GLib.idle_add(self.lbl_progress.set_text, text)
+        self.value = pty_login(login, password, on_output, self.cancel_event)
+        if not self.cancel_event.is_set():
+            GLib.idle_add(self.response, RESPONSE_DONE)
@@ -0,0 +1,369 @@
+#! /usr/bin/env python3
+
+"""
+Log viewer for daemon.log and indicator.log
+The log files are memory-mapped and indexed incrementally:
+only the lines that were added since the last update are read.
+A connection timeline is built from the same lines.
+"""
+
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk, Gio
+from os.path import abspath, dirname, join, exists, basename
+from os import stat
+from array import array
+from datetime import datetime
+from time import time
+import mmap
+import json
+import re
+
+# Local modules
+from .config import conf_path
+
+# i18n: shared catalogue
+from .i18n import _, N_
+
+LOGS = ['/var/log/nordvpn/daemon.log',
+        join(conf_path, 'indicator.log')]
+# Maximum number of lines shown in the viewer
+MAX_LINES = 2000
+LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
+# Level aliases used by nordvpnd
+LEVEL_ALIASES = {'WARN': 'WARNING', 'ERR': 'ERROR', 'FATAL': 'CRITICAL'}
+# Time filters (seconds)
+PERIODS = [(N_('All'), None), (N_('Last hour'), 3600),
+           (N_('Last day'), 86400), (N_('Last week'), 604800)]
+# "2023/05/12 10:15:01 [Info] message" or "2023-05-12T10:15:01.123 ..."
+LINE_RE = re.compile(rb'^(\d{4})[/-](\d\d)[/-](\d\d)[ T](\d\d):(\d\d):(\d\d)\S*\s+\[?([A-Za-z]+)\]?')
+# Connection events: (regex on the lowercase message, event)
+EVENTS = [(re.compile(r'execute command: nordvpn c\b\s*(.*)'), 'attempt'),
+          (re.compile(r'connecting to\s+(\S*)'), 'attempt'),
+          (re.compile(r'connection status: connected'), 'connected'),
+          (re.compile(r'(?:successfully )?connected to\s+(\S*)'), 'connected'),
+          (re.compile(r'connection status: disconnected'), 'disconnected'),
+          (re.compile(r'execute command: nordvpn d\b'), 'disconnected'),
+          (re.compile(r'disconnected'), 'disconnected')]
+
+
+class LogIndex():
+    def __init__(self, path):
+        """
+        Offset index of a log file with level and time per line.
+        """
+        self.path = path
+        self.reset()
+
+    def reset(self):
+        """
+        Forget everything (log was rotated or truncated).
+        """
+        self.offset = 0
+        self.inode = None
+        self.starts = array('Q')
+        self.ends = array('Q')
+        self.levels = bytearray()
+        self.times = array('d')
+        self.timeline = Timeline()
+
+    def update(self):
+        """
+        Index the lines that were added since the last update.
+        Returns the number of new lines.
+        """
+        try:
+            st = stat(self.path)
+        except OSError:
+            return 0
+        if st.st_ino != self.inode or st.st_size < self.offset:
+            self.reset()
+            self.inode = st.st_ino
+        if st.st_size == self.offset:
+            return 0
+        count = len(self.starts)
+        with open(self.path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                pos = self.offset
+                while True:
+                    end = mm.find(b'\n', pos)
+                    if end < 0:
+                        # Wait for the rest of the line
+                        break
+                    line = mm[pos:end]
+                    level, timestamp = self.parse(line)
+                    self.starts.append(pos)
+                    self.ends.append(end)
+                    self.levels.append(level)
+                    self.times.append(timestamp)
+                    self.timeline.feed(line, timestamp, level)
+                    pos = end + 1
+                self.offset = pos
+        return len(self.starts) - count
+
+    def parse(self, line):
+        """
+        Get level (index in LEVELS) and time from a line.
+        """
+        if line.startswith(b'{'):
+            # indicator.log: JSON lines
+            try:
+                record = json.loads(line)
+                return (self.level_index(record.get('level', '')),
+                        datetime.strptime(record['time'], '%Y-%m-%dT%H:%M:%S.%f').timestamp())
+            except (ValueError, KeyError):
+                return (1, 0.0)
+        match = LINE_RE.match(line)
+        if match:
+            fields = [int(x) for x in match.groups()[:6]]
+            try:
+                timestamp = datetime(*fields).timestamp()
+            except ValueError:
+                timestamp = 0.0
+            return (self.level_index(match.group(7).decode('ascii')), timestamp)
+        # Continuation lines get the level and time of the previous line
+        if self.levels:
+            return (self.levels[-1], self.times[-1])
+        return (1, 0.0)
+
+    def level_index(self, level):
+        """
+        Index of a level name in LEVELS (INFO when unknown).
+        """
+        level = level.upper()
+        level = LEVEL_ALIASES.get(level, level)
+        return LEVELS.index(level) if level in LEVELS else 1
+
+    def lines(self, min_level=0, since=None, first=0, limit=None):
+        """
+        Get the lines with at least min_level, newer than since (timestamp).
+        Only the last limit lines are returned.
+        """
+        selected = [i for i in range(first, len(self.starts))
+                    if self.levels[i] >= min_level and (since is None or self.times[i] >= since)]
+        if limit is not None:
+            selected = selected[-limit:]
+        if not selected:
+            return []
+        with open(self.path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return [mm[self.starts[i]:self.ends[i]].decode('utf-8', 'replace') for i in selected]
+
+
+class Timeline():
+    def __init__(self):
+        """
+        Connection attempts with their duration and errors.
+        """
+        self.events = []
+        self.current = None
+
+    def feed(self, line, timestamp, level):
+        """
+        Add one log line.
+        """
+        text = line.decode('utf-8', 'replace').lower()
+        if text.startswith('{'):
+            try:
+                text = json.loads(text).get('msg', '')
+            except ValueError:
+                pass
+        if level >= LEVELS.index('ERROR') and self.current is not None:
+            self.current['errors'].append(text.strip())
+        for regex, event in EVENTS:
+            match = regex.search(text)
+            if not match:
+                continue
+            target = match.group(1).strip() if match.groups() else ''
+            if event == 'attempt':
+                self.current = {'start': timestamp, 'target': target,
+                                'connected': None, 'end': None, 'errors': []}
+                self.events.append(self.current)
+            elif self.current is not None:
+                if event == 'connected' and self.current['connected'] is None:
+                    self.current['connected'] = timestamp
+                    if target and not self.current['target']:
+                        self.current['target'] = target
+                elif event == 'disconnected' and self.current['end'] is None:
+                    self.current['end'] = timestamp
+                    self.current = None
+            break
+
+    def duration(self, event):
+        """
+        Seconds connected (until now when still connected).
+        """
+        if event['connected'] is None:
+            return 0
+        end = event['end'] if event['end'] is not None else time()
+        return max(0, end - event['connected'])
+
+
+class NordVPNLogViewer(Gtk.Dialog):
+    def __init__(self):
+        # Paths
+        self.script_dir = abspath(dirname(__file__))
+        self.indexes = {}
+        self.monitors = []
+
+    def show_logs(self):
+        """
+        Show the log viewer.
+        """
+        Gtk.Dialog.__init__(self, title=_('NordVPN Logs'), parent=None, flags=0)
+        self.add_buttons(Gtk.STOCK_CLOSE, Gtk.ResponseType.CLOSE)
+
+        # Window settings
+        self.set_icon_from_file(join(self.script_dir, 'connected.svg'))
+        self.set_position(Gtk.WindowPosition.MOUSE)
+        self.set_default_size(800, 500)
+        # Grid
+        grid = Gtk.Grid()
+        grid.set_row_spacing(5)
+        grid.set_column_spacing(5)
+        self.get_content_area().add(grid)
+        # Log files, level and period
+        self.logs = [log for log in LOGS if exists(log)]
+        self.cmb_logs = self.create_combobox([basename(log) for log in self.logs])
+        grid.attach(self.cmb_logs, 0, 0, 1, 1)
+        self.cmb_levels = self.create_combobox([level.capitalize() for level in LEVELS])
+        grid.attach(self.cmb_levels, 1, 0, 1, 1)
+        self.cmb_periods = self.create_combobox([_(period[0]) for period in PERIODS])
+        grid.attach(self.cmb_periods, 2, 0, 1, 1)
+        # Log lines and timeline
+        notebook = Gtk.Notebook()
+        notebook.set_hexpand(True)
+        notebook.set_vexpand(True)
+        grid.attach(notebook, 0, 1, 3, 1)
+        self.txt_log = Gtk.TextView()
+        self.txt_log.set_editable(False)
+        self.txt_log.set_monospace(True)
+        notebook.append_page(self.scrolled(self.txt_log), Gtk.Label(label=_('Log')))
+        # Start, target, duration, errors
+        self.timeline_store = Gtk.ListStore(str, str, str, str)
+        tree = Gtk.TreeView(model=self.timeline_store)
+        for i, title in enumerate([_('Start'), _('Server'), _('Duration'), _('Errors')]):
+            tree.append_column(Gtk.TreeViewColumn(title, Gtk.CellRendererText(), text=i))
+        notebook.append_page(self.scrolled(tree), Gtk.Label(label=_('Timeline')))
+
+        for combobox in (self.cmb_logs, self.cmb_levels, self.cmb_periods):
+            combobox.connect('changed', self.on_filter_changed)
+        # Tail the logs (inotify)
+        for log in self.logs:
+            monitor = Gio.File.new_for_path(log).monitor_file(Gio.FileMonitorFlags.NONE, None)
+            monitor.connect('changed', self.on_log_changed, log)
+            self.monitors.append(monitor)
+        self.cmb_levels.set_active(LEVELS.index('INFO'))
+        self.cmb_logs.set_active(0)
+
+        # Show the window
+        self.show_all()
+        self.run()
+        for monitor in self.monitors:
+            monitor.cancel()
+        self.destroy()
+
+    def create_combobox(self, data_list):
+        """
+        Returns a Gtk.ComboBox object from a data list.
+        """
+        liststore = Gtk.ListStore(str)
+        for data in data_list:
+            liststore.append([data])
+        combobox = Gtk.ComboBox.new_with_model(liststore)
+        cell = Gtk.CellRendererText()
+        combobox.pack_start(cell, True)
+        combobox.add_attribute(cell, 'text', 0)
+        combobox.set_active(0)
+        return combobox
+
+    def scrolled(self, widget):
+        """
+        Put a widget in a Gtk.ScrolledWindow.
+        """
+        window = Gtk.ScrolledWindow()
+        window.add(widget)
+        return window
+
+    def get_index(self, log):
+        """
+        Get the (updated) index of a log file.
+        """
+        if log not in self.indexes:
+            self.indexes[log] = LogIndex(log)
+        self.indexes[log].update()
+        return self.indexes[log]
+
+    def get_filter(self):
+        """
+        Selected log, minimum level and since timestamp.
+        """
+        if not self.logs:
+            return (None, 0, None)
+        log = self.logs[max(0, self.cmb_logs.get_active())]
+        min_level = max(0, self.cmb_levels.get_active())
+        period = PERIODS[max(0, self.cmb_periods.get_active())][1]
+        since = time() - period if period else None
+        return (log, min_level, since)
+
+    def on_filter_changed(self, widget=None):
+        """
+        Show the filtered lines and the timeline of the selected log.
+        """
+        log, min_level, since = self.get_filter()
+        buffer = self.txt_log.get_buffer()
+        self.timeline_store.clear()
+        if log is None:
+            buffer.set_text(_('No log files found.'))
+            return
+        index = self.get_index(log)
+        buffer.set_text('\n'.join(index.lines(min_level, since, limit=MAX_LINES)))
+        self.scroll_to_end()
+        self.fill_timeline(index)
+
+    def on_log_changed(self, monitor, file, other_file, event_type, log):
+        """
+        Append new lines of the selected log.
+        """
+        if event_type != Gio.FileMonitorEvent.CHANGES_DONE_HINT:
+            return
+        selected, min_level, since = self.get_filter()
+        index = self.indexes.get(log)
+        if index is None:
+            return
+        first = len(index.starts)
+        inode = index.inode
+        if index.update() == 0:
+            return
+        if log != selected:
+            return
+        if index.inode != inode or first > len(index.starts):
+            # Rotated: show everything again
+            self.on_filter_changed()
+            return
+        lines = index.lines(min_level, since, first=first)
+        if lines:
+            buffer = self.txt_log.get_buffer()
+            buffer.insert(buffer.get_end_iter(), '\n' + '\n'.join(lines))
+            self.scroll_to_end()
+        self.fill_timeline(index)
+
+    def scroll_to_end(self):
+        """
+        Scroll the log to the last line.
+        """
+        buffer = self.txt_log.get_buffer()
+        buffer.place_cursor(buffer.get_end_iter())
+        self.txt_log.scroll_to_mark(buffer.get_insert(), 0, False, 0, 0)
+
+    def fill_timeline(self, index):
+        """
+        Show the connection events, newest first.
+        """
+        self.timeline_store.clear()
+        for event in reversed(index.timeline.events):
+            start = datetime.fromtimestamp(event['start']).strftime('%Y-%m-%d %H:%M:%S') if event['start'] else ''
+            duration = int(index.timeline.duration(event))
+            duration = '{0}:{1:02d}:{2:02d}'.format(duration // 3600, duration // 60 % 60, duration % 60) \
+                       if event['connected'] is not None else _('not connected')
+            self.timeline_store.append([start, event['target'], duration, '; '.join(event['errors'][-3:])])
@@ -0,0 +1,207 @@
+#! /usr/bin/env python3
+
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk, GLib, Pango
+from os.path import abspath, dirname, join
+from threading import Thread
+import logging
+
+# Local modules
+from .nordvpn import get_meshnet_peers, get_cached_meshnet_peers, \
+                    set_meshnet_permissions, MESHNET_PERMISSIONS
+
+# i18n: shared catalogue
+from .i18n import _, N_
+
+# Refresh the peer list every number of seconds while the window is open
+MESHNET_INTERVAL = 5
+# List store columns
+COL_HOSTNAME, COL_IP, COL_STATUS, COL_WEIGHT = range(4)
+COL_PERMISSIONS = {permission: i + 4 for i, permission in enumerate(MESHNET_PERMISSIONS)}
+PERMISSION_TITLES = {'incoming': N_('Incoming'),
+                     'routing': N_('Routing'),
+                     'local': N_('Local network'),
+                     'fileshare': N_('Files')}
+
+logger = logging.getLogger(__name__)
+
+
+class NordVPNMeshnet(Gtk.Dialog):
+    def __init__(self):
+        # Paths
+        self.script_dir = abspath(dirname(__file__))
+        # Permission changes to apply: (hostname, permission): allow
+        self.pending = {}
+        # Last peer list: hostname: peer
+        self.peers = {}
+        self.refreshing = False
+        self.timer_id = None
+        self.closed = False
+
+    def show_meshnet(self):
+        """
+        Show the meshnet peers and their permissions.
+        """
+        Gtk.Dialog.__init__(self, title=_('NordVPN Meshnet'), parent=None, flags=0)
+        self.add_buttons(Gtk.STOCK_CLOSE, Gtk.ResponseType.CLOSE, Gtk.STOCK_APPLY, Gtk.ResponseType.APPLY)
+
+        # Window settings
+        self.set_icon_from_file(join(self.script_dir, 'connected.svg'))
+        self.set_position(Gtk.WindowPosition.MOUSE)
+        self.set_default_size(600, 300)
+        self.set_response_sensitive(Gtk.ResponseType.APPLY, False)
+        # Grid
+        grid = Gtk.Grid()
+        grid.set_row_spacing(5)
+        grid.set_column_spacing(5)
+        grid.set_margin_bottom(10)
+        self.get_content_area().add(grid)
+        # Hostname, IP, status, weight, permissions
+        self.store = Gtk.ListStore(str, str, str, int, *[bool] * len(MESHNET_PERMISSIONS))
+        tree = Gtk.TreeView(model=self.store)
+        for column, title in ((COL_HOSTNAME, _('Hostname')), (COL_IP, _('IP')), (COL_STATUS, _('Status'))):
+            tree.append_column(Gtk.TreeViewColumn(title, Gtk.CellRendererText(), text=column, weight=COL_WEIGHT))
+        for permission in MESHNET_PERMISSIONS:
+            cell = Gtk.CellRendererToggle()
+            cell.connect('toggled', self.on_permission_toggled, permission)
+            tree.append_column(Gtk.TreeViewColumn(_(PERMISSION_TITLES[permission]), cell,
+                                                  active=COL_PERMISSIONS[permission]))
+        window = Gtk.ScrolledWindow()
+        window.set_hexpand(True)
+        window.set_vexpand(True)
+        window.add(tree)
+        grid.attach(window, 0, 0, 1, 1)
+        self.lbl_status = Gtk.Label()
+        self.lbl_status.set_halign(Gtk.Align.START)
+        self.lbl_status.set_line_wrap(True)
+        self.lbl_status.set_margin_start(5)
+        grid.attach(self.lbl_status, 0, 1, 1, 1)
+
+        # Show the cached peers, then refresh in the background
+        self.update_rows(get_cached_meshnet_peers())
+        self.refresh()
+        self.timer_id = GLib.timeout_add_seconds(MESHNET_INTERVAL, self.refresh)
+
+        # Show the window
+        self.show_all()
+        while self.run() == Gtk.ResponseType.APPLY:
+            self.apply()
+        GLib.source_remove(self.timer_id)
+        self.closed = True
+        self.destroy()
+
+    def refresh(self):
+        """
+        Get the peer list in a thread.
+        """
+        if not self.refreshing:
+            self.refreshing = True
+            Thread(target=self.run_refresh, daemon=True).start()
+        return True
+
+    def run_refresh(self):
+        """
+        Refresh thread.
+        """
+        peers = get_meshnet_peers(refresh=True)
+        GLib.idle_add(self.update_rows, peers)
+
+    def update_rows(self, peers):
+        """
+        Only change the rows (and values) that changed.
+        Permissions with a pending change are kept.
+        """
+        self.refreshing = False
+        if self.closed:
+            return False
+        if peers is None:
+            self.lbl_status.set_text(_('Meshnet is not enabled.\n'
+                                       'Please, enable it with: nordvpn set meshnet on'))
+            peers = []
+        elif self.lbl_status.get_text() and not self.pending:
+            self.lbl_status.set_text('')
+        self.peers = {peer['hostname']: peer for peer in peers}
+        rows = {row[COL_HOSTNAME]: row.iter for row in self.store}
+        for peer in peers:
+            values = self.get_row_values(peer)
+            row_iter = rows.pop(peer['hostname'], None)
+            if row_iter is None:
+                self.store.append([values[column] for column in sorted(values)])
+                continue
+            changed = {column: value for column, value in values.items()
+                       if self.store[row_iter][column] != value}
+            if changed:
+                self.store.set(row_iter, list(changed), list(changed.values()))
+        # Removed peers
+        for row_iter in rows.values():
+            self.store.remove(row_iter)
+        return False
+
+    def get_row_values(self, peer):
+        """
+        List store values of a peer: column: value.
+        """
+        status = _('Online') if peer['online'] else _('Offline')
+        if peer['local_peer']:
+            # "Local Peers" are the devices of the user's own account
+            status = '{0} ({1})'.format(status, _('own device'))
+        values = {COL_HOSTNAME: peer['hostname'],
+                  COL_IP: peer['ip'],
+                  COL_STATUS: status,
+                  COL_WEIGHT: Pango.Weight.NORMAL}
+        for permission, column in COL_PERMISSIONS.items():
+            values[column] = self.pending.get((peer['hostname'], permission), peer[permission])
+            if (peer['hostname'], permission) in self.pending:
+                values[COL_WEIGHT] = Pango.Weight.BOLD
+        return values
+
+    def on_permission_toggled(self, cell, path, permission):
+        """
+        Remember the permission change (applied with Apply).
+        """
+        hostname = self.store[path][COL_HOSTNAME]
+        allow = not self.store[path][COL_PERMISSIONS[permission]]
+        peer = self.peers.get(hostname)
+        if peer is not None and peer[permission] == allow:
+            self.pending.pop((hostname, permission), None)
+        else:
+            self.pending[(hostname, permission)] = allow
+        if peer is not None:
+            values = self.get_row_values(peer)
+            self.store.set(self.store.get_iter(path), list(values), list(values.values()))
+        self.set_response_sensitive(Gtk.ResponseType.APPLY, bool(self.pending))
+
+    def apply(self):
+        """
+        Apply all pending permission changes in one batch.
+        """
+        changes = [(hostname, permission, allow) for (hostname, permission), allow in self.pending.items()]
+        self.set_response_sensitive(Gtk.ResponseType.APPLY, False)
+        self.lbl_status.set_text(_('Applying {0} changes...').format(len(changes)))
+        self.refreshing = True
+        Thread(target=self.run_apply, args=(changes,), daemon=True).start()
+
+    def run_apply(self, changes):
+        """
+        Apply thread.
+        """
+        failed = set_meshnet_permissions(changes)
+        peers = get_meshnet_peers(refresh=True)
+        GLib.idle_add(self.on_applied, failed, peers)
+
+    def on_applied(self, failed, peers):
+        """
+        Show the result and the new peer list.
+        """
+        if self.closed:
+            return False
+        self.pending = {}
+        for hostname, permission, output in failed:
+            logger.warning('Cannot change %s of %s: %s', permission, hostname, output)
+        if failed:
+            self.lbl_status.set_text('\n'.join(output for hostname, permission, output in failed))
+        else:
+            self.lbl_status.set_text('')
+        self.update_rows(peers)
+        return False
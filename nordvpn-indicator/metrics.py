@@ -0,0 +1,277 @@
+#! /usr/bin/env python3
+
+"""
+Connection health metrics in the OpenMetrics text format
+Opt-in in indicator.json:
+    "metrics_port": 9877      (HTTP endpoint http://127.0.0.1:9877/metrics, 0: off)
+    "metrics_textfile": ""    (file for the node exporter textfile collector)
+The metrics are recorded by the code that runs anyway (nordvpn commands,
+API requests, status checks). Scraping only reads them and the tunnel
+byte counters in /sys/class/net: it never runs a command.
+"""
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Lock, Thread
+from os.path import join, exists
+from os import replace
+from time import monotonic
+import logging
+
+# Local modules
+from .watchdog import get_watchdog
+from .singleflight import get_single_flight, get_api_bucket
+
+PREFIX = 'nordvpn_indicator'
+# Tunnel interface per technology
+TUNNEL_INTERFACES = {'nordlynx': ('nordlynx',),
+                     'openvpn': ('nordtun', 'tun0')}
+SYS_NET = '/sys/class/net'
+# Histogram buckets (seconds) of the command and API latencies
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Write the textfile every number of seconds
+TEXTFILE_INTERVAL = 60
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+logger = logging.getLogger(__name__)
+_lock = Lock()
+_metrics = {'state': None,
+            'state_since': None,
+            'was_connected': False,
+            'reconnects': 0,
+            # No state changes while the technologies are measured
+            'states_paused': False,
+            # state: number of times the state was entered
+            'state_changes': {},
+            # command: {'histogram': Histogram, 'timeouts': int, 'failures': int}
+            'commands': {},
+            # source (api, service or http): {'histogram': Histogram, 'timeouts': int, 'failures': int}
+            'api': {},
+            # cache: {'hit': int, 'miss': int}
+            'cache': {}}
+
+
+class Histogram():
+    def __init__(self, buckets=BUCKETS):
+        """
+        Cumulative histogram of observed values.
+        """
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+def set_state(state):
+    """
+    Record the connection state (called on every status check).
+    """
+    with _lock:
+        if state == _metrics['state'] or _metrics['states_paused']:
+            return
+        if state == 'connected':
+            if _metrics['was_connected']:
+                _metrics['reconnects'] += 1
+            _metrics['was_connected'] = True
+        _metrics['state'] = state
+        _metrics['state_since'] = monotonic()
+        _metrics['state_changes'][state] = _metrics['state_changes'].get(state, 0) + 1
+
+
+def pause_states(paused):
+    """
+    Ignore the connection states (synthetic connections) or record them again.
+    """
+    with _lock:
+        _metrics['states_paused'] = paused
+
+
+def _observe(kind, name, seconds, timeout, failed):
+    with _lock:
+        entry = _metrics[kind].setdefault(name, {'histogram': Histogram(), 'timeouts': 0, 'failures': 0})
+        entry['histogram'].observe(seconds)
+        if timeout:
+            entry['timeouts'] += 1
+        elif failed:
+            entry['failures'] += 1
+
+
+def observe_command(command, seconds, timeout=False, failed=False):
+    """
+    Record the duration of a nordvpn command (e.g. status, connect).
+    """
+    _observe('commands', command, seconds, timeout, failed)
+
+
+def observe_api(source, seconds, timeout=False, failed=False):
+    """
+    Record the duration of an API request (source: api, service or http).
+    """
+    _observe('api', source, seconds, timeout, failed)
+
+
+def count_cache(name, hit):
+    """
+    Record a cache hit or miss.
+    """
+    with _lock:
+        counts = _metrics['cache'].setdefault(name, {'hit': 0, 'miss': 0})
+        counts['hit' if hit else 'miss'] += 1
+
+
+def get_tunnel_bytes(sys_net=SYS_NET):
+    """
+    Byte counters of the tunnel interfaces that exist.
+    Returns {interface: (received, sent)}
+    """
+    counters = {}
+    for interfaces in TUNNEL_INTERFACES.values():
+        for interface in interfaces:
+            statistics = join(sys_net, interface, 'statistics')
+            if not exists(statistics):
+                continue
+            try:
+                with open(join(statistics, 'rx_bytes')) as f:
+                    received = int(f.read())
+                with open(join(statistics, 'tx_bytes')) as f:
+                    sent = int(f.read())
+            except (OSError, ValueError):
+                continue
+            counters[interface] = (received, sent)
+    return counters
+
+
+def _labels(**labels):
+    return '{' + ','.join('{0}="{1}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for key, value in labels.items()) + '}'
+
+
+def _histogram_lines(name, label, entries):
+    lines = ['# TYPE {0}_{1}_seconds histogram'.format(PREFIX, name),
+             '# UNIT {0}_{1}_seconds seconds'.format(PREFIX, name)]
+    for key, entry in sorted(entries.items()):
+        histogram = entry['histogram']
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            lines.append('{0}_{1}_seconds_bucket{2} {3}'.format(PREFIX, name, _labels(**{label: key, 'le': float(bound)}), count))
+        lines.append('{0}_{1}_seconds_bucket{2} {3}'.format(PREFIX, name, _labels(**{label: key, 'le': '+Inf'}), histogram.count))
+        lines.append('{0}_{1}_seconds_count{2} {3}'.format(PREFIX, name, _labels(**{label: key}), histogram.count))
+        lines.append('{0}_{1}_seconds_sum{2} {3:.6f}'.format(PREFIX, name, _labels(**{label: key}), histogram.sum))
+    for counter in ('timeouts', 'failures'):
+        lines.append('# TYPE {0}_{1}_{2} counter'.format(PREFIX, name, counter))
+        for key, entry in sorted(entries.items()):
+            lines.append('{0}_{1}_{2}_total{3} {4}'.format(PREFIX, name, counter, _labels(**{label: key}), entry[counter]))
+    return lines
+
+
+def render(sys_net=SYS_NET):
+    """
+    All metrics as OpenMetrics text.
+    """
+    with _lock:
+        lines = ['# TYPE {0}_connection_state stateset'.format(PREFIX)]
+        for state in sorted(set(_metrics['state_changes']) | {'connected', 'disconnected'}):
+            # The label of a stateset has the name of the metric
+            lines.append('{0}_connection_state{1} {2}'.format(PREFIX, _labels(**{PREFIX + '_connection_state': state}),
+                                                              int(state == _metrics['state'])))
+        if _metrics['state_since'] is not None:
+            lines += ['# TYPE {0}_state_duration_seconds gauge'.format(PREFIX),
+                      '# UNIT {0}_state_duration_seconds seconds'.format(PREFIX),
+                      '{0}_state_duration_seconds {1:.1f}'.format(PREFIX, monotonic() - _metrics['state_since'])]
+        lines.append('# TYPE {0}_state_changes counter'.format(PREFIX))
+        for state, count in sorted(_metrics['state_changes'].items()):
+            lines.append('{0}_state_changes_total{1} {2}'.format(PREFIX, _labels(state=state), count))
+        lines += ['# TYPE {0}_reconnects counter'.format(PREFIX),
+                  '{0}_reconnects_total {1}'.format(PREFIX, _metrics['reconnects'])]
+        lines += _histogram_lines('command', 'command', _metrics['commands'])
+        lines += _histogram_lines('api', 'source', _metrics['api'])
+        lines.append('# TYPE {0}_cache_requests counter'.format(PREFIX))
+        for name, counts in sorted(_metrics['cache'].items()):
+            for result in ('hit', 'miss'):
+                lines.append('{0}_cache_requests_total{1} {2}'.format(PREFIX, _labels(cache=name, result=result),
+                                                                      counts[result]))
+    watchdog = get_watchdog()
+    lines += ['# TYPE {0}_daemon_unresponsive gauge'.format(PREFIX),
+              '{0}_daemon_unresponsive {1}'.format(PREFIX, int(watchdog.unresponsive)),
+              '# TYPE {0}_daemon_consecutive_failures gauge'.format(PREFIX),
+              '{0}_daemon_consecutive_failures {1}'.format(PREFIX, watchdog.consecutive_failures),
+              '# TYPE {0}_daemon_latency_seconds summary'.format(PREFIX),
+              '# UNIT {0}_daemon_latency_seconds seconds'.format(PREFIX)]
+    for percent, seconds in watchdog.percentiles().items():
+        lines.append('{0}_daemon_latency_seconds{1} {2:.6f}'.format(PREFIX, _labels(quantile=percent / 100), seconds))
+    counters = dict(get_single_flight().counters)
+    lines.append('# TYPE {0}_coalesced_requests counter'.format(PREFIX))
+    for result in ('calls', 'hits', 'shared'):
+        lines.append('{0}_coalesced_requests_total{1} {2}'.format(PREFIX, _labels(result=result), counters[result]))
+    lines += ['# TYPE {0}_api_rate_limited counter'.format(PREFIX),
+              '{0}_api_rate_limited_total {1}'.format(PREFIX, get_api_bucket().limited)]
+    lines.append('# TYPE {0}_tunnel_bytes counter'.format(PREFIX))
+    lines.append('# UNIT {0}_tunnel_bytes bytes'.format(PREFIX))
+    for interface, (received, sent) in sorted(get_tunnel_bytes(sys_net).items()):
+        lines.append('{0}_tunnel_bytes_total{1} {2}'.format(PREFIX, _labels(interface=interface, direction='rx'), received))
+        lines.append('{0}_tunnel_bytes_total{1} {2}'.format(PREFIX, _labels(interface=interface, direction='tx'), sent))
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(path):
+    """
+    Write the metrics for the textfile collector (atomically).
+    """
+    try:
+        with open(path + '.tmp', 'w') as f:
+            f.write(render())
+        replace(path + '.tmp', path)
+    except OSError as e:
+        logger.warning('Cannot write metrics to %s: %s', path, e)
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('Metrics request: %s', format % args)
+
+
+class MetricsExporter():
+    def __init__(self, port, address='127.0.0.1'):
+        """
+        HTTP endpoint on the loopback interface.
+        """
+        self.port = port
+        self.address = address
+        self.server = None
+
+    def start(self):
+        try:
+            self.server = MetricsServer((self.address, self.port), MetricsHandler)
+        except OSError as e:
+            logger.warning('Cannot serve metrics on port %d: %s', self.port, e)
+            return
+        Thread(target=self.server.serve_forever, name='metrics', daemon=True).start()
+        logger.info('Metrics on http://%s:%d/metrics', self.address, self.port)
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,112 @@
+#! /usr/bin/env python3
+
+"""
+Network state monitor
+Listens on the system bus to logind (PrepareForSleep) and
+NetworkManager (StateChanged) to know when polling makes sense.
+A private bus address can be passed to use a local D-Bus stand-in.
+"""
+
+from gi.repository import Gio, GLib
+import logging
+
+LOGIND_NAME = 'org.freedesktop.login1'
+LOGIND_PATH = '/org/freedesktop/login1'
+LOGIND_IFACE = 'org.freedesktop.login1.Manager'
+NM_NAME = 'org.freedesktop.NetworkManager'
+NM_PATH = '/org/freedesktop/NetworkManager'
+NM_IFACE = 'org.freedesktop.NetworkManager'
+# NMState: anything below CONNECTED_LOCAL has no usable network
+NM_STATE_CONNECTED_LOCAL = 50
+
+logger = logging.getLogger(__name__)
+
+
+class NetworkMonitor():
+    def __init__(self, callback, bus_address=None):
+        """
+        Calls callback(active, resumed) when polling should stop or start.
+        active: False while asleep or offline
+        resumed: True when we just woke up or came back online
+        """
+        self.callback = callback
+        self.bus_address = bus_address
+        self.sleeping = False
+        self.online = True
+        self.bus = None
+        self.subscriptions = []
+
+    @property
+    def active(self):
+        """
+        Polling is only useful when awake and online.
+        """
+        return self.online and not self.sleeping
+
+    def start(self):
+        """
+        Connect to the bus and subscribe to the signals.
+        Without a bus we assume to be always online.
+        """
+        try:
+            if self.bus_address:
+                flags = Gio.DBusConnectionFlags.AUTHENTICATION_CLIENT | \
+                        Gio.DBusConnectionFlags.MESSAGE_BUS_CONNECTION
+                self.bus = Gio.DBusConnection.new_for_address_sync(self.bus_address, flags, None, None)
+            else:
+                self.bus = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
+        except GLib.Error as e:
+            logger.warning('Cannot connect to bus: %s', e.message)
+            return False
+        self.subscriptions.append(self.bus.signal_subscribe(
+            LOGIND_NAME, LOGIND_IFACE, 'PrepareForSleep', LOGIND_PATH,
+            None, Gio.DBusSignalFlags.NONE, self.on_prepare_for_sleep))
+        self.subscriptions.append(self.bus.signal_subscribe(
+            NM_NAME, NM_IFACE, 'StateChanged', NM_PATH,
+            None, Gio.DBusSignalFlags.NONE, self.on_nm_state_changed))
+        # Initial network state
+        state = self.get_nm_state()
+        if state is not None:
+            self.online = state >= NM_STATE_CONNECTED_LOCAL
+        return True
+
+    def stop(self):
+        """
+        Unsubscribe from all signals.
+        """
+        if self.bus:
+            for subscription in self.subscriptions:
+                self.bus.signal_unsubscribe(subscription)
+        self.subscriptions = []
+
+    def get_nm_state(self):
+        """
+        Get the current NetworkManager state (None if NM is not running).
+        """
+        try:
+            result = self.bus.call_sync(NM_NAME, NM_PATH,
+                                        'org.freedesktop.DBus.Properties', 'Get',
+                                        GLib.Variant('(ss)', (NM_IFACE, 'State')),
+                                        GLib.VariantType('(v)'),
+                                        Gio.DBusCallFlags.NONE, 1000, None)
+            return result.unpack()[0]
+        except GLib.Error:
+            return None
+
+    def on_prepare_for_sleep(self, connection, sender, path, interface, signal, parameters):
+        """
+        logind sends True before suspend and False after resume.
+        """
+        self.sleeping = parameters.unpack()[0]
+        logger.info('Sleeping: %s', self.sleeping)
+        self.callback(self.active, not self.sleeping)
+
+    def on_nm_state_changed(self, connection, sender, path, interface, signal, parameters):
+        """
+        NetworkManager state changed.
+        """
+        was_online = self.online
+        self.online = parameters.unpack()[0] >= NM_STATE_CONNECTED_LOCAL
+        if was_online != self.online:
+            logger.info('Online: %s', self.online)
+            self.callback(self.active, self.online)
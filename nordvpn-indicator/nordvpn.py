@@ -7,13 +7,100 @@ Api examples: https://blog.sleeplessbeastie.eu/2019/02/18/how-to-use-public-nord
 
 import subprocess
 from os.path import exists, join, \
-                    abspath, dirname
+                    abspath, dirname, getmtime
+from os import makedirs, replace, remove, environ, killpg
+from signal import SIGKILL
 from pathlib import Path
-from glob import glob
+from time import time, monotonic
+from datetime import date, datetime
+import socket
+import json
+import urllib.request
+import logging
 import re
 
-conf_path = '{0}/.config/nordvpn'.format(Path.home())
+# Local modules
+from .config import get_config
+from . import metrics, recorder
+from .watchdog import get_watchdog, DaemonUnresponsive
+from .singleflight import get_single_flight, get_api_bucket, RateLimited
+
+cache_path = '{0}/.cache/nordvpn-indicator'.format(Path.home())
 script_dir = abspath(dirname(__file__))
+# Maximum age (seconds) of the cached country catalogue
+CATALOGUE_MAX_AGE = 86400
+# Refresh the cached account information when it expires within this number of days
+ACCOUNT_REFRESH_DAYS = 14
+# Meshnet peer permissions: nordvpn meshnet peer <permission> allow|deny <peer>
+MESHNET_PERMISSIONS = ('incoming', 'routing', 'local', 'fileshare')
+# Meshnet peer list fields (lower case, without spaces) and their key
+MESHNET_FIELDS = {'hostname': 'hostname',
+                  'nickname': 'nickname',
+                  'status': 'status',
+                  'ip': 'ip',
+                  'os': 'os',
+                  'allowincomingtraffic': 'incoming',
+                  'allowrouting': 'routing',
+                  'allowlocalnetworkaccess': 'local',
+                  'allowsendingfiles': 'fileshare'}
+# Recommended server fields: hostname and location
+SERVER_FIELDS = '[.hostname, .locations[0].latitude, .locations[0].longitude, .locations[0].country.code] | @tsv'
+# Month abbreviations of the nordvpn output
+MONTHS = ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec')
+ANSI_ESCAPE = re.compile(r'\x1B\[[0-?]*[ -/]*[@-~]')
+# Read-only nordvpn commands: seconds to keep their output (0: only share calls in flight)
+# Other nordvpn commands change the state and are never shared
+READ_ONLY_TTLS = {'status': 1,
+                  'settings': 2,
+                  'countries': 60,
+                  'account': 10,
+                  # Logged in: "You are already logged in."
+                  'login': 2,
+                  'meshnet peer list': 0}
+# Seconds to keep an API response
+API_TTL = 5
+# Public IP, location and protection of this connection
+INSIGHTS_PATH = '/helpers/ips/insights'
+# Socket of the optional shared cache service (nordvpn-indicator-cache)
+SERVICE_SOCKET = '/run/nordvpn-indicator/cache.sock'
+# API that is cached by the service
+SERVICE_API_URL = 'https://api.nordvpn.com/v1'
+# Use the status of the service when it is not older than this number of seconds
+SERVICE_STATUS_MAX_AGE = 10
+
+logger = logging.getLogger(__name__)
+watchdog = get_watchdog()
+single_flight = get_single_flight()
+api_bucket = get_api_bucket()
+# Network state as reported by the NetworkMonitor, the killswitch setting,
+# the last connection status and the time of the last own state change
+network_state = {'online': True, 'killswitch': False, 'status': None, 'changed': 0.0}
+# Last meshnet peer list output and the parsed peers
+meshnet_state = {'output': None, 'peers': []}
+
+def set_online(online):
+    """
+    Set the network state.
+    API calls are skipped while offline or suspended.
+    """
+    if online != network_state['online']:
+        recorder.record('network', online=online)
+    network_state['online'] = online
+
+def set_killswitch(enabled):
+    """
+    Set the killswitch state (from the NordVPN settings).
+    """
+    network_state['killswitch'] = bool(enabled)
+
+def api_reachable():
+    """
+    Check if the API can be reached: online and not blocked by the
+    killswitch (it drops all traffic while the tunnel is down).
+    """
+    if not network_state['online']:
+        return False
+    return not network_state['killswitch'] or network_state['status'] == 'connected'
 
 def nordvpn_connect(connect_object=''):
     """
@@ -28,54 +115,343 @@ def nordvpn_disconnect():
     """
     return _exec_con_command(['nordvpn', 'd'])
 
+def nordvpn_set(setting, *values):
+    """
+    Change a NordVPN setting.
+    Arguments: setting name, values (booleans are enabled/disabled)
+    Returns (return code, output)
+    """
+    values = [('enabled' if value else 'disabled') if isinstance(value, bool) else str(value)
+              for value in values]
+    logger.info('Execute command: nordvpn set %s %s', setting, ' '.join(values))
+    return _run_nordvpn(['set', setting] + [value for value in values if value])
+
+def _get_memo_ttl(command):
+    """
+    Seconds to keep the output of a command
+    (None: a nordvpn command that changes the state or another command).
+    """
+    if command[0] == 'curl':
+        return API_TTL
+    if command[0] == 'nordvpn':
+        for read_only, ttl in READ_ONLY_TTLS.items():
+            if command[1:1 + len(read_only.split())] == read_only.split():
+                return ttl
+    return None
+
+def _execute(command, timeout=10, merge_stderr=False, env=None):
+    """
+    Run a command without a shell: all nordvpn and API interactions go through here
+    so they can be recorded (and replayed by tools/replay.py).
+    Identical read-only commands share one call (see READ_ONLY_TTLS),
+    API requests are rate limited and nordvpn commands are watched by
+    the daemon watchdog.
+    Arguments: command list, timeout in seconds (deadline),
+               merge_stderr: include stderr in the output, env: environment
+    Returns (return code, output)
+    Raises OSError (DaemonUnresponsive, RateLimited) and subprocess.TimeoutExpired
+    """
+    ttl = _get_memo_ttl(command)
+    if ttl is None and command[0] == 'nordvpn':
+        # The command changes the state: forget what was read before and while it ran
+        single_flight.forget()
+        try:
+            return _execute_now(command, timeout, merge_stderr, env)
+        finally:
+            single_flight.forget()
+            # A status of the cache service from before this time is outdated
+            network_state['changed'] = time()
+    return single_flight.do((tuple(command), merge_stderr),
+                            lambda: _execute_now(command, timeout, merge_stderr, env), ttl or 0)
+
+def _execute_now(command, timeout=10, merge_stderr=False, env=None):
+    """
+    Run a command (see _execute).
+    """
+    if command[0] == 'curl' and not api_bucket.acquire(timeout):
+        raise RateLimited('API rate limit')
+    daemon = command[0] == 'nordvpn'
+    if daemon and not watchdog.allow():
+        raise DaemonUnresponsive('NordVPN daemon is unresponsive')
+    start = time()
+    try:
+        return_code, output = _spawn(command, timeout, merge_stderr, env)
+    except subprocess.TimeoutExpired:
+        logger.info('Killed %s: no answer within %s seconds', ' '.join(command), timeout)
+        if daemon:
+            watchdog.observe(time() - start, timeout=True)
+        recorder.record('command', command=command, returncode=None, output='',
+                        duration=time() - start, start=start)
+        raise
+    except OSError:
+        if daemon:
+            # Not installed: nothing to watch
+            watchdog.observe(time() - start)
+        raise
+    if daemon:
+        watchdog.observe(time() - start, output)
+    recorder.record('command', command=command, returncode=return_code, output=output,
+                    duration=time() - start, start=start)
+    return (return_code, output)
+
+def _spawn(command, timeout, merge_stderr=False, env=None):
+    """
+    Start a command in its own process group and wait for it.
+    The whole group is killed when the deadline (timeout) is missed.
+    Returns (return code, output)
+    """
+    process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, env=env,
+                               start_new_session=True,
+                               stderr=subprocess.STDOUT if merge_stderr else None)
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        try:
+            killpg(process.pid, SIGKILL)
+        except OSError:
+            pass
+        process.communicate()
+        raise
+    return (process.returncode, stdout.decode('utf-8', 'replace'))
+
+def _run_nordvpn(args, timeout=10):
+    """
+    Run a nordvpn command without a shell.
+    Arguments: list with the nordvpn arguments, timeout in seconds
+    Returns (return code, output without ansi codes)
+    """
+    command = ['nordvpn'] + args
+    logger.debug('Execute command: %s', ' '.join(command))
+    start = monotonic()
+    try:
+        return_code, output = _execute(command, timeout, merge_stderr=True, env=dict(environ, LANG='C'))
+    except DaemonUnresponsive as e:
+        # Not started: the watchdog already warned
+        logger.debug('Cannot execute %s: %s', ' '.join(command), e)
+        return (1, str(e))
+    except (OSError, subprocess.TimeoutExpired) as e:
+        metrics.observe_command(args[0], monotonic() - start,
+                                timeout=isinstance(e, subprocess.TimeoutExpired), failed=True)
+        logger.warning('Cannot execute %s: %s', ' '.join(command), e)
+        return (1, str(e))
+    metrics.observe_command(args[0], monotonic() - start, failed=return_code != 0)
+    output = ANSI_ESCAPE.sub('', output).replace('\r', '').strip()
+    logger.debug('Command output: %s', output)
+    return (return_code, output)
+
 def _exec_con_command(command):
     """
     Called to connect or disconnect.
     Argument: command: list with commands/parameters
     """
     output = ''
+    # Metrics: connect or disconnect
+    name = {'c': 'connect', 'd': 'disconnect'}.get(command[1], command[1])
+    start = monotonic()
     try:
         # Unfortunately, encoding='ansi' to filter out the ansi code is only supported from Python 3.6
-        print('Execute command: {}'.format(' '.join(command)))
-        output = subprocess.check_output(command, timeout=10).decode('utf-8').lower().strip()
+        logger.info('Execute command: %s', ' '.join(command))
+        try:
+            return_code, output = _execute(command, timeout=10)
+        except subprocess.TimeoutExpired as e:
+            # The caller notifies and checks the status, like on other errors
+            metrics.observe_command(name, monotonic() - start, timeout=True)
+            logger.warning('Cannot execute %s: %s', ' '.join(command), e)
+            return (1, str(e))
         # Cleanup ansi
-        ansi_escape = re.compile(r'\x1B\[[0-?]*[ -/]*[@-~]')
-        output = ansi_escape.sub('', output)
-        print(('--------- exec_con_command ---------'))
-        print(output)
+        output = ANSI_ESCAPE.sub('', output.lower().strip())
+        logger.debug('Command output: %s', output)
+        if return_code != 0:
+            metrics.observe_command(name, monotonic() - start, failed=True)
+            return (return_code, output)
         # Catch return non-errors:
         # We're having trouble reaching our servers. If the issue persists, please contact our customer support.
         # Whoops! We can't connect you to 'nl350.nordvpn.com'. Please try again. If the problem persists, contact our customer support.
         # Whoops! Cannot reach User Daemon.
         words = ['support', 'oops', 'cannot']
-        return (2, output) if any(x in output for x in words) else (0, output)
-    except subprocess.CalledProcessError as CPE:
-        return (CPE.returncode, output)
+        failed = any(x in output for x in words)
+        metrics.observe_command(name, monotonic() - start, failed=failed)
+        return (2, output) if failed else (0, output)
+    except OSError as e:
+        metrics.observe_command(name, monotonic() - start, failed=True)
+        return (1, str(e))
 
 def is_loggedin():
     """
     Check if we are logged into NordVPN.
     """
-    # Use shell=True to return stdout and stderr together
-    output = subprocess.check_output('LANG=C nordvpn login &', shell=True, timeout=2).decode('utf-8')
-    return True if 'logged' in output else False
+    # "You are already logged in." (nordvpn gets no input: it never waits for credentials)
+    return_code, output = _run_nordvpn(['login'], timeout=2)
+    return 'logged' in output.lower()
 
-def get_connection_status():
+def service_get(request, timeout=2):
     """
-    Get connection status.
+    Ask the shared cache service (when it is running).
+    Argument: "status" or "api <path>"
+    Returns (data, age in seconds) or None
+    """
+    if not exists(SERVICE_SOCKET):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(SERVICE_SOCKET)
+            sock.sendall('{0}\n'.format(request).encode('utf-8'))
+            chunks = []
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        answer = json.loads(b''.join(chunks).decode('utf-8'))
+    except (OSError, ValueError) as e:
+        logger.debug('Cache service unavailable: %s', e)
+        return None
+    if 'error' in answer:
+        logger.debug('Cache service: %s', answer['error'])
+        return None
+    return (answer['data'], answer['age'])
+
+def api_get(path, timeout=5, shared=True):
+    """
+    Get a NordVPN API response (JSON text).
+    The shared cache service is used when it runs and the default API is configured
+    (shared: False for answers that depend on the connection).
+    Returns an empty string when the API cannot be reached.
+    """
+    api_url = get_config().get('api_url')
+    if shared and api_url == SERVICE_API_URL:
+        start = monotonic()
+        answer = service_get('api {0}'.format(path))
+        if answer is not None:
+            metrics.observe_api('service', monotonic() - start)
+            metrics.count_cache('service', True)
+            return answer[0]
+        metrics.count_cache('service', False)
+    if not api_reachable():
+        # Do not wait for a timeout
+        logger.debug('Skip API request %s: offline or blocked by the killswitch', path)
+        return ''
+    logger.debug('Public NordVPN API request: %s%s', api_url, path)
+    start = monotonic()
+    try:
+        return_code, data = _execute(['curl', '--silent', api_url + path], timeout)
+        if return_code != 0:
+            raise subprocess.CalledProcessError(return_code, 'curl')
+    except (subprocess.SubprocessError, OSError) as e:
+        metrics.observe_api('api', monotonic() - start,
+                            timeout=isinstance(e, subprocess.TimeoutExpired), failed=True)
+        logger.warning('Cannot reach the NordVPN API: %s', e)
+        return ''
+    metrics.observe_api('api', monotonic() - start)
+    return data
+
+def get_insights(timeout=5):
+    """
+    Public IP, location and protection of this connection.
+    Returns a dictionary (empty when the API cannot be reached)
+    """
+    data = api_get(INSIGHTS_PATH, timeout, shared=False)
+    try:
+        insights = json.loads(data) if data else {}
+    except ValueError as e:
+        logger.warning('Cannot read the insights: %s', e)
+        return {}
+    return insights if isinstance(insights, dict) else {}
+
+def http_open(url, data=None, headers=None, timeout=10):
+    """
+    Open a URL that is not the NordVPN API (speed tests), like api_get:
+    skipped when offline or blocked by the killswitch, rate limited,
+    recorded and measured (metrics source: http).
+    Arguments: url, data: request body (an iterable is streamed: POST),
+               headers dictionary, timeout in seconds
+    Returns the response (read it in a with statement)
+    Raises OSError (RateLimited when the rate limit is exceeded)
+    """
+    if not api_reachable():
+        raise OSError('offline or blocked by the killswitch')
+    if not api_bucket.acquire(timeout):
+        raise RateLimited('API rate limit')
+    request = urllib.request.Request(url, data=data, headers=headers or {})
+    command = ['http', request.get_method(), url]
+    start = time()
+    try:
+        response = urllib.request.urlopen(request, timeout=timeout)
+    except OSError as e:
+        metrics.observe_api('http', time() - start, timeout=isinstance(e, socket.timeout), failed=True)
+        recorder.record('command', command=command, returncode=None, output='',
+                        duration=time() - start, start=start)
+        raise
+    metrics.observe_api('http', time() - start)
+    recorder.record('command', command=command, returncode=response.status, output='',
+                    duration=time() - start, start=start)
+    return response
+
+def jq(data, jq_filter, timeout=5):
+    """
+    Filter JSON text with jq.
+    Returns the raw output (empty on errors).
+    """
+    if not data:
+        return ''
+    try:
+        return subprocess.run(['jq', '--raw-output', jq_filter], input=data.encode('utf-8'),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              timeout=timeout).stdout.decode('utf-8')
+    except (subprocess.SubprocessError, OSError) as e:
+        logger.warning('Cannot execute jq: %s', e)
+        return ''
+
+def get_status_text():
+    """
+    Output of nordvpn status.
+    From the shared cache service when its status is recent and newer
+    than the last own state change (not while connecting or disconnecting).
+    """
+    answer = None
+    if network_state['status'] not in ('connecting', 'disconnecting'):
+        answer = service_get('status')
+    if answer is not None and answer[1] < SERVICE_STATUS_MAX_AGE and \
+       time() - answer[1] > network_state['changed']:
+        metrics.count_cache('status', True)
+        return ANSI_ESCAPE.sub('', answer[0]).replace('\r', '').strip()
+    metrics.count_cache('status', False)
+    return _run_nordvpn(['status'], timeout=5)[1]
+
+def parse_connection_status(text):
+    """
+    Connection status in the output of nordvpn status.
     """
     status = 'no_internet'
-    command = "LANG=C nordvpn status | grep -i status: | awk '{print $NF}'"
-    output = subprocess.check_output(command, shell=True).decode('utf-8').lower()
+    output = ''
+    for line in text.split('\n'):
+        if 'status:' in line.lower():
+            output = line.split()[-1].lower()
     if output:
         if 'discon' in output:
             status = 'disconnecting' if 'ing' in output else 'disconnected'
         else:
             status = 'connecting' if 'ing' in output else 'connected'
-        if not exists(join(conf_path, 'has_account')):
-            # Save an has_account file
-            if status == 'connected':
-                Path(join(conf_path, 'has_account')).touch()
+    return status
+
+def get_settings_text():
+    """
+    Output of nordvpn settings.
+    """
+    return _run_nordvpn(['settings'], timeout=5)[1]
+
+def get_connection_status():
+    """
+    Get connection status.
+    """
+    status = parse_connection_status(get_status_text())
+    if watchdog.unresponsive:
+        status = 'unresponsive'
+    network_state['status'] = status
+    if status == 'connected' and not get_config().get('has_account'):
+        set_has_account()
+    metrics.set_state(status)
     return status
 
 def is_connected():
@@ -88,37 +464,42 @@ def needs_nordlynx():
     """
     Check if nordlynx is used.
     """
-    command = 'LANG=C nordvpn settings | grep -i protocol'
-    # Do not use stdout=PIPE or stderr=PIPE with subprocess.call.
-    # The child process will block if it generates enough output to a pipe to fill up the OS pipe buffer as the pipes are not being read from.
-    return_code = subprocess.call(command, shell=True)
-    return False if return_code == 0 else True
+    # NordLynx has no protocol setting
+    return 'protocol' not in get_settings_text().lower()
     
 def has_account():
     """
     Check if current user has an account.
     """
-    if exists(join(conf_path, 'has_account')):
+    if get_config().get('has_account'):
         return True
     elif is_loggedin():
+        set_has_account()
         return True
     return False
     
+def set_has_account():
+    """
+    Flag that the current user has an account.
+    """
+    get_config().set(has_account=True)
+
 def is_wireguard_installed():
     """
     Check if WireGuard is installed for NordLynx.
     """
-    command = 'dpkg -l wireguard-dkms | grep ^ii'
-    return_code = subprocess.call(command, shell=True)
-    return True if return_code == 0 else False
+    try:
+        return_code, output = _execute(['dpkg-query', '--show', '--showformat=${Status}', 'wireguard-dkms'],
+                                       timeout=5, merge_stderr=True)
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+    return return_code == 0 and 'install ok installed' in output
 
 def uses_nordlynx():
     """
     Check if nordlynx is used.
     """
-    command = 'LANG=C nordvpn status | grep -i nordlynx'
-    return_code = subprocess.call(command, shell=True)
-    return True if return_code == 0 else False
+    return 'nordlynx' in get_status_text().lower()
     
 def rate_connection(rate):
     """
@@ -126,32 +507,44 @@ def rate_connection(rate):
     """
     if rate > 5: rate = 5
     if rate < 1: rate = 1
-    print(('--------- rate_connection ---------'))
-    print(('Previous connection rate: {0}'.format(rate)))
-    command = 'LANG=C nordvpn rate {}'.format(rate)
-    process = subprocess.Popen(command, stdout=subprocess.PIPE, shell=True)
-    return_code = process.wait()
-    return (return_code, process.stdout.read().decode('utf-8').replace('\r', '').replace('-', '').strip())
+    logger.info('Previous connection rate: %d', rate)
+    return_code, output = _run_nordvpn(['rate', str(rate)])
+    return (return_code, output.replace('-', '').strip())
 
 def get_fastest_server():
     """
     Get the fastest server
+    Returns an empty string when no server was found
     """
-    return get_recommended_servers()[0]
+    servers = get_recommended_servers()
+    return servers[0] if servers else ''
     
-def get_countries():
+def get_countries(refresh=False):
     """
     Get a list of country ids, names and codes
-    """
+    The list is cached for CATALOGUE_MAX_AGE seconds
+    Argument: refresh: ignore the cache
+    """
+    cached = load_cache('countries')
+    if cached and not refresh and cache_age('countries') < CATALOGUE_MAX_AGE:
+        metrics.count_cache('countries', True)
+        return cached
+    metrics.count_cache('countries', False)
     countries = []
+    if not network_state['online']:
+        # Better outdated than nothing
+        return cached or countries
     try:
-        output = subprocess.check_output(['nordvpn', 'countries'], timeout=5).decode('utf-8')
+        return_code, output = _execute(['nordvpn', 'countries'], timeout=5)
+        if return_code != 0:
+            return cached or countries
         output = output.replace('\r', '').replace('-', '').replace('_', ' ').strip()
         # Split on tabs, new lines and commas and remove empty strings from list (filter)
         nordvpn_countries = list(filter(None, sorted(re.split('\t|\n|, ', output))))
-        command = "LANG=C curl --silent \"https://api.nordvpn.com/v1/servers/countries\" | jq --raw-output '.[] | [.id, .name, .code] | @tsv' 2>/dev/null | egrep -i '{0}'".format('|'.join(nordvpn_countries))
-        print(('get_countries - public NordVPN API command: {0}'.format(command)))
-        output = subprocess.check_output(command, shell=True, timeout=5).decode('utf-8')
+        output = jq(api_get('/servers/countries'), '.[] | [.id, .name, .code] | @tsv')
+        # Only the countries nordvpn knows
+        known = re.compile('|'.join(nordvpn_countries), re.IGNORECASE)
+        output = '\n'.join(line for line in output.split('\n') if known.search(line))
         if output:
             # Split in lines
             output = output.split('\n')
@@ -162,85 +555,289 @@ def get_countries():
                     countries.append([int(country_list[0].strip()), country_list[1].replace(' ', '_'), country_list[2].lower()])
     except:
         pass
-    return countries
+    if countries:
+        save_cache('countries', countries)
+    return countries or cached or []
     
+def get_cities(refresh=False, cache_only=False):
+    """
+    Get a list of cities with their country and location:
+    [country id, country name, country code, city, latitude, longitude]
+    The list is cached for CATALOGUE_MAX_AGE seconds
+    Arguments: refresh: ignore the cache, cache_only: never call the API
+    """
+    cached = load_cache('cities')
+    if cache_only or (cached and not refresh and cache_age('cities') < CATALOGUE_MAX_AGE):
+        metrics.count_cache('cities', bool(cached))
+        return cached or []
+    metrics.count_cache('cities', False)
+    if not network_state['online']:
+        return cached or []
+    cities = []
+    try:
+        output = jq(api_get('/servers/countries'),
+                    '.[] | .id as $id | .name as $name | .code as $code | .cities[] | [$id, $name, $code, .name, .latitude, .longitude] | @tsv')
+        for line in output.split('\n'):
+            fields = line.split('\t')
+            if len(fields) == 6:
+                try:
+                    cities.append([int(fields[0]), fields[1].replace(' ', '_'), fields[2].lower(),
+                                   fields[3].replace(' ', '_'), float(fields[4]), float(fields[5])])
+                except ValueError:
+                    continue
+    except (subprocess.SubprocessError, OSError) as e:
+        logger.warning('Cannot get the cities: %s', e)
+    if cities:
+        save_cache('cities', cities)
+    return cities or cached or []
+
 def get_recommended_country():
     """
     Get country of fastest server
     Used to pre-select country in countries list
     """
-    command = "LANG=C curl --silent \"https://api.nordvpn.com/v1/servers/recommendations\" | jq --raw-output 'first | .locations[].country.name'"
-    print(('get_recommended_country - public NordVPN API command: {0}'.format(command)))
-    try:
-        return subprocess.check_output(command, shell=True, timeout=5).decode('utf-8').replace('\n', '')
-    except:
+    if not network_state['online']:
         return ''
+    return jq(api_get('/servers/recommendations'), 'first | .locations[].country.name').replace('\n', '')
     
-def get_account_info():
+def get_account_info(refresh=False):
     """
     Get user account information
-    """
+    The information is cached and only refreshed when
+    the account expires within ACCOUNT_REFRESH_DAYS
+    Argument: refresh: ignore the cache (e.g. after login)
+    """
+    account = load_cache('account')
+    if account and not refresh:
+        days = get_account_expiry_days(account)
+        # Near expiry: refresh once a day to pick up a renewal
+        if days is None or days > ACCOUNT_REFRESH_DAYS or cache_age('account') < 86400:
+            metrics.count_cache('account', True)
+            return (account['email'], account['expires'])
+    metrics.count_cache('account', False)
     email = ''
     expires = ''
+    expiry_date = ''
     try:
-        output = subprocess.check_output(['nordvpn', 'account'], timeout=5).decode('utf-8').strip().split('\n')
+        return_code, output = _execute(['nordvpn', 'account'], timeout=5)
+        output = output.strip().split('\n')
         for line in output:
             if 'mail' in line.lower():
                 email = line.split(':')[1].strip()
             elif 'expires' in line.lower():
                 expires = line.split('(')[1].replace(')', '').strip()
+                expiry_date = parse_expiry_date(expires)
                 expires = 'Account {0}'.format(expires[0].lower() + expires[1:])
     except:
         pass
+    if email:
+        save_cache('account', {'email': email, 'expires': expires, 'expiry_date': expiry_date})
+    elif account:
+        # Keep the cached information when nordvpn does not answer
+        return (account['email'], account['expires'])
     return (email, expires)
-    
+
+def invalidate_account_info():
+    """
+    Remove the cached account information (login changed)
+    """
+    single_flight.forget()
+    try:
+        remove(join(cache_path, 'account.json'))
+    except OSError:
+        pass
+
+def parse_expiry_date(expires):
+    """
+    Parse the date from "Expires on Jan 1st, 2024"
+    Returns an ISO date string or an empty string
+    """
+    match = re.search(r'([a-z]{3})[a-z]*\s+(\d+)(st|nd|rd|th)?,?\s+(\d{4})', expires.lower())
+    # nordvpn writes English month names: %b would depend on the locale (LC_TIME)
+    if match and match.group(1) in MONTHS:
+        try:
+            return date(int(match.group(4)), MONTHS.index(match.group(1)) + 1, int(match.group(2))).isoformat()
+        except ValueError:
+            pass
+    return ''
+
+def get_account_expiry_days(account=None):
+    """
+    Number of days until the account expires (None if unknown)
+    Argument: optional account dictionary from the cache
+    """
+    if account is None:
+        get_account_info()
+        account = load_cache('account')
+    if not account or not account.get('expiry_date'):
+        return None
+    return (datetime.strptime(account['expiry_date'], '%Y-%m-%d').date() - date.today()).days
+
 def get_status_info():
     """
     Get status information
     """
-    text = subprocess.check_output(['nordvpn', 'status'], timeout=5).decode('utf-8')
-    return text.replace('\r', '').replace('-', '').strip()
+    return get_status_text().replace('-', '').strip()
     
-def get_recommended_servers(country_code=-1):
+def get_status_dict():
+    """
+    Get the status information as a dictionary
+    Keys are lower case without spaces: status, hostname, country, currenttechnology, ...
+    """
+    status = {}
+    for line in get_status_text().split('\n'):
+        if ':' in line:
+            key, value = line.split(':', 1)
+            status[key.lower().replace(' ', '').replace('-', '')] = value.strip()
+    return status
+
+def get_recommended_servers(country_code=-1, nordlynx=None):
     """
     Get recommended servers
-    Argument: optional country code
+    Arguments: optional country code,
+               nordlynx: only NordLynx servers (default: for the current technology)
     """
+    if not network_state['online']:
+        return []
     filter = ''
     if country_code > -1:
         filter = '?filters\[country_id\]={0}'.format(country_code)
     # Get recommended servers
-    if needs_nordlynx():
-        command = "LANG=C curl -s 'https://api.nordvpn.com/v1/servers/recommendations{filter}' | jq --raw-output 'limit(10;.[]) | select(.load > 0) | select(.technologies[].identifier == \"wireguard_udp\") | .hostname' 2>/dev/null".format(filter=filter)
-    else:
-        command = "LANG=C curl -s 'https://api.nordvpn.com/v1/servers/recommendations{filter}' | jq --raw-output 'limit(10;.[]) | select(.load > 0) | .hostname' 2>/dev/null".format(filter=filter)
-    print(('get_recommended_servers - public NordVPN API command: {0}'.format(command)))
-    output = subprocess.check_output(command, shell=True, timeout=5).decode('utf-8').strip()
+    if nordlynx is None:
+        nordlynx = needs_nordlynx()
+    jq_filter = 'limit(10;.[]) | select(.load > 0) | '
+    if nordlynx:
+        jq_filter += 'select(.technologies[].identifier == "wireguard_udp") | '
+    output = jq(api_get('/servers/recommendations{0}'.format(filter)), jq_filter + SERVER_FIELDS).strip()
     # Init servers list
     servers = []
-    lines = sorted(output.split())
+    locations = {}
+    lines = sorted(output.split('\n'))
     for line in lines:
+        fields = line.split('\t')
+        if not fields[0].strip():
+            continue
         # Only keep the server name without nordvpn.com
-        servers.append(line.split('.')[0])
+        server = fields[0].strip().split('.')[0]
+        if server not in servers:
+            servers.append(server)
+        try:
+            locations[server] = [float(fields[1]), float(fields[2]), fields[3].strip().lower()]
+        except (IndexError, ValueError):
+            pass
+    if locations:
+        # Remember where the servers are for the geo index
+        known_locations = get_server_locations()
+        if any(known_locations.get(server) != location for server, location in locations.items()):
+            known_locations.update(locations)
+            save_cache('server_locations', known_locations)
     return servers
+
+def get_server_locations():
+    """
+    Get the locations of the servers seen in the recommendations
+    Returns a dictionary: server: [latitude, longitude, country code]
+    """
+    return load_cache('server_locations') or {}
     
+def parse_meshnet_peers(output):
+    """
+    Parse the output of nordvpn meshnet peer list
+    Returns a list of peer dictionaries: hostname, nickname, ip, os,
+    online, local_peer (a device of the user's own account, listed under
+    "Local Peers") and the MESHNET_PERMISSIONS (bool)
+    """
+    peers = []
+    peer = None
+    section = ''
+    for line in output.split('\n'):
+        if ':' not in line:
+            continue
+        key, value = line.split(':', 1)
+        key = key.lower().replace(' ', '').replace('-', '').replace('_', '')
+        value = value.strip()
+        if not value:
+            # Section title: This device, Local Peers, External Peers
+            section = key
+            peer = None
+            continue
+        if section not in ('localpeers', 'externalpeers') or key not in MESHNET_FIELDS:
+            continue
+        field = MESHNET_FIELDS[key]
+        if field == 'hostname':
+            peer = {'hostname': value, 'nickname': '', 'ip': '', 'os': '',
+                    'online': False, 'local_peer': section == 'localpeers'}
+            peer.update({permission: False for permission in MESHNET_PERMISSIONS})
+            peers.append(peer)
+        elif peer is None:
+            continue
+        elif field == 'status':
+            peer['online'] = value.lower() in ('connected', 'online')
+        elif field in MESHNET_PERMISSIONS:
+            peer[field] = value.lower() in ('enabled', 'allowed', 'yes')
+        else:
+            peer[field] = '' if value == '-' else value
+    return peers
+
+def get_meshnet_peers(refresh=False):
+    """
+    Get the meshnet peers (see parse_meshnet_peers)
+    The output is only parsed again when it changed
+    Argument: refresh: do not use the cache
+    Returns None when meshnet is not available
+    """
+    if not refresh and meshnet_state['output'] is not None:
+        return meshnet_state['peers']
+    return_code, output = _run_nordvpn(['meshnet', 'peer', 'list'])
+    if return_code != 0 or 'not enabled' in output.lower():
+        meshnet_state['output'] = None
+        meshnet_state['peers'] = []
+        return None
+    if output != meshnet_state['output']:
+        meshnet_state['peers'] = parse_meshnet_peers(output)
+        meshnet_state['output'] = output
+        save_cache('meshnet', meshnet_state['peers'])
+    return meshnet_state['peers']
+
+def get_cached_meshnet_peers():
+    """
+    Get the peers of the last meshnet peer list (also from a previous session)
+    """
+    if meshnet_state['output'] is not None:
+        return meshnet_state['peers']
+    return load_cache('meshnet') or []
+
+def set_meshnet_permissions(changes):
+    """
+    Change meshnet peer permissions in one batch
+    Argument: list of (hostname, permission, allow) tuples
+    Only changes that differ from the last peer list are executed
+    Returns a list of (hostname, permission, output) tuples that failed
+    """
+    peers = {peer['hostname']: peer for peer in get_cached_meshnet_peers()}
+    failed = []
+    for hostname, permission, allow in changes:
+        if permission not in MESHNET_PERMISSIONS:
+            failed.append((hostname, permission, 'unknown permission'))
+            continue
+        if hostname in peers and peers[hostname][permission] == allow:
+            continue
+        return_code, output = _run_nordvpn(['meshnet', 'peer', permission,
+                                            'allow' if allow else 'deny', hostname])
+        if return_code != 0:
+            failed.append((hostname, permission, output))
+    # Peer list is outdated
+    meshnet_state['output'] = None
+    return failed
+
 def load_order_page():
     """
-    Get order page URL from ~/.config/nordvpn/indicator.conf
-    Check for ORDER_LINK variable
+    Get order page URL (order_link) from the configuration
     Then load order page in default browser
     """
     return_code = 1
     try:
-        distro = get_distrib_id().upper()
-        order_conf = join(conf_path, 'indicator.conf')
-        config = get_config_dict(order_conf)
-        order_url = config.get('ORDER_LINK', '')
-        # If no order url was configured, save default in order_conf
-        if not order_url:
-            order_url = 'https://join.nordvpn.com/order/'
-            with open(order_conf, 'w') as f:
-                f.write('ORDER_LINK="{}"'.format(order_url))
+        order_url = get_config().get('order_link')
         # Open url in browser
         if order_url:
             return_code = subprocess.call(['xdg-open', '{0}'.format(order_url)])
@@ -248,31 +845,47 @@ def load_order_page():
         return_code = 1
     return return_code
 
-def get_distrib_id():
-    """
-    Get distribution ID from /etc/os-release or /etc/lsb-release
-    """
-    val = ''
-    for f in glob('/etc/*release'):
-        conf = get_config_dict(f)
-        val = conf.get('ID', '')
-        if not val:
-            val = conf.get('DISTRIB_ID', '')
-        if val: break
-    return val
-
-# Read keys from file
-def get_config_dict(file, key_value=re.compile(r'^\s*(\w+)\s*=\s*["\']?(.*?)["\']?\s*(#.*)?$')):
-    """
-    Returns POSIX config file (key=value, no sections) as dict.
-    Assumptions: no multiline values, no value contains '#'.
-    """
-    d = {}
-    with open(file) as f:
-        for line in f:
-            try:
-                key, value, _ = key_value.match(line).groups()
-            except AttributeError:
-                continue
-            d[key] = value
-    return d
+def load_cache(name, max_age=None):
+    """
+    Load cached data from cache_path/name.json
+    Arguments: cache name, optional maximum age in seconds
+    Returns None if there is no (recent) cache
+    """
+    age = cache_age(name)
+    if age is None or (max_age is not None and age >= max_age):
+        return None
+    try:
+        with open(join(cache_path, '{0}.json'.format(name)), 'r') as f:
+            return json.load(f)
+    except:
+        return None
+
+def cache_age(name):
+    """
+    Age in seconds of cache_path/name.json (None if it does not exist)
+    """
+    mtime = cache_mtime(name)
+    return None if mtime is None else time() - mtime
+
+def cache_mtime(name):
+    """
+    Modification time of cache_path/name.json (None if it does not exist)
+    """
+    try:
+        return getmtime(join(cache_path, '{0}.json'.format(name)))
+    except OSError:
+        return None
+
+def save_cache(name, data):
+    """
+    Save data to cache_path/name.json
+    Write to a temporary file first to never leave a partial cache
+    """
+    cache_file = join(cache_path, '{0}.json'.format(name))
+    try:
+        makedirs(cache_path, exist_ok=True)
+        with open(cache_file + '.tmp', 'w') as f:
+            json.dump(data, f)
+        replace(cache_file + '.tmp', cache_file)
+    except Exception as e:
+        logger.warning('Cannot save %s: %s', cache_file, e)
@@ -0,0 +1,158 @@
+#! /usr/bin/env python3
+
+"""
+Desktop notifications
+One notification per category is reused and updated in place.
+Notifications of a category that arrive within COALESCE_WINDOW are
+merged into one, and identical notifications are not shown again
+within REPEAT_INTERVAL (they are counted instead). Answers to a user
+action are forced: they are always shown.
+Notifications are posted by a worker thread: callers never wait
+for the notification server.
+"""
+
+import gi
+gi.require_version('Notify', '0.7')
+from gi.repository import Notify, GLib
+from threading import Thread, Condition
+from time import monotonic
+import logging
+
+# i18n: shared catalogue
+from .i18n import _
+
+# Seconds to wait for more notifications of the same category
+COALESCE_WINDOW = 0.5
+# Seconds before an identical notification is shown again
+REPEAT_INTERVAL = 60
+# Seconds to keep the number of suppressed repeats of a notification
+FORGET_INTERVAL = 3600
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationManager():
+    def __init__(self, app_name, window=COALESCE_WINDOW, repeat_interval=REPEAT_INTERVAL):
+        """
+        Keeps the notifications and the queued notifications per category.
+        """
+        self.app_name = app_name
+        self.window = window
+        self.repeat_interval = repeat_interval
+        # category: Notify.Notification
+        self.notifications = {}
+        # category: queued notification
+        self.pending = {}
+        # (category, title, text): {'time': last shown, 'count': suppressed since}
+        self.shown = {}
+        self.condition = Condition()
+        self.thread = None
+        self.stopped = False
+        # Benchmark metrics
+        self.posted = 0
+        self.suppressed = 0
+
+    def start(self):
+        """
+        Start the worker thread.
+        """
+        Notify.init(self.app_name)
+        self.thread = Thread(target=self.run, name='notify', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Post the queued notifications and stop.
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+        logger.info('Notifications posted: %d, suppressed: %d', self.posted, self.suppressed)
+        Notify.uninit()
+
+    def notify(self, category, title, text='', icon='dialog-information', force=False):
+        """
+        Queue a notification (from any thread).
+        Arguments: category, title, text, icon name,
+                   force: show it even when it was just shown (user request)
+        """
+        with self.condition:
+            now = monotonic()
+            self.forget(now)
+            key = (category, title, text)
+            shown = self.shown.get(key)
+            if not force and shown is not None and now - shown['time'] < self.repeat_interval:
+                shown['count'] += 1
+                self.suppressed += 1
+                return
+            pending = self.pending.get(category)
+            if pending is not None:
+                # Coalesce: the last one wins, but is not delayed further
+                self.suppressed += 1
+                if (pending['title'], pending['text']) == (title, text):
+                    pending['count'] += 1
+                else:
+                    pending.update(title=title, text=text, icon=icon, count=1)
+                return
+            self.pending[category] = {'title': title, 'text': text, 'icon': icon,
+                                      'due': now + self.window, 'count': 1}
+            self.condition.notify()
+
+    def forget(self, now):
+        """
+        Forget what can be shown again and, after FORGET_INTERVAL,
+        the suppressed repeats (with the condition held).
+        """
+        self.shown = {key: shown for key, shown in self.shown.items()
+                      if now - shown['time'] < (FORGET_INTERVAL if shown['count'] else self.repeat_interval)}
+
+    def run(self):
+        """
+        Worker thread: post the notifications that are due.
+        """
+        while True:
+            with self.condition:
+                while not self.stopped:
+                    now = monotonic()
+                    due = [category for category, pending in self.pending.items() if pending['due'] <= now]
+                    if due:
+                        break
+                    timeout = min((pending['due'] for pending in self.pending.values()), default=None)
+                    self.condition.wait(None if timeout is None else timeout - now)
+                if self.stopped:
+                    due = list(self.pending)
+                posts = []
+                for category in due:
+                    pending = self.pending.pop(category)
+                    key = (category, pending['title'], pending['text'])
+                    previous = self.shown.get(key)
+                    # Earlier suppressed repeats
+                    count = pending['count'] + (previous['count'] if previous else 0)
+                    self.shown[key] = {'time': monotonic(), 'count': 0}
+                    posts.append((category, pending, count))
+                self.forget(monotonic())
+                stopped = self.stopped
+            for category, pending, count in posts:
+                self.post(category, pending['title'], pending['text'], pending['icon'], count)
+            if stopped:
+                return
+
+    def post(self, category, title, text, icon, count=1):
+        """
+        Show or update the notification of a category.
+        """
+        if count > 1:
+            text = '{0}\n({1})'.format(text, _('{0} times').format(count)) if text else _('{0} times').format(count)
+        notification = self.notifications.get(category)
+        try:
+            if notification is None:
+                notification = Notify.Notification.new(title, text, icon)
+                self.notifications[category] = notification
+            else:
+                notification.update(title, text, icon)
+            notification.show()
+            self.posted += 1
+        except GLib.Error as e:
+            logger.warning('Cannot show notification %s: %s', title, e.message)
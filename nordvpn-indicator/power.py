@@ -0,0 +1,102 @@
+#! /usr/bin/env python3
+
+"""
+Power state monitor
+Listens on the system bus to UPower to know if we are running
+on battery and what the current charge is.
+"""
+
+from gi.repository import Gio, GLib
+import logging
+
+UPOWER_NAME = 'org.freedesktop.UPower'
+UPOWER_PATH = '/org/freedesktop/UPower'
+UPOWER_DISPLAY_PATH = '/org/freedesktop/UPower/devices/DisplayDevice'
+PROPERTIES_IFACE = 'org.freedesktop.DBus.Properties'
+
+logger = logging.getLogger(__name__)
+
+
+class PowerMonitor():
+    def __init__(self, callback, threshold=20, bus_address=None):
+        """
+        Calls callback(low_power) when the low power state changes.
+        low_power: on battery with a charge below threshold (percent)
+        """
+        self.callback = callback
+        self.threshold = threshold
+        self.bus_address = bus_address
+        self.on_battery = False
+        self.percentage = 100.0
+        self.bus = None
+        self.subscriptions = []
+
+    @property
+    def low_power(self):
+        """
+        On battery and below the threshold.
+        """
+        return self.on_battery and self.percentage < self.threshold
+
+    def start(self):
+        """
+        Connect to the bus and subscribe to property changes.
+        Without UPower we assume to be on AC.
+        """
+        try:
+            if self.bus_address:
+                flags = Gio.DBusConnectionFlags.AUTHENTICATION_CLIENT | \
+                        Gio.DBusConnectionFlags.MESSAGE_BUS_CONNECTION
+                self.bus = Gio.DBusConnection.new_for_address_sync(self.bus_address, flags, None, None)
+            else:
+                self.bus = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
+        except GLib.Error as e:
+            logger.warning('Cannot connect to bus: %s', e.message)
+            return False
+        for path in (UPOWER_PATH, UPOWER_DISPLAY_PATH):
+            self.subscriptions.append(self.bus.signal_subscribe(
+                UPOWER_NAME, PROPERTIES_IFACE, 'PropertiesChanged', path,
+                None, Gio.DBusSignalFlags.NONE, self.on_properties_changed))
+        on_battery = self.get_property(UPOWER_PATH, UPOWER_NAME, 'OnBattery')
+        if on_battery is not None:
+            self.on_battery = on_battery
+        percentage = self.get_property(UPOWER_DISPLAY_PATH, UPOWER_NAME + '.Device', 'Percentage')
+        if percentage is not None:
+            self.percentage = percentage
+        return True
+
+    def stop(self):
+        """
+        Unsubscribe from all signals.
+        """
+        if self.bus:
+            for subscription in self.subscriptions:
+                self.bus.signal_unsubscribe(subscription)
+        self.subscriptions = []
+
+    def get_property(self, path, interface, name):
+        """
+        Get a UPower property (None if UPower is not running).
+        """
+        try:
+            result = self.bus.call_sync(UPOWER_NAME, path, PROPERTIES_IFACE, 'Get',
+                                        GLib.Variant('(ss)', (interface, name)),
+                                        GLib.VariantType('(v)'),
+                                        Gio.DBusCallFlags.NONE, 1000, None)
+            return result.unpack()[0]
+        except GLib.Error:
+            return None
+
+    def on_properties_changed(self, connection, sender, path, interface, signal, parameters):
+        """
+        OnBattery or Percentage changed.
+        """
+        was_low_power = self.low_power
+        changed = parameters.unpack()[1]
+        if 'OnBattery' in changed:
+            self.on_battery = changed['OnBattery']
+        if 'Percentage' in changed:
+            self.percentage = changed['Percentage']
+        if was_low_power != self.low_power:
+            logger.info('Low power: %s', self.low_power)
+            self.callback(self.low_power)
@@ -0,0 +1,149 @@
+#! /usr/bin/env python3
+
+"""
+Connection profiles
+Named sets of NordVPN settings with a country or server, kept in
+~/.config/nordvpn/indicator.json:
+    "profiles": {
+        "Home": {"technology": "NordLynx", "killswitch": true, "country": "Netherlands"},
+        "Streaming": {"technology": "OpenVPN", "protocol": "TCP", "country": "United_States"}
+    }
+Switching only changes the settings that differ from the current ones.
+The server of each profile is resolved in the background
+so switching does not wait for the NordVPN API.
+"""
+
+from threading import Lock
+from time import monotonic
+import logging
+
+# Local modules
+from .nordvpn import get_countries, get_recommended_servers, nordvpn_set, set_killswitch
+from .config import get_config
+
+# Settings a profile can change, in the order they are applied
+# (technology first: protocol is only used by OpenVPN)
+PROFILE_SETTINGS = ('technology', 'protocol', 'cybersec', 'killswitch')
+# Resolved servers are used for this number of seconds
+TARGET_MAX_AGE = 600
+
+logger = logging.getLogger(__name__)
+
+
+def get_profiles():
+    """
+    Get the profiles as a dictionary: name: profile.
+    """
+    profiles = get_config().get('profiles')
+    return {name: profile for name, profile in profiles.items() if isinstance(profile, dict)}
+
+
+def normalize(setting, value):
+    """
+    Convert a profile value to the format of the current settings
+    (see NordVPNIndicator.fill_settings).
+    """
+    if setting in ('cybersec', 'killswitch'):
+        return value if isinstance(value, bool) else str(value).lower() in ('1', 'true', 'yes', 'enabled', 'on')
+    return str(value).lower().replace(' ', '').replace('-', '').replace('_', '')
+
+
+def get_profile_changes(profile, current_settings):
+    """
+    Get the settings of a profile that differ from the current settings.
+    Returns a list of (setting, value) tuples in the order to apply them.
+    """
+    changes = []
+    technology = normalize('technology', profile['technology']) if 'technology' in profile \
+                 else current_settings.get('technology', '')
+    for setting in PROFILE_SETTINGS:
+        if setting not in profile:
+            continue
+        if setting == 'protocol' and technology == 'nordlynx':
+            # NordLynx has no protocol setting
+            continue
+        if normalize(setting, profile[setting]) != current_settings.get(setting):
+            changes.append((setting, profile[setting]))
+    return changes
+
+
+def apply_profile(profile, current_settings):
+    """
+    Apply the changed settings of a profile.
+    The current settings dictionary is updated with the applied settings.
+    Returns True when all settings were applied.
+    """
+    success = True
+    for setting, value in get_profile_changes(profile, current_settings):
+        return_code, output = nordvpn_set(setting, value)
+        if return_code == 0:
+            current_settings[setting] = normalize(setting, value)
+            if setting == 'killswitch':
+                # API calls are skipped while the killswitch blocks them
+                set_killswitch(current_settings[setting])
+        else:
+            logger.warning('Cannot set %s to %s: %s', setting, value, output)
+            success = False
+    return success
+
+
+class ProfileTargets():
+    def __init__(self):
+        """
+        Servers resolved ahead of time per profile.
+        """
+        self.lock = Lock()
+        self.targets = {}
+
+    def resolve(self, profile):
+        """
+        Get the server (or country) to connect to for a profile.
+        """
+        if profile.get('server'):
+            return profile['server']
+        nordlynx = None
+        if 'technology' in profile:
+            nordlynx = normalize('technology', profile['technology']) == 'nordlynx'
+        country_id = -1
+        country = str(profile.get('country', '')).lower().replace(' ', '_')
+        if country:
+            for country_list in get_countries():
+                if country in (country_list[1].lower(), country_list[2]):
+                    country_id = country_list[0]
+                    break
+        servers = get_recommended_servers(country_id, nordlynx)
+        if servers:
+            return servers[0]
+        return profile.get('country', '')
+
+    def refresh(self):
+        """
+        Resolve the outdated targets of all profiles.
+        Called by the scheduler in a worker thread.
+        """
+        profiles = get_profiles()
+        now = monotonic()
+        with self.lock:
+            # Forget removed or changed profiles
+            self.targets = {name: target for name, target in self.targets.items()
+                            if profiles.get(name) == target['profile']}
+            outdated = [name for name in profiles
+                        if name not in self.targets or now - self.targets[name]['time'] > TARGET_MAX_AGE]
+        for name in outdated:
+            profile = profiles[name]
+            target = self.resolve(profile)
+            logger.debug('Profile %s resolves to %s', name, target)
+            with self.lock:
+                self.targets[name] = {'profile': profile, 'target': target, 'time': monotonic()}
+
+    def get_target(self, name):
+        """
+        Get the pre-resolved target of a profile (resolve it when there is none).
+        """
+        profile = get_profiles().get(name, {})
+        with self.lock:
+            target = self.targets.get(name)
+            if target is not None and target['profile'] == profile and \
+               monotonic() - target['time'] <= TARGET_MAX_AGE:
+                return target['target']
+        return self.resolve(profile)
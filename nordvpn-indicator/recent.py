@@ -0,0 +1,124 @@
+#! /usr/bin/env python3
+
+"""
+Recent and favourite servers
+Connections (also those made outside the indicator) are kept in
+~/.cache/nordvpn-indicator/recent.json:
+    server: {"country": ..., "last": time, "count": n, "quality": 0..1}
+Favourites are listed in indicator.json: "favourites": ["nl1", ...]
+Servers are ranked by recency (halved every RECENCY_HALF_LIFE seconds)
+and by the quality of their past sessions (verification and rating).
+Connecting to a listed server needs no API request.
+"""
+
+from threading import Lock
+from time import time
+import logging
+
+# Local modules
+from .nordvpn import load_cache, save_cache
+from .config import get_config
+
+# Servers to remember...
+MAX_RECENT = 20
+# ...and to show in the menu
+MENU_ITEMS = 8
+RECENCY_HALF_LIFE = 7 * 86400
+# Weight of the last session in the quality (moving average)
+QUALITY_WEIGHT = 0.3
+
+logger = logging.getLogger(__name__)
+_lock = Lock()
+
+
+def get_recent():
+    """
+    All remembered servers.
+    """
+    return load_cache('recent') or {}
+
+
+def add_connection(server, country='', quality=None):
+    """
+    Remember a successful connection.
+    Arguments: server (e.g. nl1), country name, quality of the session (0..1)
+    """
+    if not server:
+        return
+    with _lock:
+        recent = get_recent()
+        entry = recent.setdefault(server, {'country': country, 'last': 0, 'count': 0, 'quality': 0.5})
+        entry['last'] = time()
+        entry['count'] += 1
+        if country:
+            entry['country'] = country
+        if quality is not None:
+            entry['quality'] = (1 - QUALITY_WEIGHT) * entry['quality'] + QUALITY_WEIGHT * quality
+        if len(recent) > MAX_RECENT:
+            # Forget the lowest ranked servers, never a favourite
+            favourites = get_favourites()
+            ranked = sorted(recent, key=lambda name: (name in favourites, get_score(recent[name])))
+            for name in ranked[:len(recent) - MAX_RECENT]:
+                del recent[name]
+        save_cache('recent', recent)
+
+
+def rate_session(server, quality):
+    """
+    Add the quality of a session (e.g. the user's rating) to a server.
+    """
+    with _lock:
+        recent = get_recent()
+        if server in recent:
+            entry = recent[server]
+            entry['quality'] = (1 - QUALITY_WEIGHT) * entry['quality'] + QUALITY_WEIGHT * quality
+            save_cache('recent', recent)
+
+
+def get_last_server():
+    """
+    The server of the last connection (or an empty string).
+    """
+    recent = get_recent()
+    return max(recent, key=lambda name: recent[name]['last']) if recent else ''
+
+
+def get_score(entry, now=None):
+    """
+    Rank of a server: recency times quality.
+    """
+    age = max(0, (now or time()) - entry['last'])
+    return 0.5 ** (age / RECENCY_HALF_LIFE) * (0.5 + entry['quality'])
+
+
+def get_favourites():
+    return list(get_config().get('favourites'))
+
+
+def toggle_favourite(server):
+    """
+    Add or remove a favourite server.
+    Returns True when it is a favourite now
+    """
+    favourites = get_favourites()
+    if server in favourites:
+        favourites.remove(server)
+    else:
+        favourites.append(server)
+    get_config().set(favourites=favourites)
+    return server in favourites
+
+
+def get_ranked(count=MENU_ITEMS):
+    """
+    Servers for the menu: the favourites first, then the best ranked.
+    Returns a list of (server, country, favourite)
+    """
+    recent = get_recent()
+    favourites = get_favourites()
+    now = time()
+    ranked = [(server, recent.get(server, {}).get('country', ''), True) for server in favourites]
+    others = sorted((server for server in recent if server not in favourites),
+                    key=lambda server: get_score(recent[server], now), reverse=True)
+    ranked += [(server, recent[server]['country'], False) for server in others]
+    return ranked[:max(count, len(favourites))]
@@ -0,0 +1,67 @@
+#! /usr/bin/env python3
+
+"""
+Session recorder
+Records every nordvpn command and API request (command, start time,
+duration, return code and output) and the network changes as JSON lines:
+    "record_file": "~/nordvpn-session.jsonl"   (in indicator.json, empty: off)
+tools/replay.py replays a recording on a virtual clock.
+A recording contains the account e-mail address and the IP addresses
+of the session: do not share it unedited.
+"""
+
+from os.path import expanduser
+from os import open as os_open, fdopen, fchmod, O_WRONLY, O_APPEND, O_CREAT
+from threading import Lock
+from time import time
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+_lock = Lock()
+_recording = {'file': None}
+
+
+def start_recording(path):
+    """
+    Append the interactions to a file.
+    """
+    path = expanduser(path)
+    with _lock:
+        try:
+            # Only readable by the user: the recording holds personal data
+            _recording['file'] = fdopen(os_open(path, O_WRONLY | O_APPEND | O_CREAT, 0o600), 'a', buffering=1)
+            # Also for an existing recording
+            fchmod(_recording['file'].fileno(), 0o600)
+        except OSError as e:
+            logger.warning('Cannot record to %s: %s', path, e)
+            if _recording['file'] is not None:
+                _recording['file'].close()
+                _recording['file'] = None
+            return
+    logger.info('Recording the session to %s', path)
+
+
+def stop_recording():
+    """
+    Stop recording.
+    """
+    with _lock:
+        if _recording['file'] is not None:
+            _recording['file'].close()
+            _recording['file'] = None
+
+
+def record(kind, **values):
+    """
+    Write an event (command or network) when recording.
+    """
+    if _recording['file'] is None:
+        return
+    values.setdefault('start', time())
+    with _lock:
+        if _recording['file'] is not None:
+            try:
+                _recording['file'].write(json.dumps(dict(values, kind=kind)) + '\n')
+            except (OSError, ValueError) as e:
+                logger.warning('Cannot record: %s', e)
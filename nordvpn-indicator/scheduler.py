@@ -0,0 +1,202 @@
+#! /usr/bin/env python3
+
+"""
+Central scheduler for all periodic work.
+Tasks register with an interval per state. Due tasks are
+coalesced onto one shared GLib wakeup.
+All methods must be called from the GLib main loop.
+The clock and the timer can be replaced (tools/replay.py runs
+the scheduler on a virtual clock).
+"""
+
+from gi.repository import GLib
+from threading import Thread
+from time import monotonic
+import logging
+
+# Run a task early when it is due within this fraction of its interval...
+SLACK_FRACTION = 0.25
+# ...but never more than this number of seconds early
+MAX_SLACK = 5
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler():
+    def __init__(self, clock=monotonic):
+        """
+        Keeps track of the registered tasks and the shared timer.
+        Argument: clock: function that returns the time in seconds
+        """
+        self.clock = clock
+        self.tasks = {}
+        self.state = 'default'
+        # Reasons to pause (offline, low power, ...)
+        self.pause_reasons = set()
+        self.timer_id = None
+        # Benchmark metrics
+        self.start_time = self.clock()
+        self.wakeups = 0
+        self.runs = 0
+
+    def register(self, name, callback, intervals, threaded=True):
+        """
+        Register a periodic task.
+        Arguments: name, callback, dictionary with interval (seconds) per state,
+                   'default' is used for states that are not listed,
+                   None pauses the task in that state.
+                   threaded: run the callback in a worker thread
+        """
+        self.tasks[name] = {'callback': callback,
+                            'intervals': intervals,
+                            'threaded': threaded,
+                            'next_due': self.clock(),
+                            'running': False}
+        self._reschedule()
+
+    def unregister(self, name):
+        """
+        Remove a task.
+        """
+        self.tasks.pop(name, None)
+        self._reschedule()
+
+    def get_interval(self, name):
+        """
+        Get the interval of a task for the current state.
+        """
+        intervals = self.tasks[name]['intervals']
+        return intervals.get(self.state, intervals.get('default'))
+
+    def set_state(self, state):
+        """
+        Change the state: tasks that get a shorter interval
+        are moved forward.
+        """
+        if state == self.state:
+            return
+        self.state = state
+        now = self.clock()
+        for name, task in self.tasks.items():
+            interval = self.get_interval(name)
+            if interval is not None:
+                task['next_due'] = min(task['next_due'], now + interval)
+        self._reschedule()
+
+    def run_now(self, name=None):
+        """
+        Run one (or all) tasks now, even when paused.
+        """
+        for task_name, task in list(self.tasks.items()):
+            if name is None or name == task_name:
+                self._run(task)
+                interval = self.get_interval(task_name)
+                task['next_due'] = self.clock() + (interval or 0)
+        self._reschedule()
+
+    @property
+    def paused(self):
+        """
+        Paused for any reason.
+        """
+        return bool(self.pause_reasons)
+
+    def pause(self, reason='stop'):
+        """
+        Stop all wakeups until resume is called with the same reason.
+        """
+        self.pause_reasons.add(reason)
+        self._reschedule()
+
+    def resume(self, reason='stop'):
+        """
+        Restart the wakeups when there is no other reason to pause.
+        """
+        self.pause_reasons.discard(reason)
+        self._reschedule()
+
+    def stop(self):
+        """
+        Stop the scheduler and log the metrics.
+        """
+        self.pause()
+        self.tasks = {}
+        logger.info('Wakeups per hour: %.1f, task runs: %d', self.wakeups_per_hour(), self.runs)
+
+    def wakeups_per_hour(self):
+        """
+        Benchmark metric: number of timer wakeups per hour since start.
+        """
+        hours = (self.clock() - self.start_time) / 3600
+        return self.wakeups / hours if hours > 0 else 0
+
+    def _run(self, task):
+        """
+        Run a task, skip it when the previous run is still busy.
+        """
+        if task['running']:
+            return
+        self.runs += 1
+        if task['threaded']:
+            task['running'] = True
+            Thread(target=self._run_threaded, args=(task,), daemon=True).start()
+        else:
+            task['callback']()
+
+    def _run_threaded(self, task):
+        """
+        Worker thread of a threaded task.
+        """
+        try:
+            task['callback']()
+        finally:
+            task['running'] = False
+
+    def _reschedule(self):
+        """
+        (Re)start the shared timer for the first due task.
+        """
+        if self.timer_id is not None:
+            self.remove_timer(self.timer_id)
+            self.timer_id = None
+        if self.paused:
+            return
+        due = [task['next_due'] for name, task in self.tasks.items()
+               if self.get_interval(name) is not None]
+        if not due:
+            return
+        self.timer_id = self.add_timer(max(0, min(due) - self.clock()))
+
+    def add_timer(self, delay):
+        """
+        Call _on_wakeup after delay seconds.
+        Returns the timer id
+        """
+        if delay >= 1:
+            # Second timers are aligned with other wakeups system-wide
+            return GLib.timeout_add_seconds(int(delay), self._on_wakeup)
+        return GLib.timeout_add(int(delay * 1000), self._on_wakeup)
+
+    def remove_timer(self, timer_id):
+        """
+        Cancel a timer.
+        """
+        GLib.source_remove(timer_id)
+
+    def _on_wakeup(self):
+        """
+        Run all tasks that are (nearly) due.
+        """
+        self.timer_id = None
+        self.wakeups += 1
+        now = self.clock()
+        for name, task in list(self.tasks.items()):
+            interval = self.get_interval(name)
+            if interval is None:
+                continue
+            slack = min(interval * SLACK_FRACTION, MAX_SLACK)
+            if task['next_due'] - now <= slack:
+                self._run(task)
+                task['next_due'] = now + interval
+        self._reschedule()
+        return False
@@ -1,22 +1,23 @@
 #! /usr/bin/env python3
 
-APPINDICATOR_ID = 'nordvpn-indicator'
-
 import gi
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk
-from os.path import abspath, dirname, join, exists
-from os import remove
-import subprocess
+from os.path import abspath, dirname, join
+import logging
 
 # Local modules
 from .nordvpn import get_countries, get_recommended_servers, \
                     is_wireguard_installed, uses_nordlynx, \
-                    get_fastest_server, conf_path
+                    get_fastest_server, nordvpn_set, \
+                    nordvpn_connect, nordvpn_disconnect
+from .logviewer import NordVPNLogViewer
+from .config import get_config
+
+# i18n: shared catalogue
+from .i18n import _
 
-# i18n: http://docs.python.org/3/library/gettext.html
-import gettext
-_ = gettext.translation(APPINDICATOR_ID, fallback=True).gettext
+logger = logging.getLogger(__name__)
 
 
 class NordVPNSettings(Gtk.Dialog):
@@ -108,6 +109,14 @@ class NordVPNSettings(Gtk.Dialog):
                                                  'Deselect to use the default OpenVPN.'))
             grid.attach(self.chk_nordlynx, 0, grid_row, 1, 1)
             grid_row += 1
+        # Measured technology
+        self.chk_auto_technology = Gtk.CheckButton()
+        self.chk_auto_technology.set_label(_('Automatic technology'))
+        self.chk_auto_technology.set_tooltip_text(_('Measure NordLynx and OpenVPN UDP/TCP once per network\n'
+                                                    'and connect with the best one.'))
+        self.chk_auto_technology.connect('toggled', self.on_chk_auto_technology_toggled)
+        grid.attach(self.chk_auto_technology, 0, grid_row, 1, 1)
+        grid_row += 1
         # Logs
         lbl_logs = Gtk.Label(label=_('Logs'))
         lbl_logs.set_halign(Gtk.Align.START)
@@ -119,7 +128,7 @@ class NordVPNSettings(Gtk.Dialog):
         grid.attach(btn_viewlogs, 1, grid_row, 1, 1)
 
         # Pre-select from self.current_settings:
-        # dns=False, nordvpnsave='/home/arjen/.config/nordvpn', country='', autoconnect=True, protocol='', cybersec=True, notify=True, server='', killswitch=False
+        # dns=False, country='', autoconnect=True, protocol='', cybersec=True, notify=True, server='', killswitch=False
         if self.current_settings['autoconnect']:
             self.chk_autoconnect.set_active(True)
             if self.current_settings['server']:
@@ -141,6 +150,7 @@ class NordVPNSettings(Gtk.Dialog):
         elif self.show_nordlynx:
             self.nordlynx_selected = uses_nordlynx()
             self.chk_nordlynx.set_active(self.nordlynx_selected)
+        self.chk_auto_technology.set_active(get_config().get('auto_technology'))
         
         # Show the window
         self.show_all()
@@ -155,13 +165,9 @@ class NordVPNSettings(Gtk.Dialog):
         
     def on_btn_viewlogs_clicked(self, widget):
         """
-        Open log files if they exist
+        Show the log viewer
         """
-        logs = ['/var/log/nordvpn/daemon.log', 
-                '{0}/indicator.log'.format(conf_path)]
-        for log in logs:
-            if exists(log):
-                subprocess.call('xdg-open {}'.format(log), shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        NordVPNLogViewer().show_logs()
 
     def get_country_id(self, country):
         """
@@ -259,6 +265,17 @@ class NordVPNSettings(Gtk.Dialog):
             self.cmb_servers.set_active(0)
             self.cmb_servers.set_sensitive(False)
             
+    def on_chk_auto_technology_toggled(self, widget):
+        """
+        The technology and protocol are selected automatically
+        when the auto technology Gtk.Checkbutton is active.
+        """
+        manual = not widget.get_active()
+        if self.current_settings['protocol']:
+            self.cmb_protocol.set_sensitive(manual)
+        if self.show_nordlynx:
+            self.chk_nordlynx.set_sensitive(manual)
+
     def on_cmb_country_changed(self, widget=None):
         """
         Display recommended servers
@@ -283,23 +300,18 @@ class NordVPNSettings(Gtk.Dialog):
         # Get settings
         country = self.get_selected_combobox_value(self.cmb_countries)
         server = self.get_selected_combobox_value(self.cmb_servers)
-        country_save = join(self.current_settings['nordvpnsave'], 'country')
-        server_save = join(self.current_settings['nordvpnsave'], 'server')
-        if exists(country_save): remove(country_save)
-        if exists(server_save): remove(server_save)
         autoconnect = self.chk_autoconnect.get_active()
-        if autoconnect:
-            if server:
-                with open(server_save, 'w') as f:
-                    f.write(server)
-                if exists(country_save): remove(country_save)
-            elif country:
-                with open(country_save, 'w') as f:
-                    f.write(country)
-                if exists(server_save): remove(server_save)
+        # Save the server or country to auto connect to
+        if autoconnect and server:
+            get_config().set(server=server, country='')
+        elif autoconnect and country:
+            get_config().set(server='', country=country)
+        else:
+            get_config().set(server='', country='')
             
         cybersec = self.chk_cybersec.get_active()
         killswitch = self.chk_killswitch.get_active()
+        get_config().set(auto_technology=self.chk_auto_technology.get_active())
         
         protocol = ''
         nordlynx = None
@@ -312,32 +324,25 @@ class NordVPNSettings(Gtk.Dialog):
         if self.current_settings['autoconnect'] != autoconnect or \
            self.current_settings['server'] != server or  \
            self.current_settings['country'] != country:
-            connect_obj = server if server else country
-            command = 'nordvpn set autoconnect disabled; nordvpn set autoconnect enabled {}'.format(connect_obj) if autoconnect else 'nordvpn set autoconnect disabled'
-            print('Execute command: {}'.format(command))
-            return_code = subprocess.call(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            return_code, output = nordvpn_set('autoconnect', False)
+            if autoconnect:
+                return_code, output = nordvpn_set('autoconnect', True, server if server else country)
             if return_code == 0: settings_changed = True 
         if self.current_settings['cybersec'] != cybersec:
-            command = 'nordvpn set cybersec enabled' if cybersec else 'nordvpn set cybersec disabled'
-            print('Execute command: {}'.format(command))
-            return_code = subprocess.call(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            return_code, output = nordvpn_set('cybersec', cybersec)
             if return_code == 0: settings_changed = True 
         if self.current_settings['killswitch'] != killswitch:
-            command = 'nordvpn set killswitch enabled' if killswitch else 'nordvpn set killswitch disabled'
-            print('Execute command: {}'.format(command))
-            return_code = subprocess.call(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            return_code, output = nordvpn_set('killswitch', killswitch)
             if return_code == 0: settings_changed = True 
         if self.current_settings['protocol'] != protocol.lower():
-            command = 'nordvpn set protocol {}'.format(protocol).split()
-            print('Execute command: {}'.format(command))
-            return_code = subprocess.call(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            return_code, output = nordvpn_set('protocol', protocol)
             if return_code == 0: settings_changed = True 
         if nordlynx is not None:
             if nordlynx != self.nordlynx_selected:
-                command = 'nordvpn d; nordvpn set technology OpenVPN; nordvpn c {}'.format(get_fastest_server())
-                if nordlynx:
-                    command = 'nordvpn d; nordvpn set technology NordLynx; nordvpn c {}'.format(get_fastest_server())
-                print('Execute command: {}'.format(command))
-                return_code = subprocess.call(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                if return_code == 0: settings_changed = True 
+                server = get_fastest_server()
+                nordvpn_disconnect()
+                return_code, output = nordvpn_set('technology', 'NordLynx' if nordlynx else 'OpenVPN')
+                if return_code == 0:
+                    settings_changed = True
+                    nordvpn_connect(server)
         return settings_changed
@@ -0,0 +1,133 @@
+#! /usr/bin/env python3
+
+"""
+Request coalescing and rate limiting
+Identical read-only requests that run at the same time share one call
+and its result (single-flight); the result can be kept for a short time.
+API requests are limited by a token bucket.
+"""
+
+from threading import Lock, Event
+from time import monotonic, sleep
+import logging
+
+# API requests per second and burst
+API_RATE = 2
+API_BURST = 10
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimited(OSError):
+    """
+    The request was not sent: the rate limit would be exceeded.
+    """
+
+
+class SingleFlight():
+    def __init__(self, clock=monotonic):
+        """
+        Calls in flight and memoized results per key.
+        """
+        self.clock = clock
+        self.lock = Lock()
+        # key: {'event': Event, 'result': ..., 'error': exception or None}
+        self.calls = {}
+        # key: (expiry time, result)
+        self.memo = {}
+        # calls: executed, hits: memoized result, shared: joined a call in flight
+        self.counters = {'calls': 0, 'hits': 0, 'shared': 0}
+
+    def do(self, key, function, ttl=0):
+        """
+        Call function once for all concurrent callers with the same key.
+        Arguments: key, function without arguments,
+                   ttl: seconds to keep the result (0: only while in flight)
+        Returns the result (or raises the exception) of the shared call
+        """
+        with self.lock:
+            memo = self.memo.get(key)
+            if memo is not None and memo[0] > self.clock():
+                self.counters['hits'] += 1
+                return memo[1]
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = {'event': Event(), 'result': None, 'error': None}
+                self.calls[key] = call
+                self.counters['calls'] += 1
+            else:
+                self.counters['shared'] += 1
+        if not leader:
+            call['event'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+        try:
+            call['result'] = function()
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
+                if ttl and call['error'] is None:
+                    now = self.clock()
+                    self.memo = {key: memo for key, memo in self.memo.items() if memo[0] > now}
+                    self.memo[key] = (now + ttl, call['result'])
+            call['event'].set()
+        return call['result']
+
+    def forget(self):
+        """
+        Forget the memoized results (e.g. after a change).
+        """
+        with self.lock:
+            self.memo = {}
+
+
+class TokenBucket():
+    def __init__(self, rate=API_RATE, burst=API_BURST, clock=monotonic):
+        """
+        Allows rate requests per second with bursts of burst requests.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.lock = Lock()
+        self.tokens = burst
+        self.last = clock()
+        self.limited = 0
+
+    def acquire(self, timeout=0):
+        """
+        Take a token, wait for it at most timeout seconds.
+        Returns False when no token is available in time
+        """
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return True
+            wait = -self.tokens / self.rate
+            if wait > timeout:
+                self.tokens += 1
+                self.limited += 1
+                return False
+        # The token is reserved: wait for it outside the lock
+        sleep(wait)
+        return True
+
+
+_single_flight = SingleFlight()
+_api_bucket = TokenBucket()
+
+
+def get_single_flight():
+    return _single_flight
+
+
+def get_api_bucket():
+    return _api_bucket
@@ -0,0 +1,180 @@
+#! /usr/bin/env python3
+
+"""
+Throughput test through the VPN tunnel
+Measures time to first byte, jitter (of TTFB over a few small requests)
+and the download and upload goodput against a configurable endpoint:
+    "speedtest_download_url": "https://speed.cloudflare.com/__down?bytes={bytes}",
+    "speedtest_upload_url": "https://speed.cloudflare.com/__up",
+    "speedtest_interval": 0   (seconds between tests while connected, 0: never)
+The payload is streamed in chunks and never kept in memory. The requests
+go through nordvpn.http_open (offline and killswitch checks, rate limit,
+recording and metrics).
+Results are stored per server and technology in
+~/.cache/nordvpn-indicator/speedtest.json
+"""
+
+from statistics import median
+from threading import Lock
+from time import monotonic, time
+import logging
+
+# Local modules
+from .nordvpn import load_cache, save_cache, http_open
+from .config import get_config
+
+# Bytes to download and upload
+DOWNLOAD_BYTES = 25 * 1024 * 1024
+UPLOAD_BYTES = 10 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+# Small requests to measure time to first byte and jitter
+LATENCY_PROBES = 5
+# Seconds to wait for the endpoint
+TIMEOUT = 10
+# Stop transferring after this number of seconds
+MAX_TRANSFER_SECONDS = 15
+# Results to keep per server and technology
+HISTORY = 5
+
+logger = logging.getLogger(__name__)
+_lock = Lock()
+
+
+def measure_latency(url, probes=LATENCY_PROBES, timeout=TIMEOUT):
+    """
+    Time to first byte of small requests.
+    Returns (median TTFB, jitter) in seconds.
+    Jitter is the mean difference between consecutive TTFB.
+    """
+    ttfbs = []
+    for i in range(probes):
+        start = monotonic()
+        with http_open(url.format(bytes=0), timeout=timeout) as response:
+            response.read(1)
+            ttfbs.append(monotonic() - start)
+    jitter = sum(abs(a - b) for a, b in zip(ttfbs, ttfbs[1:])) / (len(ttfbs) - 1) if len(ttfbs) > 1 else 0
+    return (median(ttfbs), jitter)
+
+
+def measure_download(url, size=DOWNLOAD_BYTES, timeout=TIMEOUT, max_seconds=MAX_TRANSFER_SECONDS):
+    """
+    Stream a download and discard the data.
+    Returns (bits per second, TTFB in seconds, bytes)
+    Goodput is measured from the first byte on.
+    """
+    start = monotonic()
+    received = 0
+    first_byte = None
+    with http_open(url.format(bytes=size), timeout=timeout) as response:
+        while True:
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if first_byte is None:
+                first_byte = monotonic()
+            received += len(chunk)
+            if monotonic() - first_byte > max_seconds:
+                break
+    if first_byte is None:
+        return (0, monotonic() - start, 0)
+    seconds = monotonic() - first_byte
+    return (received * 8 / seconds if seconds > 0 else 0, first_byte - start, received)
+
+
+def upload_body(size, times=None):
+    """
+    Generator with zero filled chunks (one chunk is reused).
+    times: dictionary that gets the time of the first chunk ('first')
+    """
+    chunk = bytes(CHUNK_SIZE)
+    sent = 0
+    if times is not None:
+        times['first'] = monotonic()
+    while sent < size:
+        part = chunk if size - sent >= CHUNK_SIZE else chunk[:size - sent]
+        sent += len(part)
+        yield part
+
+
+def measure_upload(url, size=UPLOAD_BYTES, timeout=TIMEOUT, ttfb=0):
+    """
+    Stream an upload.
+    Goodput is measured from the first chunk (after connecting) until
+    the answer, without the answer time of the server (ttfb: TTFB of a
+    small request, see measure_latency).
+    Returns (bits per second, bytes)
+    """
+    times = {}
+    # Content-Length is needed to stream an iterable body
+    with http_open(url, data=upload_body(size, times), timeout=timeout,
+                   headers={'Content-Type': 'application/octet-stream',
+                            'Content-Length': str(size)}) as response:
+        answered = monotonic()
+        response.read()
+    seconds = answered - times.get('first', answered)
+    if ttfb < seconds:
+        seconds -= ttfb
+    return (size * 8 / seconds if seconds > 0 else 0, size)
+
+
+def run_speedtest(server, technology, download_url=None, upload_url=None):
+    """
+    Run all measurements and store the result.
+    Returns the result dictionary (mbps, ms) or None when the test failed.
+    """
+    config = get_config()
+    download_url = download_url or config.get('speedtest_download_url')
+    upload_url = upload_url or config.get('speedtest_upload_url')
+    if not _lock.acquire(blocking=False):
+        logger.info('Speed test is already running')
+        return None
+    try:
+        ttfb, jitter = measure_latency(download_url)
+        download, download_ttfb, received = measure_download(download_url)
+        upload, sent = measure_upload(upload_url, ttfb=ttfb) if upload_url else (0, 0)
+    except (OSError, ValueError) as e:
+        logger.warning('Speed test failed: %s', e)
+        return None
+    finally:
+        _lock.release()
+    result = {'time': time(),
+              'download_mbps': round(download / 1e6, 1),
+              'upload_mbps': round(upload / 1e6, 1),
+              'ttfb_ms': round(ttfb * 1000, 1),
+              'jitter_ms': round(jitter * 1000, 1)}
+    logger.info('Speed test %s (%s): %s', server, technology, result)
+    save_result(server, technology, result)
+    return result
+
+
+def get_results():
+    """
+    All stored results: server: technology: list of results (newest last).
+    """
+    return load_cache('speedtest') or {}
+
+
+def save_result(server, technology, result):
+    """
+    Store a result and keep the last HISTORY results.
+    """
+    results = get_results()
+    history = results.setdefault(server, {}).setdefault(technology.lower(), [])
+    history.append(result)
+    del history[:-HISTORY]
+    save_cache('speedtest', results)
+
+
+def get_server_summary(server, results=None):
+    """
+    Short text with the last result per technology of a server.
+    """
+    if results is None:
+        results = get_results()
+    texts = []
+    for technology, history in sorted(results.get(server, {}).items()):
+        if history:
+            last = history[-1]
+            texts.append('{0} {1:g}/{2:g} Mbit/s {3:g} ms'.format(technology, last['download_mbps'],
+                                                                 last['upload_mbps'], last['ttfb_ms']))
+    return ', '.join(texts)
@@ -0,0 +1,272 @@
+#! /usr/bin/env python3
+
+"""
+Measured technology selection
+With "auto_technology": true in indicator.json every available technology
+(NordLynx when WireGuard is installed, OpenVPN UDP and TCP) is tried
+once per network: connect time, download goodput and jitter (stability)
+are measured on the same server and the best one is kept per network in
+~/.cache/nordvpn-indicator/technology.json:
+    network: {"name": "nordlynx", "time": ..., "results": {name: {...}}}
+The winner is applied (like a profile: only what differs) before
+connecting. The network is identified by a hash of the interface and the
+MAC address of the default gateway, so the cache holds no addresses.
+A network is measured again when the winner fails to connect or a speed
+test gives less than DEGRADED_FRACTION of the measured download.
+The measurement is the user's connect on a network without a measured
+technology (never in the background). The indicator shows it as
+measuring, a connection change of the user cancels it between the
+candidates (cancel_measurement) and the metrics do not record the
+synthetic connections.
+"""
+
+from os.path import join
+from threading import Lock, Event
+from time import monotonic, time
+import hashlib
+import logging
+
+# Local modules
+from .nordvpn import load_cache, save_cache, is_wireguard_installed, \
+                    nordvpn_connect, nordvpn_disconnect, get_status_dict
+from .profiles import apply_profile
+from .speedtest import measure_latency, measure_download
+from .verify import TUNNEL_INTERFACES
+from .config import get_config
+from . import metrics
+
+# Candidates as profiles (see profiles.py)
+CANDIDATES = {'nordlynx': {'technology': 'NordLynx'},
+              'openvpn_udp': {'technology': 'OpenVPN', 'protocol': 'UDP'},
+              'openvpn_tcp': {'technology': 'OpenVPN', 'protocol': 'TCP'}}
+# Bytes and seconds of the download per candidate (smaller than the speed test)
+BENCHMARK_BYTES = 5 * 1024 * 1024
+BENCHMARK_SECONDS = 5
+# Seconds of connect time and milliseconds of jitter that halve the score
+CONNECT_PENALTY = 10
+JITTER_PENALTY = 50
+# Measure again below this fraction of the measured download
+DEGRADED_FRACTION = 0.5
+# Networks to remember
+MAX_NETWORKS = 20
+PROC_NET = '/proc/net'
+
+logger = logging.getLogger(__name__)
+# One measurement at a time
+_lock = Lock()
+# Changes of technology.json
+_cache_lock = Lock()
+# Set while the connections are synthetic
+_measuring = Event()
+# Set to stop measuring at the next candidate
+_cancel = Event()
+
+
+def get_network_identity(proc_net=PROC_NET):
+    """
+    Hash of the interface and gateway MAC address of the default route
+    (tunnel interfaces are skipped). Empty string when unknown.
+    """
+    tunnels = sum(TUNNEL_INTERFACES.values(), ())
+    try:
+        with open(join(proc_net, 'route')) as f:
+            routes = [line.split() for line in f.readlines()[1:]]
+        with open(join(proc_net, 'arp')) as f:
+            arp = [line.split() for line in f.readlines()[1:]]
+    except OSError:
+        return ''
+    for route in routes:
+        # Iface Destination Gateway Flags RefCnt Use Metric Mask ...
+        if len(route) < 8 or route[0] in tunnels or route[1] != '00000000' or route[7] != '00000000':
+            continue
+        # Little endian hexadecimal address
+        gateway = '.'.join(str(int(route[2][i:i + 2], 16)) for i in (6, 4, 2, 0))
+        macs = [entry[3] for entry in arp if len(entry) >= 6 and entry[0] == gateway and entry[5] == route[0]]
+        identity = '{0} {1}'.format(route[0], macs[0] if macs else gateway)
+        return hashlib.sha256(identity.encode()).hexdigest()[:16]
+    return ''
+
+
+def is_measuring():
+    """
+    True while the technologies are measured.
+    """
+    return _measuring.is_set()
+
+
+def cancel_measurement():
+    """
+    Stop measuring at the next candidate and wait until it stopped
+    (the connection is the user's again).
+    Returns True when a measurement was cancelled
+    """
+    if not _measuring.is_set():
+        return False
+    _cancel.set()
+    with _lock:
+        pass
+    logger.info('Measurement of the technologies cancelled')
+    return True
+
+
+def is_cancelled():
+    """
+    True when the last measurement was cancelled: the user changed the connection.
+    """
+    return _cancel.is_set()
+
+
+def get_candidates():
+    """
+    Names of the technologies that can be used here.
+    """
+    return [name for name in CANDIDATES if name != 'nordlynx' or is_wireguard_installed()]
+
+
+def get_choices():
+    return load_cache('technology') or {}
+
+
+def get_choice(network):
+    """
+    The measured technology of a network (None when it must be measured).
+    """
+    if not network:
+        return None
+    choice = get_choices().get(network)
+    if choice is None or choice.get('degraded'):
+        return None
+    return choice
+
+
+def apply_choice(choice, current_settings):
+    """
+    Set the technology (and protocol) of a choice when it differs.
+    Returns True when all settings were applied
+    """
+    return apply_profile(CANDIDATES[choice['name']], current_settings)
+
+
+def mark_degraded(network, reason):
+    """
+    Measure the network again at the next connection.
+    """
+    with _cache_lock:
+        choices = get_choices()
+        if network in choices and not choices[network].get('degraded'):
+            logger.info('Technology %s degraded (%s): measure again', choices[network]['name'], reason)
+            choices[network]['degraded'] = True
+            save_cache('technology', choices)
+
+
+def check_speed(network, technology, download_mbps):
+    """
+    Mark the network degraded when a speed test of the chosen technology
+    is well below the measured download.
+    """
+    choice = get_choice(network)
+    if choice is None or not technology or CANDIDATES[choice['name']]['technology'].lower() != technology.lower():
+        return
+    measured = choice['results'][choice['name']]['download_mbps']
+    if download_mbps < DEGRADED_FRACTION * measured:
+        mark_degraded(network, '{0:g} of {1:g} Mbit/s'.format(download_mbps, measured))
+
+
+def get_score(result):
+    """
+    Download goodput, halved by CONNECT_PENALTY seconds of connect time
+    and by JITTER_PENALTY ms of jitter.
+    """
+    return result['download_mbps'] / (1 + result['connect_seconds'] / CONNECT_PENALTY) \
+                                   / (1 + result['jitter_ms'] / JITTER_PENALTY)
+
+
+def measure(name, server, current_settings, url):
+    """
+    Connect to server with a candidate and measure it.
+    Returns the result dictionary or None when it did not work
+    """
+    nordvpn_disconnect()
+    if not apply_profile(CANDIDATES[name], current_settings):
+        return None
+    start = monotonic()
+    return_code, output = nordvpn_connect(server)
+    connect_seconds = monotonic() - start
+    if return_code != 0:
+        logger.info('Technology %s cannot connect: %s', name, output)
+        return None
+    try:
+        ttfb, jitter = measure_latency(url)
+        download, download_ttfb, received = measure_download(url, BENCHMARK_BYTES, max_seconds=BENCHMARK_SECONDS)
+    except (OSError, ValueError) as e:
+        logger.info('Technology %s cannot be measured: %s', name, e)
+        return None
+    return {'connect_seconds': round(connect_seconds, 1),
+            'download_mbps': round(download / 1e6, 1),
+            'jitter_ms': round(jitter * 1000, 1)}
+
+
+def select_technology(network, server, current_settings):
+    """
+    Measure every candidate on server (a server, city or country: the
+    first connected server is used for the other candidates) and keep
+    the best one for the network. The settings of the winner are applied
+    and the current settings dictionary is updated. Connected with the
+    winner when it was measured last, else disconnected.
+    Returns the name of the chosen candidate (None when none worked or cancelled)
+    """
+    if not _lock.acquire(blocking=False):
+        logger.info('Technologies are already being measured')
+        return None
+    winner = None
+    _cancel.clear()
+    _measuring.set()
+    metrics.pause_states(True)
+    try:
+        winner = _select_technology(network, server, current_settings)
+    finally:
+        _lock.release()
+        _measuring.clear()
+        metrics.pause_states(False)
+    return winner
+
+
+def _select_technology(network, server, current_settings):
+    """
+    Measure the candidates (see select_technology).
+    """
+    # Keep the current technology when nothing could be measured
+    original = {setting: current_settings[setting] for setting in ('technology', 'protocol')
+                if current_settings.get(setting)}
+    url = get_config().get('speedtest_download_url')
+    results = {}
+    name = None
+    for name in get_candidates():
+        if _cancel.is_set():
+            return None
+        result = measure(name, server, current_settings, url)
+        if result is not None:
+            results[name] = result
+            logger.info('Technology %s: %s', name, result)
+            # The other candidates on the same server
+            server = get_status_dict().get('hostname', '').split('.')[0] or server
+    if _cancel.is_set():
+        return None
+    if not results:
+        logger.warning('No technology could be measured')
+        nordvpn_disconnect()
+        apply_profile(original, current_settings)
+        return None
+    winner = max(results, key=lambda name: get_score(results[name]))
+    with _cache_lock:
+        choices = get_choices()
+        choices[network] = {'name': winner, 'time': time(), 'results': results}
+        if len(choices) > MAX_NETWORKS:
+            del choices[min(choices, key=lambda key: choices[key]['time'])]
+        save_cache('technology', choices)
+    logger.info('Technology for this network: %s', winner)
+    if winner != name or name not in results:
+        # Connected with (or failed on) the last candidate: connect with the winner
+        nordvpn_disconnect()
+        apply_profile(CANDIDATES[winner], current_settings)
+    return winner
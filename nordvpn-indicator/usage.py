@@ -0,0 +1,273 @@
+#! /usr/bin/env python3
+
+"""
+Data usage accounting
+The byte counters of the tunnel interfaces are sampled every minute and
+added to three ring files in ~/.cache/nordvpn-indicator/usage/:
+    minute.bin (MINUTE_SLOTS), hour.bin (HOUR_SLOTS), day.bin (DAY_SLOTS)
+Every ring has a fixed size: a record (RECORD: period, received, sent)
+per slot, the slot of a period is period % slots and a record is only
+valid when its period matches. Periods are minutes and hours since the
+epoch and local days (date ordinals).
+Per server totals, the recent sessions, the last counters and the sent
+alerts are kept in usage.json.
+A counter that went down or an interface with a new ifindex was
+recreated: its counters started again from zero.
+Budgets in MB (0: none) in indicator.json:
+    "usage_daily_budget": 1000, "usage_monthly_budget": 50000
+"""
+
+from os.path import join
+from os import makedirs, open as os_open, close, pread, pwrite, ftruncate, fstat, O_RDWR, O_CREAT
+from datetime import date
+from threading import Lock
+from time import time
+import struct
+import logging
+
+# Local modules
+from .nordvpn import cache_path, load_cache, save_cache
+from .metrics import get_tunnel_bytes, SYS_NET
+from .config import get_config
+
+# Seconds between samples
+USAGE_INTERVAL = 60
+# Period, received bytes, sent bytes
+RECORD = struct.Struct('<qQQ')
+# Slots per ring: 2 days of minutes, 92 days of hours, 3 years of days
+MINUTE_SLOTS = 2 * 1440
+HOUR_SLOTS = 92 * 24
+DAY_SLOTS = 3 * 366
+# Sessions and servers to keep in usage.json
+MAX_SESSIONS = 50
+MAX_SERVERS = 100
+# Fractions of a budget to alert at
+BUDGET_ALERTS = (0.8, 1.0)
+MB = 1000000
+
+logger = logging.getLogger(__name__)
+
+
+def get_periods(timestamp):
+    """
+    The minute, hour and day of a time.
+    Returns {ring name: period}
+    """
+    return {'minute': int(timestamp // 60),
+            'hour': int(timestamp // 3600),
+            'day': date.fromtimestamp(timestamp).toordinal()}
+
+
+class Ring():
+    def __init__(self, path, slots):
+        """
+        Fixed size file of slots records.
+        """
+        self.path = path
+        self.slots = slots
+        self.fd = os_open(path, O_RDWR | O_CREAT, 0o600)
+        if fstat(self.fd).st_size != slots * RECORD.size:
+            # New file or another number of slots: start empty
+            ftruncate(self.fd, 0)
+            ftruncate(self.fd, slots * RECORD.size)
+
+    def read(self, period):
+        """
+        Returns (received, sent) of a period (zero when not recorded)
+        """
+        data = pread(self.fd, RECORD.size, (period % self.slots) * RECORD.size)
+        if len(data) == RECORD.size:
+            recorded_period, received, sent = RECORD.unpack(data)
+            if recorded_period == period:
+                return (received, sent)
+        return (0, 0)
+
+    def add(self, period, received, sent):
+        """
+        Add bytes to a period (overwrites the period a full ring ago).
+        """
+        old_received, old_sent = self.read(period)
+        pwrite(self.fd, RECORD.pack(period, old_received + received, old_sent + sent),
+               (period % self.slots) * RECORD.size)
+
+    def total(self, first, last):
+        """
+        Sum of the periods first..last (at most one ring).
+        Returns (received, sent)
+        """
+        first = max(first, last - self.slots + 1)
+        received = sent = 0
+        for period in range(first, last + 1):
+            period_received, period_sent = self.read(period)
+            received += period_received
+            sent += period_sent
+        return (received, sent)
+
+    def close(self):
+        close(self.fd)
+
+
+class UsageAccounting():
+    def __init__(self, directory=join(cache_path, 'usage'), sys_net=SYS_NET):
+        """
+        Open the rings and load the state of the last run.
+        """
+        self.sys_net = sys_net
+        self.lock = Lock()
+        makedirs(directory, exist_ok=True)
+        self.rings = {'minute': Ring(join(directory, 'minute.bin'), MINUTE_SLOTS),
+                      'hour': Ring(join(directory, 'hour.bin'), HOUR_SLOTS),
+                      'day': Ring(join(directory, 'day.bin'), DAY_SLOTS)}
+        state = load_cache('usage') or {}
+        # interface: [ifindex, received, sent] of the last sample (None: never sampled)
+        self.counters = state.get('counters')
+        # server: [received, sent]
+        self.servers = state.get('servers', {})
+        # [{'server', 'start', 'end', 'received', 'sent'}], last is the current session
+        self.sessions = state.get('sessions', [])
+        # 'day:period' or 'month:YYYY-MM': highest budget fraction alerted
+        self.alerts = state.get('alerts', {})
+        self.server = ''
+
+    def get_ifindex(self, interface):
+        try:
+            with open(join(self.sys_net, interface, 'ifindex')) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return 0
+
+    def set_server(self, server):
+        """
+        Start a session on a server ('' when disconnected).
+        """
+        with self.lock:
+            if server == self.server:
+                return
+            self.server = server
+            if server:
+                self.sessions.append({'server': server, 'start': time(), 'end': time(), 'received': 0, 'sent': 0})
+                self.sessions = self.sessions[-MAX_SESSIONS:]
+
+    def sample(self, now=None):
+        """
+        Add the traffic since the last sample.
+        Returns the new budget alerts [(period name, used MB, budget MB)]
+        """
+        now = now or time()
+        received = sent = 0
+        counters = {}
+        for interface, (interface_received, interface_sent) in get_tunnel_bytes(self.sys_net).items():
+            ifindex = self.get_ifindex(interface)
+            counters[interface] = [ifindex, interface_received, interface_sent]
+            if self.counters is None:
+                # First run: only the baseline
+                continue
+            last = self.counters.get(interface)
+            if last is None or last[0] != ifindex or interface_received < last[1] or interface_sent < last[2]:
+                # New or recreated interface: counted from zero
+                logger.debug('Counters of %s started again', interface)
+                received += interface_received
+                sent += interface_sent
+            else:
+                received += interface_received - last[1]
+                sent += interface_sent - last[2]
+        with self.lock:
+            self.counters = counters
+            if received or sent:
+                for name, period in get_periods(now).items():
+                    self.rings[name].add(period, received, sent)
+                if self.server:
+                    server = self.servers.setdefault(self.server, [0, 0])
+                    server[0] += received
+                    server[1] += sent
+                    if len(self.servers) > MAX_SERVERS:
+                        smallest = min(self.servers, key=lambda name: sum(self.servers[name]))
+                        del self.servers[smallest]
+                    if self.sessions:
+                        session = self.sessions[-1]
+                        session['received'] += received
+                        session['sent'] += sent
+                        session['end'] = now
+            alerts = self.check_budgets(now)
+            self.save()
+        return alerts
+
+    def check_budgets(self, now):
+        """
+        Budget fractions (BUDGET_ALERTS) crossed for the first time in this day or month.
+        """
+        alerts = []
+        today = date.fromtimestamp(now)
+        for name, key, budget, used in (('day', 'day:{0}'.format(today.toordinal()),
+                                         get_config().get('usage_daily_budget'), self.get_today),
+                                        ('month', 'month:{0:%Y-%m}'.format(today),
+                                         get_config().get('usage_monthly_budget'), self.get_month)):
+            if not budget:
+                continue
+            used_mb = sum(used(now)) / MB
+            crossed = [fraction for fraction in BUDGET_ALERTS if used_mb >= fraction * budget]
+            if crossed and crossed[-1] > self.alerts.get(key, 0):
+                self.alerts[key] = crossed[-1]
+                alerts.append((name, used_mb, budget))
+        # Forget the alerts of other days and months
+        self.alerts = {key: fraction for key, fraction in self.alerts.items()
+                       if key in ('day:{0}'.format(today.toordinal()), 'month:{0:%Y-%m}'.format(today))}
+        return alerts
+
+    def save(self):
+        save_cache('usage', {'counters': self.counters, 'servers': self.servers,
+                             'sessions': self.sessions, 'alerts': self.alerts})
+
+    def get_today(self, now=None):
+        """
+        Returns (received, sent) today
+        """
+        day = get_periods(now or time())['day']
+        return self.rings['day'].read(day)
+
+    def get_month(self, now=None):
+        """
+        Returns (received, sent) this month
+        """
+        today = date.fromtimestamp(now or time())
+        return self.rings['day'].total(today.replace(day=1).toordinal(), today.toordinal())
+
+    def get_series(self, name='hour', count=24, now=None):
+        """
+        The last count periods of a ring (oldest first).
+        Returns [(period, received, sent)]
+        """
+        last = get_periods(now or time())[name]
+        return [(period,) + self.rings[name].read(period) for period in range(last - count + 1, last + 1)]
+
+    def get_session(self):
+        """
+        Returns (server, received, sent) of the current session (None when disconnected)
+        """
+        with self.lock:
+            if not self.server or not self.sessions:
+                return None
+            session = self.sessions[-1]
+            return (session['server'], session['received'], session['sent'])
+
+    def get_servers(self):
+        """
+        Returns {server: (received, sent)}
+        """
+        with self.lock:
+            return {server: tuple(total) for server, total in self.servers.items()}
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+
+
+def format_bytes(count):
+    """
+    Human readable byte count (decimal units, like nordvpn).
+    """
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if count < 1000:
+            return '{0:.0f} {1}'.format(count, unit) if unit == 'B' else '{0:.1f} {1}'.format(count, unit)
+        count /= 1000
+    return '{0:.1f} TB'.format(count)
@@ -0,0 +1,276 @@
+#! /usr/bin/env python3
+
+"""
+Connection verification
+After connecting, these checks run concurrently:
+    interface: the tunnel interface exists and is up
+    routing: traffic to the internet goes through the tunnel
+    dns: the system uses only the tunnel resolvers and they answer
+    exit_ip: the public IP is the IP of the server (or protected)
+Every check has its own timeout and all checks together must finish
+within VERIFY_BUDGET seconds. The results are kept until disconnected.
+All paths, addresses and commands are arguments so the checks can be
+run against local stand-ins. The exit IP is asked through the API
+helper of nordvpn.py (api_url, offline and killswitch checks, rate
+limit, recording and metrics).
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from os.path import join, exists
+from threading import Lock
+from time import monotonic, time
+import subprocess
+import socket
+import struct
+import random
+import logging
+
+# Local modules
+from .nordvpn import get_insights
+from .metrics import TUNNEL_INTERFACES, SYS_NET
+
+# Seconds all checks together may take...
+VERIFY_BUDGET = 8
+# ...and each check
+CHECK_TIMEOUTS = {'routing': 2, 'dns': 3, 'exit_ip': 6}
+# NordVPN DNS servers
+NORDVPN_DNS = ('103.86.96.100', '103.86.99.100')
+# Address to check the route to
+ROUTE_PROBE = '1.1.1.1'
+# Name to resolve
+DNS_PROBE = 'nordvpn.com'
+# Resolvers of the system...
+RESOLV_CONF = '/etc/resolv.conf'
+# ...or, behind the stub resolver of systemd-resolved, of every link
+RESOLVED_STUBS = ('127.0.0.53', '127.0.0.54')
+RESOLVECTL = ('resolvectl', 'dns')
+IFF_UP = 0x1
+
+logger = logging.getLogger(__name__)
+# Results of the current VPN session
+_session = {'server': None, 'results': {}, 'time': None}
+_session_lock = Lock()
+
+
+def check_interface(technology='', sys_net=SYS_NET):
+    """
+    Check if the tunnel interface exists and is up.
+    Returns (passed, detail)
+    """
+    interfaces = TUNNEL_INTERFACES.get(technology.lower(),
+                                       sum(TUNNEL_INTERFACES.values(), ()))
+    for interface in interfaces:
+        flags_file = join(sys_net, interface, 'flags')
+        if exists(flags_file):
+            with open(flags_file) as f:
+                flags = int(f.read().strip(), 16)
+            if flags & IFF_UP:
+                return (True, interface)
+            return (False, '{0} is down'.format(interface))
+    return (False, 'no tunnel interface ({0})'.format(', '.join(interfaces)))
+
+
+def get_tunnel_interface(technology='', sys_net=SYS_NET):
+    """
+    Name of the tunnel interface that exists (or an empty string).
+    """
+    passed, detail = check_interface(technology, sys_net)
+    return detail if passed else ''
+
+
+def check_routing(interface, probe=ROUTE_PROBE, command=('ip', 'route', 'get'), timeout=2):
+    """
+    Check if the route to the internet goes through the tunnel interface.
+    Returns (passed, detail)
+    """
+    if not interface:
+        return (False, 'no tunnel interface')
+    output = subprocess.check_output(list(command) + [probe], timeout=timeout).decode('utf-8')
+    words = output.split()
+    device = words[words.index('dev') + 1] if 'dev' in words else ''
+    return (device == interface, '{0} via {1}'.format(probe, device or '?'))
+
+
+def build_dns_query(name, query_id):
+    """
+    DNS query packet for the A record of name.
+    """
+    header = struct.pack('>HHHHHH', query_id, 0x0100, 1, 0, 0, 0)
+    question = b''.join(struct.pack('B', len(label)) + label.encode('ascii')
+                        for label in name.split('.')) + b'\x00'
+    return header + question + struct.pack('>HH', 1, 1)
+
+
+def get_active_resolvers(resolv_conf=RESOLV_CONF, command=RESOLVECTL, timeout=2):
+    """
+    Resolvers the system uses.
+    Returns list of (address, source), the source is the file or the link
+    """
+    resolvers = []
+    with open(resolv_conf) as f:
+        for line in f:
+            words = line.split()
+            if len(words) > 1 and words[0] == 'nameserver':
+                resolvers.append((words[1], resolv_conf))
+    if not resolvers or any(address not in RESOLVED_STUBS for address, source in resolvers):
+        return resolvers
+    # systemd-resolved: "Global: ..." and "Link 5 (nordlynx): 103.86.96.100 103.86.99.100"
+    resolvers = []
+    output = subprocess.check_output(list(command), timeout=timeout).decode('utf-8')
+    for line in output.splitlines():
+        source, separator, addresses = line.partition(':')
+        if not separator or not (source.startswith('Link') or source == 'Global'):
+            continue
+        if '(' in source:
+            source = source[source.index('(') + 1:source.rindex(')')]
+        for address in addresses.split():
+            # Strip the port, interface and server name of 1.1.1.1:53%eth0#one.one.one.one
+            address = address.split('#')[0].split('%')[0]
+            if address.count(':') == 1:
+                address = address.split(':')[0]
+            resolvers.append((address, source))
+    return resolvers
+
+
+def check_dns(interface='', expected=NORDVPN_DNS, name=DNS_PROBE, port=53, timeout=3,
+              resolv_conf=RESOLV_CONF, command=RESOLVECTL):
+    """
+    Check that the system uses only the expected resolvers (or the ones
+    of the tunnel interface) and that they answer.
+    Returns (passed, detail)
+    """
+    deadline = monotonic() + timeout
+    active = get_active_resolvers(resolv_conf, command, timeout)
+    if not active:
+        return (False, 'no resolvers in {0}'.format(resolv_conf))
+    expected = set(expected) | {address for address, source in active if interface and source == interface}
+    others = ['{0} ({1})'.format(address, source) for address, source in active if address not in expected]
+    if others:
+        return (False, 'not through the tunnel: {0}'.format(', '.join(others)))
+    resolvers = []
+    for address, source in active:
+        if address not in resolvers:
+            resolvers.append(address)
+    return query_dns(resolvers, name, port, deadline - monotonic())
+
+
+def query_dns(resolvers, name=DNS_PROBE, port=53, timeout=3):
+    """
+    Resolve name through the resolvers with a raw UDP query.
+    Returns (passed, detail)
+    """
+    deadline = monotonic() + timeout
+    errors = []
+    for resolver in resolvers:
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            break
+        query_id = random.randint(0, 0xffff)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(min(remaining, timeout / len(resolvers)))
+            try:
+                sock.sendto(build_dns_query(name, query_id), (resolver, port))
+                while True:
+                    data, address = sock.recvfrom(512)
+                    # Ignore answers to other queries
+                    if len(data) >= 12 and struct.unpack('>H', data[:2])[0] == query_id:
+                        break
+            except OSError as e:
+                errors.append('{0}: {1}'.format(resolver, e))
+                continue
+        flags, questions, answers = struct.unpack('>HHH', data[2:8])
+        rcode = flags & 0xf
+        if rcode == 0 and answers > 0:
+            return (True, '{0} answered'.format(resolver))
+        errors.append('{0}: rcode {1}, {2} answers'.format(resolver, rcode, answers))
+    return (False, '; '.join(errors) or 'timeout')
+
+
+def check_exit_ip(server, resolve=socket.gethostbyname_ex, timeout=6):
+    """
+    Compare the public IP with the IP of the server.
+    Returns (passed, detail)
+    """
+    insights = get_insights(timeout)
+    if not insights:
+        return (False, 'no answer from the NordVPN API')
+    exit_ip = insights.get('ip', '')
+    server_ips = []
+    if server:
+        hostname = server if '.' in server else '{0}.nordvpn.com'.format(server)
+        try:
+            server_ips = resolve(hostname)[2]
+        except OSError:
+            pass
+    passed = exit_ip in server_ips if server_ips else bool(insights.get('protected'))
+    return (passed, '{0} ({1})'.format(exit_ip or '?', server or '?'))
+
+
+def run_checks(checks, budget=VERIFY_BUDGET):
+    """
+    Run checks concurrently.
+    Argument: dictionary name: function without arguments, total budget in seconds
+    Returns dictionary name: (passed, detail, seconds)
+        passed is None when the check did not finish in time
+    """
+    results = {}
+    start = monotonic()
+    executor = ThreadPoolExecutor(max_workers=len(checks) or 1, thread_name_prefix='verify')
+    futures = {executor.submit(timed, check): name for name, check in checks.items()}
+    done, not_done = wait(futures, timeout=budget)
+    for future, name in futures.items():
+        if future in done:
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = (False, str(e) or type(e).__name__, monotonic() - start)
+        else:
+            future.cancel()
+            results[name] = (None, 'timeout', monotonic() - start)
+    # Do not wait for checks that are still running
+    executor.shutdown(wait=False)
+    return results
+
+
+def timed(check):
+    """
+    Run a check and add its duration.
+    """
+    start = monotonic()
+    passed, detail = check()
+    return (passed, detail, monotonic() - start)
+
+
+def verify_connection(server, technology='', budget=VERIFY_BUDGET, timeouts=CHECK_TIMEOUTS):
+    """
+    Verify the VPN connection to server and keep the results for this session.
+    Returns dictionary name: (passed, detail, seconds)
+    """
+    interface = get_tunnel_interface(technology)
+    checks = {'interface': lambda: check_interface(technology),
+              'routing': lambda: check_routing(interface, timeout=timeouts['routing']),
+              'dns': lambda: check_dns(interface, timeout=timeouts['dns']),
+              'exit_ip': lambda: check_exit_ip(server, timeout=timeouts['exit_ip'])}
+    results = run_checks(checks, budget)
+    for name, (passed, detail, seconds) in results.items():
+        logger.info('Verify %s: %s %s (%.2fs)', name,
+                    {True: 'passed', False: 'failed', None: 'timeout'}[passed], detail, seconds)
+    with _session_lock:
+        _session.update(server=server, results=results, time=time())
+    return results
+
+
+def get_verification():
+    """
+    Get the server and results of the last verification of this session.
+    """
+    with _session_lock:
+        return (_session['server'], dict(_session['results']))
+
+
+def clear_verification():
+    """
+    Forget the results (disconnected).
+    """
+    with _session_lock:
+        _session.update(server=None, results={}, time=None)
@@ -0,0 +1,125 @@
+#! /usr/bin/env python3
+
+"""
+Watchdog of the NordVPN daemon
+Every nordvpn command has a deadline; a command that misses it is killed
+together with its children. Latencies and consecutive failures (missed
+deadlines, "Cannot reach User Daemon") are tracked.
+After UNRESPONSIVE_FAILURES consecutive failures the daemon is unresponsive:
+commands fail at once, except one probe after a backoff that doubles
+up to MAX_BACKOFF seconds, until a command succeeds again.
+"""
+
+from collections import deque
+from threading import Lock
+from time import monotonic
+import logging
+
+# Consecutive failures before the daemon is unresponsive
+UNRESPONSIVE_FAILURES = 3
+# Seconds before the first probe of an unresponsive daemon...
+BACKOFF = 5
+# ...doubled after every failed probe up to
+MAX_BACKOFF = 300
+# Latencies to keep for the percentiles
+LATENCY_SAMPLES = 200
+# Output of nordvpn when the daemon does not answer (lower case)
+DAEMON_ERRORS = ('cannot reach user daemon', 'cannot reach system daemon')
+
+logger = logging.getLogger(__name__)
+
+
+class DaemonUnresponsive(OSError):
+    """
+    The command was not started: the daemon is unresponsive.
+    """
+
+
+class Watchdog():
+    def __init__(self, failures=UNRESPONSIVE_FAILURES, backoff=BACKOFF,
+                 max_backoff=MAX_BACKOFF, clock=monotonic):
+        """
+        Keeps the latencies and the failures of the daemon.
+        """
+        self.failures = failures
+        self.initial_backoff = backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.lock = Lock()
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.consecutive_failures = 0
+        self.unresponsive = False
+        self.backoff = 0
+        self.next_probe = 0
+        self.probing = False
+
+    def allow(self):
+        """
+        Check if a command may start: always while the daemon responds,
+        one probe at a time after the backoff while it is unresponsive.
+        """
+        with self.lock:
+            if not self.unresponsive:
+                return True
+            if self.probing or self.clock() < self.next_probe:
+                return False
+            self.probing = True
+            return True
+
+    def observe(self, seconds, output='', timeout=False):
+        """
+        Record the result of a command.
+        Arguments: duration, output, timeout: the deadline was missed
+        """
+        failed = timeout or any(error in output.lower() for error in DAEMON_ERRORS)
+        with self.lock:
+            self.probing = False
+            self.latencies.append(seconds)
+            if not failed:
+                if self.unresponsive:
+                    logger.warning('NordVPN daemon responds again')
+                self.consecutive_failures = 0
+                self.unresponsive = False
+                self.backoff = 0
+                return
+            self.consecutive_failures += 1
+            if self.consecutive_failures < self.failures:
+                return
+            if self.unresponsive:
+                self.backoff = min(self.backoff * 2, self.max_backoff)
+            else:
+                logger.warning('NordVPN daemon is unresponsive after %d failures', self.consecutive_failures)
+                self.unresponsive = True
+                self.backoff = self.initial_backoff
+            self.next_probe = self.clock() + self.backoff
+
+    def percentiles(self, percents=(50, 95, 99)):
+        """
+        Latency percentiles in seconds (nearest rank).
+        Returns {percent: seconds} (empty without samples)
+        """
+        with self.lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return {}
+        return {percent: latencies[min(len(latencies) - 1, max(0, -(-percent * len(latencies) // 100) - 1))]
+                for percent in percents}
+
+    def get_summary(self):
+        """
+        Short text for the log.
+        """
+        percentiles = self.percentiles()
+        text = ', '.join('p{0} {1:.2f} s'.format(percent, seconds) for percent, seconds in percentiles.items())
+        return '{0}, consecutive failures: {1}{2}'.format(text or 'no samples', self.consecutive_failures,
+                                                           ', unresponsive' if self.unresponsive else '')
+
+
+_watchdog = Watchdog()
+
+
+def get_watchdog():
+    """
+    The watchdog of the daemon.
+    """
+    return _watchdog
@@ -9,14 +9,16 @@ import pathlib, os
 # Set these variables
 PACKAGE_NAME='nordvpn-indicator'
 PACKAGE_DIR=PACKAGE_NAME
-PACKAGE_DATA={PACKAGE_NAME: ['*.svg', '*.conf', '*.exp']}
+PACKAGE_DATA={PACKAGE_NAME: ['*.svg', '*.conf']}
 SCRIPTS=['scripts/nordvpn-indicator', 
-                  'scripts/nordvpn-install']
+                  'scripts/nordvpn-install',
+                  'scripts/nordvpn-indicator-cache']
 DATA_FILES=[
     ('share/man/man1', ['man/nordvpn-indicator.1']),
     ('/etc/xdg/autostart', ['data/nordvpn-indicator.desktop']),
     ('share/polkit-1/actions', ['data/com.nordvpn.pkexec.nordvpn-indicator.nordvpn-install.policy']),
-    ('/etc/logrotate.d', ['data/nordvpn'])
+    ('/etc/logrotate.d', ['data/nordvpn']),
+    ('/lib/systemd/system', ['data/nordvpn-indicator-cache.service'])
 ]
 
 # Load the package's version.py module as a dictionary.
@@ -0,0 +1,105 @@
+"""
+Shared fixtures: an isolated home directory and local stand-ins.
+The indicator package imports python3-gi: test modules skip without it.
+"""
+
+import http.server
+import importlib
+import json
+import os
+import sys
+import tempfile
+import threading
+from os.path import abspath, dirname
+
+import pytest
+
+ROOT_DIR = dirname(dirname(abspath(__file__)))
+# Before the package is imported: its paths are based on the home directory
+os.environ['HOME'] = tempfile.mkdtemp(prefix='nordvpn-indicator-tests-')
+sys.path.insert(0, ROOT_DIR)
+
+
+def load(name):
+    """
+    Import a module of the indicator package (the directory name has a dash).
+    """
+    return importlib.import_module('nordvpn-indicator.{0}'.format(name))
+
+
+class StandIn():
+    def __init__(self, handler):
+        """
+        Local HTTP server in a thread.
+        """
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.server.daemon_threads = True
+        self.server.requests = []
+        self.server.answers = {}
+        self.url = 'http://127.0.0.1:{0}'.format(self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    @property
+    def answers(self):
+        return self.server.answers
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class JSONHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        """
+        Answer a path of server.answers with JSON.
+        """
+        self.server.requests.append(self.path)
+        if self.path not in self.server.answers:
+            self.send_error(404)
+            return
+        data = json.dumps(self.server.answers[self.path]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def nordvpn():
+    """
+    The nordvpn module online, without killswitch and memoized answers,
+    with a full API rate limit bucket and a responsive daemon.
+    """
+    module = load('nordvpn')
+    reset(module)
+    yield module
+    reset(module)
+
+
+def reset(module):
+    module.network_state.update(online=True, killswitch=False, status=None, changed=0.0)
+    module.single_flight.forget()
+    module.api_bucket.tokens = module.api_bucket.burst
+    # A successful command ends the back-off of the watchdog
+    module.watchdog.observe(0)
+
+
+@pytest.fixture
+def api(nordvpn):
+    """
+    NordVPN API stand-in, configured as api_url.
+    """
+    stand_in = StandIn(JSONHandler)
+    config = load('config').get_config()
+    config.set(api_url=stand_in.url)
+    yield stand_in
+    config.set(api_url=load('config').DEFAULTS['api_url'])
+    stand_in.stop()
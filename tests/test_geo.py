@@ -0,0 +1,45 @@
+"""
+Location of the user from an insights API stand-in.
+"""
+
+import pytest
+
+from conftest import load
+
+pytest.importorskip('gi')
+geo = load('geo')
+config = load('config').get_config()
+
+
+@pytest.fixture(autouse=True)
+def location():
+    config.set(location='', last_location='')
+    yield
+    config.set(location='', last_location='')
+
+
+def test_location_while_unprotected(api):
+    api.answers['/helpers/ips/insights'] = {'protected': False, 'latitude': 50.8503, 'longitude': 4.3517}
+    geo.update_location()
+    assert config.get('last_location') == '50.85,4.35'
+    assert geo.get_location() == (50.85, 4.35)
+
+
+def test_no_location_of_vpn_server(api):
+    api.answers['/helpers/ips/insights'] = {'protected': True, 'latitude': 52.37, 'longitude': 4.89}
+    geo.update_location()
+    assert config.get('last_location') == ''
+    assert geo.get_location() is None
+
+
+def test_no_request_offline(api, nordvpn):
+    nordvpn.set_online(False)
+    geo.update_location()
+    assert api.requests == []
+
+
+def test_configured_location(api):
+    config.set(location='40.71,-74.01')
+    api.answers['/helpers/ips/insights'] = {'protected': False, 'latitude': 50.85, 'longitude': 4.35}
+    geo.update_location()
+    assert geo.get_location() == (40.71, -74.01)
@@ -0,0 +1,65 @@
+"""
+Login on a pseudo terminal against the fake nordvpn command (tools/nordvpn).
+"""
+
+import json
+import os
+import threading
+
+import pytest
+
+from conftest import load, ROOT_DIR
+
+pytest.importorskip('gi')
+login = load('login')
+
+
+@pytest.fixture
+def fake_nordvpn(tmp_path, monkeypatch):
+    """
+    State directory of the fake nordvpn command, first in PATH.
+    """
+    monkeypatch.setenv('PATH', '{0}:{1}'.format(os.path.join(ROOT_DIR, 'tools'), os.environ.get('PATH', '')))
+    monkeypatch.setenv('FAKE_NORDVPN_DIR', str(tmp_path))
+    monkeypatch.setenv('FAKE_NORDVPN_LOGIN', 'user@example.com')
+    monkeypatch.setenv('FAKE_NORDVPN_PASSWORD', 'secret-password')
+    return tmp_path
+
+
+def is_loggedin(state_dir):
+    with open(str(state_dir / 'state.json')) as f:
+        return json.load(f)['loggedin']
+
+
+def test_success(fake_nordvpn):
+    output = []
+    return_code, message = login.pty_login('user@example.com', 'secret-password', output.append, timeout=10)
+    assert return_code == 0
+    assert message.startswith('Welcome to NordVPN!')
+    assert is_loggedin(fake_nordvpn)
+    # The password is never shown
+    assert not any('secret-password' in text for text in output)
+
+
+def test_wrong_password(fake_nordvpn):
+    return_code, message = login.pty_login('user@example.com', 'wrong-password', timeout=10)
+    assert return_code == 4
+    assert message == 'Username or password is not correct. Please try again.'
+    assert not os.path.exists(str(fake_nordvpn / 'state.json'))
+
+
+def test_already_logged_in(fake_nordvpn):
+    assert login.pty_login('user@example.com', 'secret-password', timeout=10)[0] == 0
+    return_code, message = login.pty_login('other@example.com', 'other-password', timeout=10)
+    assert return_code == 0
+    assert message == 'You are already logged in.'
+
+
+def test_no_credentials(fake_nordvpn):
+    assert login.pty_login('user@example.com', '')[0] == 3
+
+
+def test_cancelled(fake_nordvpn):
+    cancel = threading.Event()
+    cancel.set()
+    assert login.pty_login('user@example.com', 'secret-password', cancel_event=cancel)[0] == 6
@@ -0,0 +1,170 @@
+"""
+Network and power monitors on a private dbus-daemon (bus_address) with
+stand-ins for logind, NetworkManager and UPower.
+"""
+
+import shutil
+import subprocess
+import threading
+import time
+
+import pytest
+
+from conftest import load
+
+pytest.importorskip('gi')
+from gi.repository import Gio, GLib
+
+network = load('network')
+power = load('power')
+
+PROPERTIES_XML = '''
+<node>
+  <interface name="org.freedesktop.DBus.Properties">
+    <method name="Get">
+      <arg type="s" name="interface_name" direction="in"/>
+      <arg type="s" name="property_name" direction="in"/>
+      <arg type="v" name="value" direction="out"/>
+    </method>
+  </interface>
+</node>
+'''
+
+
+@pytest.fixture
+def bus():
+    """
+    Address of a private message bus.
+    """
+    if not shutil.which('dbus-daemon'):
+        pytest.skip('dbus-daemon is needed')
+    process = subprocess.Popen(['dbus-daemon', '--session', '--nofork', '--print-address'],
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    address = process.stdout.readline().decode('utf-8').strip()
+    yield address
+    process.terminate()
+    process.wait()
+
+
+class BusStandIn():
+    def __init__(self, address, names, properties):
+        """
+        Owns names on the bus and answers Properties.Get in its own thread.
+        properties: {(path, interface, name): GLib.Variant}
+        """
+        self.address = address
+        self.names = names
+        self.properties = properties
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        assert self.ready.wait(5)
+
+    def run(self):
+        # The method calls of the monitor block the main thread
+        context = GLib.MainContext()
+        context.push_thread_default()
+        flags = Gio.DBusConnectionFlags.AUTHENTICATION_CLIENT | Gio.DBusConnectionFlags.MESSAGE_BUS_CONNECTION
+        self.bus = Gio.DBusConnection.new_for_address_sync(self.address, flags, None, None)
+        for name in self.names:
+            self.bus.call_sync('org.freedesktop.DBus', '/org/freedesktop/DBus', 'org.freedesktop.DBus',
+                               'RequestName', GLib.Variant('(su)', (name, 0)), GLib.VariantType('(u)'),
+                               Gio.DBusCallFlags.NONE, 1000, None)
+        interface = Gio.DBusNodeInfo.new_for_xml(PROPERTIES_XML).interfaces[0]
+        for path in set(key[0] for key in self.properties):
+            self.bus.register_object(path, interface, self.on_method_call, None, None)
+        self.loop = GLib.MainLoop(context)
+        self.ready.set()
+        self.loop.run()
+
+    def on_method_call(self, connection, sender, path, interface, method, parameters, invocation):
+        key = (path,) + tuple(parameters.unpack())
+        if key in self.properties:
+            invocation.return_value(GLib.Variant('(v)', (self.properties[key],)))
+        else:
+            invocation.return_dbus_error('org.freedesktop.DBus.Error.UnknownProperty', str(key))
+
+    def emit(self, path, interface, signal, parameters):
+        self.bus.emit_signal(None, path, interface, signal, parameters)
+        self.bus.flush_sync(None)
+
+    def stop(self):
+        self.loop.quit()
+        self.thread.join(5)
+        self.bus.close_sync(None)
+
+
+def wait_for(condition, timeout=5):
+    """
+    Run the main loop until condition() is true.
+    """
+    context = GLib.MainContext.default()
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        while context.pending():
+            context.iteration(False)
+        time.sleep(0.01)
+    return condition()
+
+
+def test_network_monitor(bus):
+    stand_in = BusStandIn(bus, (network.NM_NAME, network.LOGIND_NAME),
+                          {(network.NM_PATH, network.NM_IFACE, 'State'): GLib.Variant('u', 20)})
+    calls = []
+    monitor = network.NetworkMonitor(lambda active, resumed: calls.append((active, resumed)), bus_address=bus)
+    try:
+        assert monitor.start()
+        # NM_STATE_DISCONNECTED
+        assert not monitor.online
+        assert not monitor.active
+        # NM_STATE_CONNECTED_GLOBAL
+        stand_in.emit(network.NM_PATH, network.NM_IFACE, 'StateChanged', GLib.Variant('(u)', (70,)))
+        assert wait_for(lambda: calls == [(True, True)])
+        stand_in.emit(network.LOGIND_PATH, network.LOGIND_IFACE, 'PrepareForSleep', GLib.Variant('(b)', (True,)))
+        assert wait_for(lambda: calls[-1] == (False, False))
+        stand_in.emit(network.LOGIND_PATH, network.LOGIND_IFACE, 'PrepareForSleep', GLib.Variant('(b)', (False,)))
+        assert wait_for(lambda: calls[-1] == (True, True))
+        assert len(calls) == 3
+    finally:
+        monitor.stop()
+        stand_in.stop()
+
+
+def test_network_without_network_manager(bus):
+    monitor = network.NetworkMonitor(lambda active, resumed: None, bus_address=bus)
+    try:
+        assert monitor.start()
+        # Assumed online
+        assert monitor.active
+    finally:
+        monitor.stop()
+
+
+def test_network_without_bus(tmp_path):
+    monitor = network.NetworkMonitor(lambda active, resumed: None,
+                                     bus_address='unix:path={0}'.format(tmp_path / 'missing'))
+    assert not monitor.start()
+    assert monitor.active
+
+
+def test_power_monitor(bus):
+    device = power.UPOWER_NAME + '.Device'
+    stand_in = BusStandIn(bus, (power.UPOWER_NAME,),
+                          {(power.UPOWER_PATH, power.UPOWER_NAME, 'OnBattery'): GLib.Variant('b', True),
+                           (power.UPOWER_DISPLAY_PATH, device, 'Percentage'): GLib.Variant('d', 50.0)})
+    calls = []
+    monitor = power.PowerMonitor(calls.append, threshold=20, bus_address=bus)
+    try:
+        assert monitor.start()
+        assert monitor.on_battery
+        assert monitor.percentage == 50.0
+        assert not monitor.low_power
+        stand_in.emit(power.UPOWER_DISPLAY_PATH, power.PROPERTIES_IFACE, 'PropertiesChanged',
+                      GLib.Variant('(sa{sv}as)', (device, {'Percentage': GLib.Variant('d', 10.0)}, [])))
+        assert wait_for(lambda: calls == [True])
+        stand_in.emit(power.UPOWER_PATH, power.PROPERTIES_IFACE, 'PropertiesChanged',
+                      GLib.Variant('(sa{sv}as)', (power.UPOWER_NAME, {'OnBattery': GLib.Variant('b', False)}, [])))
+        assert wait_for(lambda: calls == [True, False])
+    finally:
+        monitor.stop()
+        stand_in.stop()
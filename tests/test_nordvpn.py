@@ -0,0 +1,72 @@
+"""
+Connection commands of the command layer.
+"""
+
+import json
+import socket
+import subprocess
+import threading
+
+import pytest
+
+pytest.importorskip('gi')
+
+
+def test_connect_timeout(nordvpn, monkeypatch):
+    def spawn(command, timeout, merge_stderr=False, env=None):
+        raise subprocess.TimeoutExpired(command, timeout)
+    monkeypatch.setattr(nordvpn, '_spawn', spawn)
+    # An error like the other failures, not an exception in the caller's thread
+    return_code, output = nordvpn.nordvpn_connect('nl812')
+    assert return_code == 1
+    assert 'timed out' in output
+    assert nordvpn.nordvpn_disconnect()[0] == 1
+
+
+def test_connect_failure_in_output(nordvpn, monkeypatch):
+    monkeypatch.setattr(nordvpn, '_spawn', lambda command, timeout, merge_stderr=False, env=None:
+                        (0, 'Whoops! Cannot reach User Daemon.'))
+    assert nordvpn.nordvpn_connect() == (2, 'whoops! cannot reach user daemon.')
+
+
+@pytest.fixture
+def service(nordvpn, tmp_path, monkeypatch):
+    """
+    Cache service stand-in with a status of 3 seconds old.
+    """
+    path = str(tmp_path / 'cache.sock')
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(5)
+
+    def serve():
+        while True:
+            try:
+                connection, address = server.accept()
+            except OSError:
+                return
+            with connection:
+                connection.recv(1024)
+                connection.sendall(json.dumps({'data': 'Status: Connected', 'age': 3}).encode('utf-8'))
+
+    threading.Thread(target=serve, daemon=True).start()
+    monkeypatch.setattr(nordvpn, 'SERVICE_SOCKET', path)
+    monkeypatch.setattr(nordvpn, '_spawn', lambda command, timeout, merge_stderr=False, env=None:
+                        (0, 'Status: Disconnected'))
+    yield server
+    server.close()
+
+
+def test_status_from_service(service, nordvpn):
+    assert nordvpn.get_status_text() == 'Status: Connected'
+
+
+def test_status_after_own_change(service, nordvpn):
+    # The status of the service was taken before the disconnect
+    nordvpn.nordvpn_disconnect()
+    assert nordvpn.get_status_text() == 'Status: Disconnected'
+
+
+def test_status_while_connecting(service, nordvpn):
+    nordvpn.network_state['status'] = 'connecting'
+    assert nordvpn.get_status_text() == 'Status: Disconnected'
@@ -0,0 +1,65 @@
+"""
+Coalescing and repeat suppression of the notifications.
+"""
+
+import threading
+import time
+
+import pytest
+
+from conftest import load
+
+pytest.importorskip('gi')
+notify = load('notify')
+
+
+@pytest.fixture
+def manager():
+    """
+    A notification manager that records the posts instead of showing them.
+    """
+    manager = notify.NotificationManager('test', window=0.05, repeat_interval=60)
+    manager.posts = []
+    manager.post = lambda category, title, text, icon, count=1: manager.posts.append((category, title, count))
+    thread = threading.Thread(target=manager.run, daemon=True)
+    thread.start()
+    yield manager
+    with manager.condition:
+        manager.stopped = True
+        manager.condition.notify()
+    thread.join(2)
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_repeat_suppressed(manager):
+    manager.notify('verify', 'failed')
+    assert wait_for(lambda: len(manager.posts) == 1)
+    manager.notify('verify', 'failed')
+    time.sleep(0.2)
+    assert manager.posts == [('verify', 'failed', 1)]
+    assert manager.suppressed == 1
+
+
+def test_user_action_forced(manager):
+    manager.notify('connection', 'Failed to connect', force=True)
+    assert wait_for(lambda: len(manager.posts) == 1)
+    manager.notify('connection', 'Failed to connect', force=True)
+    assert wait_for(lambda: len(manager.posts) == 2)
+
+
+def test_suppressed_repeats_expire(manager, monkeypatch):
+    manager.notify('daemon', 'unresponsive')
+    assert wait_for(lambda: len(manager.posts) == 1)
+    manager.notify('daemon', 'unresponsive')
+    assert manager.shown[('daemon', 'unresponsive', '')]['count'] == 1
+    # Much later another notification is sent
+    later = time.monotonic() + notify.FORGET_INTERVAL + 1
+    monkeypatch.setattr(notify, 'monotonic', lambda: later)
+    manager.notify('usage', 'budget')
+    assert ('daemon', 'unresponsive', '') not in manager.shown
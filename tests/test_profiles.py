@@ -0,0 +1,38 @@
+"""
+Applying connection profiles.
+"""
+
+import pytest
+
+from conftest import load
+
+pytest.importorskip('gi')
+profiles = load('profiles')
+
+
+def test_only_changes_are_applied(nordvpn, monkeypatch):
+    calls = []
+    monkeypatch.setattr(profiles, 'nordvpn_set', lambda setting, *values: calls.append((setting,) + values) or (0, ''))
+    settings = {'technology': 'openvpn', 'protocol': 'udp', 'killswitch': False}
+    assert profiles.apply_profile({'technology': 'NordLynx', 'protocol': 'TCP', 'killswitch': False}, settings)
+    assert calls == [('technology', 'NordLynx')]
+    assert settings['technology'] == 'nordlynx'
+
+
+def test_killswitch_follows_profile(nordvpn, monkeypatch):
+    monkeypatch.setattr(profiles, 'nordvpn_set', lambda setting, *values: (0, ''))
+    settings = {'killswitch': False}
+    assert profiles.apply_profile({'killswitch': 'enabled'}, settings)
+    # Disconnected with the killswitch: the API is blocked
+    assert nordvpn.network_state['killswitch'] is True
+    assert not nordvpn.api_reachable()
+    assert profiles.apply_profile({'killswitch': False}, settings)
+    assert nordvpn.api_reachable()
+
+
+def test_failed_setting(nordvpn, monkeypatch):
+    monkeypatch.setattr(profiles, 'nordvpn_set', lambda setting, *values: (1, 'error'))
+    settings = {'killswitch': False}
+    assert not profiles.apply_profile({'killswitch': True}, settings)
+    assert settings['killswitch'] is False
+    assert nordvpn.network_state['killswitch'] is False
@@ -0,0 +1,116 @@
+"""
+Speed test against a local HTTP stand-in.
+"""
+
+import http.server
+import time
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+from conftest import load, StandIn
+
+pytest.importorskip('gi')
+speedtest = load('speedtest')
+
+
+class SpeedHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        """
+        /__down?bytes=N: N zero bytes after server.delay seconds.
+        """
+        self.server.requests.append(self.path)
+        size = int(parse_qs(urlparse(self.path).query)['bytes'][0])
+        time.sleep(self.server.answers.get('delay', 0))
+        self.send_response(200)
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        chunk = bytes(64 * 1024)
+        while size > 0:
+            self.wfile.write(chunk[:size])
+            size -= len(chunk)
+
+    def do_POST(self):
+        """
+        /__up: read the body, answer after server.delay seconds.
+        """
+        self.server.requests.append(self.path)
+        size = int(self.headers['Content-Length'])
+        received = 0
+        while received < size:
+            received += len(self.rfile.read(min(size - received, 64 * 1024)))
+        self.server.answers['received'] = received
+        time.sleep(self.server.answers.get('delay', 0))
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server(nordvpn):
+    stand_in = StandIn(SpeedHandler)
+    yield stand_in
+    stand_in.stop()
+
+
+def test_upload_body():
+    assert sum(len(chunk) for chunk in speedtest.upload_body(speedtest.CHUNK_SIZE * 2 + 10)) == \
+        speedtest.CHUNK_SIZE * 2 + 10
+    times = {}
+    assert list(speedtest.upload_body(0, times)) == []
+    assert 'first' in times
+
+
+def test_latency(server):
+    ttfb, jitter = speedtest.measure_latency(server.url + '/__down?bytes={bytes}', probes=3)
+    assert len(server.requests) == 3
+    assert server.requests[0] == '/__down?bytes=0'
+    assert 0 < ttfb < 1
+    assert jitter >= 0
+
+
+def test_download_without_ttfb(server):
+    server.answers['delay'] = 0.3
+    bps, ttfb, received = speedtest.measure_download(server.url + '/__down?bytes={bytes}', 4 * 1024 * 1024)
+    assert received == 4 * 1024 * 1024
+    assert ttfb >= 0.3
+    # Measured from the first byte on: with the TTFB it would be below 112 Mbit/s
+    assert bps > 200e6
+
+
+def test_upload_without_ttfb(server):
+    server.answers['delay'] = 0.3
+    url = server.url + '/__up'
+    bps, sent = speedtest.measure_upload(url, 1024 * 1024)
+    assert sent == server.answers['received'] == 1024 * 1024
+    assert bps < 8 * 1024 * 1024 / 0.3
+    # Without the answer time of the server
+    fast, sent = speedtest.measure_upload(url, 1024 * 1024, ttfb=0.3)
+    assert fast > 3 * bps
+
+
+def test_offline(server, nordvpn):
+    nordvpn.set_online(False)
+    with pytest.raises(OSError):
+        speedtest.measure_download(server.url + '/__down?bytes={bytes}', 1024)
+    assert server.requests == []
+
+
+def test_rate_limited(server, nordvpn):
+    nordvpn.api_bucket.tokens = -10
+    with pytest.raises(nordvpn.RateLimited):
+        speedtest.measure_download(server.url + '/__down?bytes={bytes}', 1024, timeout=0.1)
+    assert server.requests == []
+
+
+def test_run_and_store(server):
+    download_url = server.url + '/__down?bytes={bytes}'
+    result = speedtest.run_speedtest('nl812', 'NordLynx', download_url, server.url + '/__up')
+    assert result['download_mbps'] > 0 and result['upload_mbps'] > 0
+    assert speedtest.get_results()['nl812']['nordlynx'][-1] == result
+    assert speedtest.get_server_summary('nl812').startswith('nordlynx ')
@@ -0,0 +1,108 @@
+"""
+Network identity from a temporary /proc/net tree and the selection of
+the technology with stand-ins for the nordvpn commands and the measurements.
+"""
+
+import threading
+import time
+
+import pytest
+
+from conftest import load
+
+pytest.importorskip('gi')
+technology = load('technology')
+
+ROUTE_HEADER = 'Iface\tDestination\tGateway\tFlags\tRefCnt\tUse\tMetric\tMask\tMTU\tWindow\tIRTT\n'
+ARP_HEADER = 'IP address       HW type     Flags       HW address            Mask     Device\n'
+
+
+def make_proc_net(path, routes, arp):
+    path.mkdir(exist_ok=True)
+    (path / 'route').write_text(ROUTE_HEADER + ''.join(
+        '{0}\t{1}\t{2}\t0003\t0\t0\t100\t{3}\t0\t0\t0\n'.format(*route) for route in routes))
+    (path / 'arp').write_text(ARP_HEADER + ''.join(
+        '{0}  0x1  0x2  {1}  *  {2}\n'.format(*entry) for entry in arp))
+    return str(path)
+
+
+def test_identity_of_gateway(tmp_path):
+    # Default route via 192.168.1.1 (little endian 0101A8C0)
+    proc_net = make_proc_net(tmp_path, [('wlan0', '0000A8C0', '00000000', '00FFFFFF'),
+                                        ('wlan0', '00000000', '0101A8C0', '00000000')],
+                             [('192.168.1.1', 'aa:bb:cc:dd:ee:ff', 'wlan0')])
+    identity = technology.get_network_identity(proc_net)
+    assert len(identity) == 16
+    # The same gateway on another network has another MAC address
+    other = make_proc_net(tmp_path / 'other', [('wlan0', '00000000', '0101A8C0', '00000000')],
+                          [('192.168.1.1', '11:22:33:44:55:66', 'wlan0')])
+    assert technology.get_network_identity(other) not in ('', identity)
+
+
+def test_identity_skips_tunnel(tmp_path):
+    # The default route of the tunnel is not the network
+    tunnel = make_proc_net(tmp_path, [('nordlynx', '00000000', '00000000', '00000000'),
+                                      ('eth0', '00000000', '0101A8C0', '00000000')],
+                           [('192.168.1.1', 'aa:bb:cc:dd:ee:ff', 'eth0')])
+    direct = make_proc_net(tmp_path / 'direct', [('eth0', '00000000', '0101A8C0', '00000000')],
+                           [('192.168.1.1', 'aa:bb:cc:dd:ee:ff', 'eth0')])
+    assert technology.get_network_identity(tunnel) == technology.get_network_identity(direct) != ''
+
+
+def test_identity_unknown(tmp_path):
+    assert technology.get_network_identity(str(tmp_path / 'missing')) == ''
+    assert technology.get_network_identity(make_proc_net(tmp_path, [], [])) == ''
+
+
+RESULTS = {'nordlynx': {'connect_seconds': 2, 'download_mbps': 50, 'jitter_ms': 5},
+           'openvpn_udp': {'connect_seconds': 4, 'download_mbps': 20, 'jitter_ms': 10}}
+
+
+@pytest.fixture
+def candidates(monkeypatch):
+    """
+    Two candidates on the server nl812, the commands and applied profiles are kept.
+    """
+    calls = []
+    monkeypatch.setattr(technology, 'get_candidates', lambda: ['nordlynx', 'openvpn_udp'])
+    monkeypatch.setattr(technology, 'get_status_dict', lambda: {'hostname': 'nl812.nordvpn.com'})
+    monkeypatch.setattr(technology, 'nordvpn_disconnect', lambda: calls.append('disconnect'))
+    monkeypatch.setattr(technology, 'apply_profile', lambda profile, settings: calls.append(profile) or True)
+    return calls
+
+
+def test_select_technology(monkeypatch, candidates):
+    servers = []
+    monkeypatch.setattr(technology, 'measure',
+                        lambda name, server, settings, url: servers.append(server) or RESULTS[name])
+    assert technology.select_technology('home', 'Netherlands', {}) == 'nordlynx'
+    # The first connected server is used for the other candidates
+    assert servers == ['Netherlands', 'nl812']
+    # Connected with the last candidate: disconnected with the settings of the winner
+    assert candidates == ['disconnect', technology.CANDIDATES['nordlynx']]
+    assert technology.get_choice('home')['name'] == 'nordlynx'
+    assert not technology.is_measuring()
+    assert not technology.is_cancelled()
+
+
+def test_cancel_between_candidates(monkeypatch, candidates):
+    measured = []
+    cancel = threading.Thread(target=technology.cancel_measurement)
+
+    def measure(name, server, settings, url):
+        measured.append(name)
+        cancel.start()
+        # The cancellation waits until the measurement stopped
+        while not technology.is_cancelled():
+            time.sleep(0.01)
+        return RESULTS[name]
+
+    monkeypatch.setattr(technology, 'measure', measure)
+    assert technology.select_technology('office', 'nl812', {}) is None
+    cancel.join(5)
+    assert not cancel.is_alive()
+    assert measured == ['nordlynx']
+    assert technology.is_cancelled()
+    assert technology.get_choice('office') is None
+    # Nothing to cancel
+    assert technology.cancel_measurement() is False
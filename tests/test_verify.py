@@ -0,0 +1,209 @@
+"""
+Connection verification against a temporary sysfs tree, temporary
+resolver lists, a UDP DNS stand-in and an insights API stand-in.
+"""
+
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from conftest import load
+
+pytest.importorskip('gi')
+verify = load('verify')
+
+
+def make_interface(sys_net, name, flags):
+    interface = sys_net / name
+    interface.mkdir(parents=True)
+    (interface / 'flags').write_text('{0:#x}\n'.format(flags))
+
+
+def test_interface_up(tmp_path):
+    make_interface(tmp_path, 'nordlynx', 0x1003)
+    assert verify.check_interface('NordLynx', str(tmp_path)) == (True, 'nordlynx')
+    assert verify.get_tunnel_interface('', str(tmp_path)) == 'nordlynx'
+
+
+def test_interface_down(tmp_path):
+    make_interface(tmp_path, 'tun0', 0x1002)
+    assert verify.check_interface('OpenVPN', str(tmp_path)) == (False, 'tun0 is down')
+    assert verify.get_tunnel_interface('OpenVPN', str(tmp_path)) == ''
+
+
+def test_interface_missing(tmp_path):
+    make_interface(tmp_path, 'eth0', 0x1003)
+    passed, detail = verify.check_interface('NordLynx', str(tmp_path))
+    assert not passed
+    assert 'no tunnel interface' in detail
+
+
+def test_routing():
+    # ip route get 1.1.1.1 answers "1.1.1.1 dev nordlynx table 205 src 10.5.0.2 ..."
+    command = ('echo', 'dev', 'nordlynx', 'table', '205')
+    assert verify.check_routing('nordlynx', command=command) == (True, '1.1.1.1 via nordlynx')
+    assert verify.check_routing('nordtun', command=command)[0] is False
+    assert verify.check_routing('', command=command) == (False, 'no tunnel interface')
+
+
+class DNSStandIn():
+    def __init__(self, rcode=0, answers=1, silent=False):
+        """
+        UDP resolver that answers every query with rcode and a number of answers.
+        """
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+        self.rcode = rcode
+        self.answers = answers
+        self.silent = silent
+        self.queries = []
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                data, address = self.sock.recvfrom(512)
+            except OSError:
+                return
+            self.queries.append(data)
+            if self.silent:
+                continue
+            # Another answer first: must be ignored
+            self.sock.sendto(struct.pack('>HHHHHH', (struct.unpack('>H', data[:2])[0] + 1) & 0xffff,
+                                         0x8180, 1, 0, 0, 0), address)
+            header = struct.pack('>HHHHHH', struct.unpack('>H', data[:2])[0], 0x8180 | self.rcode,
+                                 1, self.answers, 0, 0)
+            self.sock.sendto(header + data[12:], address)
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def resolver(request):
+    stand_in = DNSStandIn(**getattr(request, 'param', {}))
+    yield stand_in
+    stand_in.close()
+
+
+def test_dns_query():
+    query = verify.build_dns_query('nordvpn.com', 0x1234)
+    assert query[:2] == b'\x12\x34'
+    assert query[12:] == b'\x07nordvpn\x03com\x00\x00\x01\x00\x01'
+
+
+def test_dns_answered(resolver):
+    passed, detail = verify.query_dns(('127.0.0.1',), port=resolver.port, timeout=2)
+    assert passed
+    assert detail == '127.0.0.1 answered'
+    assert b'\x07nordvpn\x03com\x00' in resolver.queries[0]
+
+
+@pytest.mark.parametrize('resolver', [{'rcode': 3, 'answers': 0}], indirect=True)
+def test_dns_not_found(resolver):
+    assert verify.query_dns(('127.0.0.1',), port=resolver.port, timeout=2) == \
+        (False, '127.0.0.1: rcode 3, 0 answers')
+
+
+@pytest.mark.parametrize('resolver', [{'silent': True}], indirect=True)
+def test_dns_timeout(resolver):
+    start = time.monotonic()
+    passed, detail = verify.query_dns(('127.0.0.1',), port=resolver.port, timeout=0.5)
+    assert not passed
+    assert 'timed out' in detail
+    assert time.monotonic() - start < 1.5
+
+
+def write_resolv_conf(tmp_path, *nameservers):
+    resolv_conf = tmp_path / 'resolv.conf'
+    resolv_conf.write_text('# Generated\nsearch example.com\n' +
+                           ''.join('nameserver {0}\n'.format(address) for address in nameservers))
+    return str(resolv_conf)
+
+
+# resolvectl dns behind the stub resolver of systemd-resolved
+RESOLVECTL = ('printf', 'Global:\nLink 2 (eth0):\nLink 5 (nordlynx): 127.0.0.1%%nordlynx#dns.nordvpn.com\n')
+RESOLVECTL_LEAK = ('printf', 'Global:\nLink 2 (eth0): 192.0.2.1 192.0.2.2\nLink 5 (nordlynx): 127.0.0.1\n')
+
+
+def test_active_resolvers(tmp_path):
+    resolv_conf = write_resolv_conf(tmp_path, '192.0.2.1', '192.0.2.2')
+    assert verify.get_active_resolvers(resolv_conf, command=('false',)) == \
+        [('192.0.2.1', resolv_conf), ('192.0.2.2', resolv_conf)]
+    resolv_conf = write_resolv_conf(tmp_path, '127.0.0.53')
+    assert verify.get_active_resolvers(resolv_conf, command=RESOLVECTL_LEAK) == \
+        [('192.0.2.1', 'eth0'), ('192.0.2.2', 'eth0'), ('127.0.0.1', 'nordlynx')]
+
+
+def test_dns_through_tunnel(tmp_path, resolver):
+    resolv_conf = write_resolv_conf(tmp_path, '127.0.0.1')
+    assert verify.check_dns(expected=('127.0.0.1',), port=resolver.port, timeout=2,
+                            resolv_conf=resolv_conf) == (True, '127.0.0.1 answered')
+
+
+def test_dns_leak(tmp_path, resolver):
+    resolv_conf = write_resolv_conf(tmp_path, '127.0.0.1', '192.0.2.1')
+    assert verify.check_dns(expected=('127.0.0.1',), port=resolver.port, timeout=2,
+                            resolv_conf=resolv_conf) == \
+        (False, 'not through the tunnel: 192.0.2.1 ({0})'.format(resolv_conf))
+    assert resolver.queries == []
+
+
+def test_dns_resolved_through_tunnel(tmp_path, resolver):
+    # Resolvers of the tunnel link are expected even if they are not the NordVPN DNS servers
+    resolv_conf = write_resolv_conf(tmp_path, '127.0.0.53')
+    assert verify.check_dns('nordlynx', port=resolver.port, timeout=2, resolv_conf=resolv_conf,
+                            command=RESOLVECTL) == (True, '127.0.0.1 answered')
+    assert verify.check_dns('nordtun', port=resolver.port, timeout=2, resolv_conf=resolv_conf,
+                            command=RESOLVECTL) == (False, 'not through the tunnel: 127.0.0.1 (nordlynx)')
+
+
+def test_dns_resolved_leak(tmp_path, resolver):
+    resolv_conf = write_resolv_conf(tmp_path, '127.0.0.53')
+    assert verify.check_dns('nordlynx', port=resolver.port, timeout=2, resolv_conf=resolv_conf,
+                            command=RESOLVECTL_LEAK) == \
+        (False, 'not through the tunnel: 192.0.2.1 (eth0), 192.0.2.2 (eth0)')
+
+
+def resolve(hostname):
+    assert hostname == 'nl812.nordvpn.com'
+    return (hostname, [], ['203.0.113.12'])
+
+
+def test_exit_ip_of_server(api):
+    api.answers['/helpers/ips/insights'] = {'ip': '203.0.113.12', 'protected': True}
+    assert verify.check_exit_ip('nl812', resolve=resolve) == (True, '203.0.113.12 (nl812)')
+    assert api.requests == ['/helpers/ips/insights']
+
+
+def test_exit_ip_of_other_server(api):
+    api.answers['/helpers/ips/insights'] = {'ip': '198.51.100.7', 'protected': True}
+    assert verify.check_exit_ip('nl812', resolve=resolve) == (False, '198.51.100.7 (nl812)')
+
+
+def test_exit_ip_protected_without_server(api):
+    api.answers['/helpers/ips/insights'] = {'ip': '198.51.100.7', 'protected': False}
+    assert verify.check_exit_ip('') == (False, '198.51.100.7 (?)')
+
+
+def test_exit_ip_offline(api, nordvpn):
+    # Offline and blocked by the killswitch: the API is not asked
+    nordvpn.set_online(False)
+    assert verify.check_exit_ip('nl812', resolve=resolve) == (False, 'no answer from the NordVPN API')
+    nordvpn.set_online(True)
+    nordvpn.set_killswitch(True)
+    assert verify.check_exit_ip('nl812', resolve=resolve)[0] is False
+    assert api.requests == []
+
+
+def test_checks_within_budget():
+    results = verify.run_checks({'fast': lambda: (True, 'ok'),
+                                 'failing': lambda: 1 / 0,
+                                 'slow': lambda: time.sleep(2) or (True, 'late')}, budget=0.5)
+    assert results['fast'][:2] == (True, 'ok')
+    assert results['failing'][:2] == (False, 'division by zero')
+    assert results['slow'][:2] == (None, 'timeout')
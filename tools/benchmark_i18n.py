@@ -0,0 +1,62 @@
+#! /usr/bin/env python3
+
+"""
+Start-up cost of the translations.
+Compares loading a catalogue per module and translating all labels up
+front with the shared, lazily used catalogue of i18n.py:
+    python3 tools/benchmark_i18n.py [localedir] [language]
+"""
+
+import gettext
+import importlib
+import os
+import sys
+from os.path import abspath, dirname
+from timeit import timeit
+
+TOOLS_DIR = abspath(dirname(__file__))
+ROOT_DIR = dirname(TOOLS_DIR)
+# Modules that loaded their own catalogue
+MODULES = 4
+LABELS = ['Get a NordVPN account', 'Quick connect', 'Disconnect', 'Manual connect',
+          'Status Information', 'Rate last connection', 'poor', 'excellent']
+
+
+def benchmark(i18n, localedir=None, count=200):
+    """
+    Returns the milliseconds per start-up (per module, shared)
+    """
+    def per_module():
+        # Forget the catalogues gettext keeps, like a new process
+        gettext._translations.clear()
+        for i in range(MODULES):
+            t = gettext.translation(i18n.APPINDICATOR_ID, localedir, fallback=True).gettext
+        for label in LABELS:
+            t(label)
+
+    def shared():
+        gettext._translations.clear()
+        i18n._translation = None
+        i18n.get_translation(localedir)
+        # Only the menu labels are translated at start-up
+        for label in LABELS[1:4]:
+            i18n._(label)
+
+    old = timeit(per_module, number=count) / count * 1000
+    new = timeit(shared, number=count) / count * 1000
+    return (old, new)
+
+
+def main():
+    if len(sys.argv) > 2:
+        os.environ['LANGUAGE'] = sys.argv[2]
+    sys.path.insert(0, ROOT_DIR)
+    i18n = importlib.import_module('nordvpn-indicator.i18n')
+    old, new = benchmark(i18n, sys.argv[1] if len(sys.argv) > 1 else None)
+    print('Per module catalogues: {0:.3f} ms'.format(old))
+    print('Shared lazy catalogue: {0:.3f} ms'.format(new))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
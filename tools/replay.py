@@ -0,0 +1,399 @@
+#! /usr/bin/env python3
+
+"""
+Replay a recorded session on a virtual clock.
+Record a session with "record_file" in indicator.json, then:
+    python3 tools/replay.py session.jsonl --speed 1000 --repeat 7
+A day connected, a disconnect and a night disconnected, with the polling
+budget of STATUS_INTERVALS (2 status checks per minute when stable):
+    python3 tools/replay.py tools/sessions/day.jsonl --speed 0 --max-wakeups 150
+The indicator (its status checks, connection changes and network
+changes, with the user interface and the monitors stubbed) runs against
+the recorded nordvpn answers: the answer of a command is the last one that
+was recorded for that command at or before the virtual time, and the
+virtual clock advances with the recorded duration of the command.
+The user's connect/disconnect commands and the network changes are
+replayed at their recorded times.
+Reported: polling cost (commands and wakeups per hour), transition
+latency (recorded state change until the indicator shows it) and missed
+transitions.
+Dependencies: python3-gi (the package is imported, no display is needed)
+Exit codes: 0: within budget, 1: budget exceeded, 2: cannot load
+"""
+
+import argparse
+import importlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from bisect import bisect_right
+from os.path import abspath, dirname, join
+from time import monotonic, sleep
+
+TOOLS_DIR = abspath(dirname(__file__))
+ROOT_DIR = dirname(TOOLS_DIR)
+# Commands of the user (replayed as input, not as answers)
+ACTIONS = (('nordvpn', 'c'), ('nordvpn', 'd'))
+# Seconds between repetitions of the recording
+REPEAT_GAP = 60
+
+
+def load_recording(path, repeat=1):
+    """
+    Load the events of a recording, sorted by start time.
+    repeat: play the recording this number of times back to back
+    """
+    events = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                events.append(json.loads(line))
+    if not events:
+        raise ValueError('{0} is empty'.format(path))
+    events.sort(key=lambda event: event['start'])
+    first = events[0]['start']
+    span = events[-1]['start'] + events[-1].get('duration', 0) - first + REPEAT_GAP
+    repeated = []
+    for n in range(repeat):
+        for event in events:
+            repeated.append(dict(event, start=event['start'] - first + n * span))
+    return repeated
+
+
+def is_action(event):
+    """
+    Input of the user or the system: connection and network changes.
+    """
+    return event['kind'] == 'network' or tuple(event['command'][:2]) in ACTIONS
+
+
+class VirtualClock():
+    def __init__(self, speed=1000):
+        """
+        Virtual seconds since the start of the recording.
+        speed: virtual seconds per real second (0: as fast as possible)
+        """
+        self.now = 0.0
+        self.speed = speed
+        self.real_start = monotonic()
+
+    def time(self):
+        return self.now
+
+    def advance_to(self, when):
+        """
+        Move the clock forward (never back), pacing it when a speed is set.
+        """
+        if when <= self.now:
+            return
+        if self.speed:
+            delay = self.real_start + when / self.speed - monotonic()
+            if delay > 0:
+                sleep(delay)
+        self.now = when
+
+    def advance(self, seconds):
+        self.advance_to(self.now + seconds)
+
+
+class Replayer():
+    def __init__(self, events, clock):
+        """
+        The recorded answers per command.
+        """
+        self.clock = clock
+        # command: (start times, events)
+        self.answers = {}
+        for event in events:
+            if event['kind'] == 'command':
+                times, answers = self.answers.setdefault(tuple(event['command']), ([], []))
+                times.append(event['start'])
+                answers.append(event)
+        self.counts = {}
+        self.unmatched = {}
+
+    def execute(self, command, timeout=10, merge_stderr=False, env=None):
+        """
+        Replacement of nordvpn._spawn.
+        """
+        key = tuple(command)
+        name = ' '.join(command[:2])
+        if key not in self.answers:
+            self.unmatched[name] = self.unmatched.get(name, 0) + 1
+            raise FileNotFoundError('not recorded: {0}'.format(' '.join(command)))
+        self.counts[name] = self.counts.get(name, 0) + 1
+        times, answers = self.answers[key]
+        index = max(0, bisect_right(times, self.clock.time()) - 1)
+        answer = answers[index]
+        if answer['returncode'] is None:
+            self.clock.advance(timeout)
+            raise subprocess.TimeoutExpired(command, timeout)
+        self.clock.advance(answer.get('duration', 0))
+        return (answer['returncode'], answer['output'])
+
+
+def get_recorded_states(events, parse):
+    """
+    The connection states of the recording: [(time, state)] on change.
+    """
+    states = []
+    for event in events:
+        if event['kind'] == 'network':
+            state = None if event['online'] else 'no_internet'
+        elif event['command'][:2] == ['nordvpn', 'status'] and event['returncode'] is not None:
+            state = parse(event['output'])
+        else:
+            continue
+        if state is not None and (not states or states[-1][1] != state):
+            states.append((event['start'], state))
+    return states
+
+
+def get_latencies(recorded, observed):
+    """
+    Latency of every recorded state change until the indicator showed it.
+    The indicator must show the state after the previous recorded change
+    and before the next one. It can be ahead of the daemon (connecting
+    is shown at the click): latency 0.
+    Returns (latencies, missed changes)
+    """
+    latencies = []
+    missed = []
+    for n, (start, state) in enumerate(recorded):
+        begin = recorded[n - 1][0] if n > 0 else 0.0
+        end = recorded[n + 1][0] if n + 1 < len(recorded) else float('inf')
+        seen = [when for when, observed_state in observed if observed_state == state and begin <= when <= end]
+        if seen:
+            latencies.append(max(0.0, seen[0] - start))
+        else:
+            missed.append((start, state))
+    return (latencies, missed)
+
+
+class Stub():
+    """
+    Stands in for a user interface object or a monitor: every attribute
+    is the stub itself, every call returns it.
+    """
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+    def __getattr__(self, name):
+        return self
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+
+class Immediate():
+    """
+    Stands in for GLib in the package: idle callbacks run at once.
+    """
+    def idle_add(self, callback, *args):
+        callback(*args)
+        return 1
+
+
+class ObservedIcons():
+    def __init__(self, clock):
+        """
+        Stands in for the IconSet: keeps the shown connection states.
+        """
+        self.clock = clock
+        self.state = None
+        # [(time, state)] on change
+        self.observed = []
+
+    def set_state(self, state):
+        if self.state is not None and state != self.state:
+            self.observed.append((self.clock.time(), state))
+        self.state = state
+
+    def stop_animation(self):
+        pass
+
+
+class RecordingNotifier():
+    def __init__(self, *args):
+        """
+        Stands in for the NotificationManager: keeps the notifications.
+        """
+        self.notifications = []
+
+    def notify(self, kind, title, text='', icon='', force=False):
+        self.notifications.append((kind, title, text))
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+def build_indicator(package, clock):
+    """
+    The real NordVPNIndicator with the user interface, the monitors and the
+    verification stubbed, on a virtual scheduler that runs only the status
+    checks (the other tasks ask the API).
+    Returns (indicator, observed icons)
+    """
+    class VirtualScheduler(package.scheduler.Scheduler):
+        def __init__(scheduler):
+            super().__init__(clock.time)
+            scheduler.due = None
+
+        def register(scheduler, name, callback, intervals, threaded=True):
+            if name == 'status':
+                super().register(name, callback, intervals, threaded=False)
+
+        def add_timer(scheduler, delay):
+            # Second timers are rounded down, like GLib.timeout_add_seconds
+            scheduler.due = clock.time() + (int(delay) if delay >= 1 else delay)
+            return 1
+
+        def remove_timer(scheduler, timer_id):
+            scheduler.due = None
+
+        def wakeup(scheduler):
+            scheduler.due = None
+            scheduler._on_wakeup()
+
+    class ReplayIndicator(package.NordVPNIndicator):
+        def build_menu(self):
+            return None
+
+        def run_verify(self):
+            # The checks need the tunnel of the recording
+            pass
+
+    icons = ObservedIcons(clock)
+    package.GLib = Immediate()
+    package.AppIndicator3 = Stub()
+    package.IconSet = lambda *args: icons
+    package.NotificationManager = RecordingNotifier
+    package.NetworkMonitor = lambda *args, **kwargs: Stub(active=True)
+    package.PowerMonitor = lambda *args, **kwargs: Stub(low_power=False)
+    package.Scheduler = VirtualScheduler
+    return (ReplayIndicator(), icons)
+
+
+def run_action(indicator, event):
+    """
+    Replay a network change or a connect/disconnect of the user.
+    """
+    if event['kind'] == 'network':
+        indicator.network_monitor.active = event['online']
+        # Back online: checked at once, like after a resume
+        indicator.on_network_changed(event['online'], event['online'])
+    elif event['command'][1] == 'c' and len(event['command']) > 2:
+        indicator.run_change_connection(server=event['command'][2], connect=True)
+    elif event['command'][1] == 'c':
+        indicator.run_change_connection(connect=True, quick=True)
+    else:
+        indicator.run_change_connection(connect=False)
+
+
+def replay(events, clock, package, nordvpn):
+    """
+    Run the indicator over the recording.
+    Returns the report dictionary
+    """
+    replayer = Replayer(events, clock)
+    nordvpn._spawn = replayer.execute
+    # The daemon watchdog backs off on the virtual clock
+    nordvpn.watchdog.clock = clock.time
+    # Memoized answers expire on the virtual clock too
+    nordvpn.single_flight.clock = clock.time
+    indicator, icons = build_indicator(package, clock)
+    scheduler = indicator.scheduler
+    actions = [event for event in events if is_action(event)]
+    end = events[-1]['start'] + events[-1].get('duration', 0)
+    real_start = monotonic()
+    index = 0
+    while True:
+        next_action = actions[index]['start'] if index < len(actions) else None
+        due = scheduler.due
+        if next_action is not None and (due is None or next_action <= due):
+            clock.advance_to(next_action)
+            run_action(indicator, actions[index])
+            index += 1
+        elif due is not None and due <= end:
+            clock.advance_to(due)
+            scheduler.wakeup()
+        else:
+            break
+    clock.advance_to(end)
+    wakeups = scheduler.wakeups
+    indicator.shutdown()
+    recorded = get_recorded_states(events, nordvpn.parse_connection_status)
+    latencies, missed = get_latencies(recorded, icons.observed)
+    hours = clock.time() / 3600 or 1
+    return {'virtual_hours': round(clock.time() / 3600, 2),
+            'real_seconds': round(monotonic() - real_start, 2),
+            'wakeups_per_hour': round(wakeups / hours, 1),
+            'commands_per_hour': {name: round(count / hours, 1) for name, count in sorted(replayer.counts.items())},
+            'unmatched_commands': replayer.unmatched,
+            'action_failures': len([kind for kind, title, text in indicator.notifier.notifications
+                                    if kind == 'connection']),
+            'recorded_changes': len(recorded),
+            'observed_changes': len(icons.observed),
+            'missed_changes': [{'time': round(when, 1), 'state': state} for when, state in missed],
+            'latency_mean': round(sum(latencies) / len(latencies), 2) if latencies else None,
+            'latency_max': round(max(latencies), 2) if latencies else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded NordVPN indicator session on a virtual clock.')
+    parser.add_argument('recording', help='JSON lines file written with "record_file"')
+    parser.add_argument('--speed', type=float, default=1000, help='virtual seconds per real second (0: unpaced)')
+    parser.add_argument('--repeat', type=int, default=1, help='play the recording this number of times')
+    parser.add_argument('--max-latency', type=float, default=0, help='transition latency budget in seconds (0: none)')
+    parser.add_argument('--max-wakeups', type=float, default=0, help='wakeups per hour budget (0: none)')
+    parser.add_argument('--max-missed', type=int, default=-1, help='missed transitions budget (-1: none)')
+    parser.add_argument('--report', help='write the report as JSON to this file')
+    args = parser.parse_args()
+
+    try:
+        events = load_recording(args.recording, args.repeat)
+    except (OSError, ValueError, KeyError) as e:
+        print('Cannot load {0}: {1}'.format(args.recording, e), file=sys.stderr)
+        return 2
+
+    # Isolated home: the replay must not touch the user's configuration and caches
+    work_dir = tempfile.mkdtemp(prefix='nordvpn-replay-')
+    os.makedirs(join(work_dir, '.config', 'nordvpn'))
+    os.environ['HOME'] = work_dir
+    try:
+        sys.path.insert(0, ROOT_DIR)
+        package = importlib.import_module('nordvpn-indicator')
+        nordvpn = importlib.import_module('nordvpn-indicator.nordvpn')
+        # Never ask a running cache service
+        nordvpn.SERVICE_SOCKET = join(work_dir, 'no-service.sock')
+        report = replay(events, VirtualClock(args.speed), package, nordvpn)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(json.dumps(report, indent=2))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    violations = []
+    if args.max_latency and report['latency_max'] is not None and report['latency_max'] > args.max_latency:
+        violations.append('transition latency {0} s > {1} s'.format(report['latency_max'], args.max_latency))
+    if args.max_wakeups and report['wakeups_per_hour'] > args.max_wakeups:
+        violations.append('{0} wakeups per hour > {1}'.format(report['wakeups_per_hour'], args.max_wakeups))
+    if args.max_missed >= 0 and len(report['missed_changes']) > args.max_missed:
+        violations.append('{0} missed transitions > {1}'.format(len(report['missed_changes']), args.max_missed))
+    for violation in violations:
+        print('FAIL: {0}'.format(violation))
+    if not violations:
+        print('OK')
+    return 1 if violations else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,345 @@
+#! /usr/bin/env python3
+
+"""
+Soak test and memory-leak detector for the indicator.
+Runs the indicator headless (Xvfb, private session and system buses,
+fake nordvpn command line interface and a local fake NordVPN API) and
+cycles thousands of connection changes and dialog opens.
+RSS, Python allocations (tracemalloc), live GObjects and threads are
+sampled; the test fails when their growth after the warm-up exceeds
+the budget. Threads are counted in the steady state: after the short
+lived workers (scheduler tasks, connection changes) finished.
+    python3 tools/soak.py --cycles 5000 --dialog-every 25
+Dependencies: xvfb, dbus, python3-gi and the indicator dependencies
+Exit codes: 0: within budget, 1: budget exceeded, 2: cannot start
+"""
+
+import argparse
+import gc
+import http.server
+import importlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import tracemalloc
+from os.path import abspath, dirname, join
+from time import monotonic, sleep
+
+TOOLS_DIR = abspath(dirname(__file__))
+ROOT_DIR = dirname(TOOLS_DIR)
+# Seconds to wait for the short lived worker threads before counting
+WORKER_TIMEOUT = 5
+STATES = ['Connecting', 'Connected', 'Disconnecting', 'Disconnected']
+COUNTRIES = [{'id': 21, 'name': 'Belgium', 'code': 'BE',
+              'cities': [{'name': 'Brussels', 'latitude': 50.85, 'longitude': 4.35}]},
+             {'id': 81, 'name': 'Germany', 'code': 'DE',
+              'cities': [{'name': 'Frankfurt', 'latitude': 50.11, 'longitude': 8.68}]},
+             {'id': 153, 'name': 'Netherlands', 'code': 'NL',
+              'cities': [{'name': 'Amsterdam', 'latitude': 52.37, 'longitude': 4.89}]},
+             {'id': 228, 'name': 'United States', 'code': 'US',
+              'cities': [{'name': 'New York', 'latitude': 40.71, 'longitude': -74.01}]}]
+SERVERS = [{'hostname': 'nl{0}.nordvpn.com'.format(n), 'load': n,
+            'locations': [{'latitude': 52.37, 'longitude': 4.89,
+                           'country': {'name': 'Netherlands', 'code': 'NL'}}],
+            'technologies': [{'identifier': 'wireguard_udp'}]} for n in range(1, 11)]
+
+
+class FakeAPI(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        """
+        Answer the API calls of nordvpn.py.
+        """
+        path = self.path.split('?')[0]
+        if path.endswith('/servers/countries'):
+            body = COUNTRIES
+        elif path.endswith('/servers/recommendations'):
+            body = SERVERS
+        else:
+            self.send_error(404)
+            return
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def setup_environment(work_dir):
+    """
+    Isolated home, fake nordvpn, fake API, display, session bus and a
+    private bus in place of the system bus (no NetworkManager or UPower
+    on it: the monitors assume online and on AC).
+    Returns (the started helper processes, the private bus address).
+    """
+    processes = []
+    home = join(work_dir, 'home')
+    os.makedirs(join(home, '.config', 'nordvpn'))
+    os.environ['HOME'] = home
+    os.environ['FAKE_NORDVPN_DIR'] = join(work_dir, 'fake-nordvpn')
+    os.environ['PATH'] = '{0}:{1}'.format(TOOLS_DIR, os.environ.get('PATH', ''))
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FakeAPI)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with open(join(home, '.config', 'nordvpn', 'indicator.json'), 'w') as f:
+        json.dump({'has_account': True,
+                   'api_url': 'http://127.0.0.1:{0}/v1'.format(server.server_address[1])}, f)
+    set_fake_status('Disconnected', loggedin=True)
+
+    if not os.environ.get('DISPLAY'):
+        if not shutil.which('Xvfb'):
+            sys.exit('Xvfb is needed when there is no display')
+        display = ':{0}'.format(90 + os.getpid() % 100)
+        processes.append(subprocess.Popen(['Xvfb', display, '-screen', '0', '1024x768x24', '-nolisten', 'tcp'],
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        os.environ['DISPLAY'] = display
+        sleep(1)
+    if not os.environ.get('DBUS_SESSION_BUS_ADDRESS') and shutil.which('dbus-daemon'):
+        process = subprocess.Popen(['dbus-daemon', '--session', '--nofork', '--print-address'],
+                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        os.environ['DBUS_SESSION_BUS_ADDRESS'] = process.stdout.readline().decode('utf-8').strip()
+        processes.append(process)
+    bus_address = None
+    if shutil.which('dbus-daemon'):
+        process = subprocess.Popen(['dbus-daemon', '--session', '--nofork', '--print-address'],
+                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        bus_address = process.stdout.readline().decode('utf-8').strip()
+        processes.append(process)
+    return (processes, bus_address)
+
+
+def set_fake_status(status, loggedin=None):
+    """
+    Change the state of the fake nordvpn command.
+    """
+    state_dir = os.environ['FAKE_NORDVPN_DIR']
+    state_file = join(state_dir, 'state.json')
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {'loggedin': True, 'server': '',
+                 'settings': {'Technology': 'NordLynx', 'Firewall': 'enabled',
+                              'Kill Switch': 'disabled', 'CyberSec': 'disabled',
+                              'Notify': 'enabled', 'Auto-connect': 'disabled',
+                              'DNS': 'disabled'}}
+    if loggedin is not None:
+        state['loggedin'] = loggedin
+    state['status'] = status
+    state['server'] = 'nl1' if status == 'Connected' else ''
+    os.makedirs(state_dir, exist_ok=True)
+    with open(state_file + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(state_file + '.tmp', state_file)
+
+
+def read_rss():
+    """
+    Resident set size in KiB.
+    """
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+class Soak():
+    def __init__(self, args, bus_address=None):
+        """
+        Start the indicator in this process.
+        bus_address: private bus for the network and power monitors
+        """
+        import gi
+        gi.require_version('Gtk', '3.0')
+        from gi.repository import Gtk, GLib, GObject
+        self.Gtk, self.GLib, self.GObject = Gtk, GLib, GObject
+        self.args = args
+        sys.path.insert(0, ROOT_DIR)
+        self.package = importlib.import_module('nordvpn-indicator')
+        self.package.setup_logging(join(os.environ['HOME'], '.config', 'nordvpn'), level='WARNING')
+        self.indicator = self.package.NordVPNIndicator(system_bus_address=bus_address)
+        self.samples = []
+
+    def pump(self, seconds=0.0):
+        """
+        Run the GTK main loop without blocking.
+        """
+        deadline = monotonic() + seconds
+        while True:
+            while self.Gtk.events_pending():
+                self.Gtk.main_iteration_do(False)
+            if monotonic() >= deadline:
+                break
+            sleep(0.005)
+
+    def close_dialogs(self):
+        """
+        Cancel the open dialogs (runs inside Gtk.Dialog.run).
+        """
+        closed = False
+        for window in self.Gtk.Window.list_toplevels():
+            if isinstance(window, self.Gtk.Dialog) and window.get_visible():
+                window.response(self.Gtk.ResponseType.CANCEL)
+                closed = True
+        # Try again until the dialog is shown
+        return not closed
+
+    def open_dialogs(self):
+        """
+        Open and cancel every dialog once.
+        """
+        connect = importlib.import_module('nordvpn-indicator.connect')
+        settings = importlib.import_module('nordvpn-indicator.settings')
+        logviewer = importlib.import_module('nordvpn-indicator.logviewer')
+        for show in (lambda: connect.NordVPNConnect().show_connect(),
+                     lambda: settings.NordVPNSettings(self.indicator.current_settings).show_settings(),
+                     lambda: logviewer.NordVPNLogViewer().show_logs()):
+            self.GLib.timeout_add(20, self.close_dialogs)
+            show()
+            self.pump()
+
+    def count_gobjects(self):
+        """
+        Live GObject wrappers.
+        """
+        gc.collect()
+        return sum(1 for obj in gc.get_objects() if isinstance(obj, self.GObject.Object))
+
+    def count_threads(self):
+        """
+        Threads in the steady state: wait (running the main loop) until the
+        short lived workers finished. Workers still running after
+        WORKER_TIMEOUT seconds are counted.
+        """
+        deadline = monotonic() + WORKER_TIMEOUT
+        while monotonic() < deadline and any(thread.name.startswith('Thread-')
+                                             for thread in threading.enumerate()):
+            self.pump(0.05)
+        return threading.active_count()
+
+    def sample(self, cycle):
+        """
+        Take a measurement.
+        """
+        self.pump()
+        sample = {'cycle': cycle,
+                  'rss_kib': read_rss(),
+                  'py_kib': tracemalloc.get_traced_memory()[0] // 1024,
+                  'gobjects': self.count_gobjects(),
+                  'threads': self.count_threads()}
+        self.samples.append(sample)
+        if self.args.verbose:
+            print(json.dumps(sample), flush=True)
+        return sample
+
+    def run(self):
+        """
+        Cycle the connection states and dialogs.
+        Returns the list of budget violations.
+        """
+        args = self.args
+        tracemalloc.start(args.frames)
+        baseline = None
+        snapshot = None
+        for cycle in range(args.warmup + args.cycles):
+            status = STATES[cycle % len(STATES)]
+            set_fake_status(status)
+            if cycle % args.check_every == 0:
+                # Through the command line, like the scheduler does
+                self.indicator.run_check()
+            else:
+                self.indicator.set_connection(status.lower())
+            self.pump(args.delay)
+            if args.dialog_every and cycle % args.dialog_every == 0:
+                self.open_dialogs()
+            if cycle == args.warmup:
+                baseline = self.sample(cycle)
+                snapshot = tracemalloc.take_snapshot()
+            elif cycle > args.warmup and (cycle - args.warmup) % args.sample_every == 0:
+                self.sample(cycle)
+        final = self.sample(args.warmup + args.cycles)
+        final_snapshot = tracemalloc.take_snapshot()
+
+        growth = {key: final[key] - baseline[key] for key in ('rss_kib', 'py_kib', 'gobjects', 'threads')}
+        budget = {'rss_kib': args.max_rss * 1024, 'py_kib': args.max_py * 1024,
+                  'gobjects': args.max_gobjects, 'threads': args.max_threads}
+        print('Growth over {0} cycles: {1}'.format(args.cycles, json.dumps(growth)))
+        violations = ['{0} grew by {1} (budget {2})'.format(key, growth[key], budget[key])
+                      for key in budget if growth[key] > budget[key]]
+        if violations or args.verbose:
+            print('Largest Python allocation growth:')
+            for stat in final_snapshot.compare_to(snapshot, 'traceback')[:args.top]:
+                print('  {0}'.format(stat))
+                for line in stat.traceback.format()[-4:]:
+                    print('    {0}'.format(line))
+        if args.report:
+            with open(args.report, 'w') as f:
+                json.dump({'samples': self.samples, 'growth': growth,
+                           'budget': budget, 'violations': violations}, f, indent=4)
+        return violations
+
+    def stop(self):
+        """
+        Stop the indicator's timers and threads.
+        """
+        self.indicator.shutdown()
+        self.package.stop_logging()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Soak test the NordVPN indicator and fail on leaks.')
+    parser.add_argument('--cycles', type=int, default=2000, help='measured state changes')
+    parser.add_argument('--warmup', type=int, default=200, help='state changes before the baseline')
+    parser.add_argument('--dialog-every', type=int, default=50, help='open the dialogs every N cycles (0: never)')
+    parser.add_argument('--check-every', type=int, default=10, help='check through the nordvpn command every N cycles')
+    parser.add_argument('--sample-every', type=int, default=250, help='sample every N cycles')
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds to run the main loop per cycle')
+    parser.add_argument('--max-rss', type=float, default=16, help='RSS growth budget (MiB)')
+    parser.add_argument('--max-py', type=float, default=2, help='Python allocation growth budget (MiB)')
+    parser.add_argument('--max-gobjects', type=int, default=100, help='live GObject growth budget')
+    parser.add_argument('--max-threads', type=int, default=0, help='steady state thread count growth budget')
+    parser.add_argument('--frames', type=int, default=10, help='tracemalloc traceback depth')
+    parser.add_argument('--top', type=int, default=10, help='allocation sites to show')
+    parser.add_argument('--report', help='write the samples as JSON to this file')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary home directory')
+    parser.add_argument('-v', '--verbose', action='store_true', help='print every sample')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='nordvpn-soak-')
+    processes, bus_address = setup_environment(work_dir)
+    soak = None
+    try:
+        try:
+            soak = Soak(args, bus_address)
+        except Exception as e:
+            print('Cannot start the indicator: {0}'.format(e), file=sys.stderr)
+            return 2
+        violations = soak.run()
+    finally:
+        if soak is not None:
+            soak.stop()
+        for process in processes:
+            process.terminate()
+            process.wait()
+        if args.keep:
+            print('Kept {0}'.format(work_dir))
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    for violation in violations:
+        print('FAIL: {0}'.format(violation))
+    if not violations:
+        print('OK')
+    return 1 if violations else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())